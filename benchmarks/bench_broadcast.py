@@ -0,0 +1,93 @@
+"""
+benchmarks/bench_broadcast.py
+
+Broadcast throughput against the local fake Bot API (benchmarks/fake_bot_api.py),
+which answers after LATENCY seconds and returns 429 above 30 msg/s or more than
+one message per second into a chat.
+
+- sequential: the old handler loop, one awaited send_message per user
+- unthrottled: every send at once, what naive concurrency does to flood limits
+- run_broadcast: the engine (worker pool + token bucket + per-chat limiter)
+- run_broadcast with sticker + text: two calls per chat, spaced by the per-chat limiter
+  (what broadcasts did before BROADCAST_WITH_STICKER defaulted to off)
+- run_broadcast with a captioned photo by cached file_id: one call per chat
+
+Run from the repo root:  python benchmarks/bench_broadcast.py [users] [latency_seconds]
+"""
+import sys
+import time
+import asyncio
+
+import seed  # noqa: F401  (project path and a throwaway DATABASE_URL)
+
+from fake_bot_api import FakeBotAPI
+from broadcast import run_broadcast, text_payload, media_spec, payload_from_dict
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+CHAT_IDS = list(range(10_000_001, 10_000_001 + USERS))
+
+
+async def sequential(bot) -> int:
+    sent = 0
+    for chat_id in CHAT_IDS:
+        try:
+            await bot.send_message(chat_id, "Salom")
+            sent += 1
+        except Exception:
+            pass
+    return sent
+
+
+async def unthrottled(bot) -> int:
+    results = await asyncio.gather(*(bot.send_message(c, "Salom") for c in CHAT_IDS), return_exceptions=True)
+    return sum(1 for r in results if not isinstance(r, Exception))
+
+
+async def engine(bot) -> int:
+    async def chat_ids():
+        for chat_id in CHAT_IDS:
+            yield chat_id
+    stats = await run_broadcast(bot, chat_ids(), text_payload("Salom"))
+    return stats.sent
+
+
+async def engine_with_sticker(bot) -> int:
+    async def chat_ids():
+        for chat_id in CHAT_IDS:
+            yield chat_id
+    stats = await run_broadcast(bot, chat_ids(), text_payload("Salom", sticker="CAACAgIAAxkBAAE"))
+    return stats.sent
+
+
+async def engine_with_photo(bot) -> int:
+    async def chat_ids():
+        for chat_id in CHAT_IDS:
+            yield chat_id
+    spec = media_spec("photo", "AgACAgIAAxkBAAE-cached-file-id", caption="Salom")
+    stats = await run_broadcast(bot, chat_ids(), payload_from_dict(spec))
+    return stats.sent
+
+
+async def main():
+    print(f"{USERS} recipients, fake API latency {LATENCY * 1000:.0f} ms, limit 30 msg/s")
+    async with FakeBotAPI(latency=LATENCY) as api:
+        bot = api.bot()
+        try:
+            for label, fn in (("sequential", sequential), ("unthrottled", unthrottled), ("run_broadcast", engine),
+                              ("+ sticker", engine_with_sticker), ("photo file_id", engine_with_photo)):
+                api.reset()
+                # let the server's one-second flood window drain between runs
+                await asyncio.sleep(1.1)
+                t0 = time.perf_counter()
+                sent = await fn(bot)
+                elapsed = time.perf_counter() - t0
+                print(f"{label:<14} delivered {sent:>6}/{USERS}  {elapsed:7.2f}s  "
+                      f"{sent / elapsed:6.1f} chats/s  {sum(api.sent_to.values()) / elapsed:6.1f} msg/s  "
+                      f"429s: {api.flood_errors}")
+        finally:
+            await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
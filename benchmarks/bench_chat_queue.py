@@ -0,0 +1,199 @@
+"""
+benchmarks/bench_chat_queue.py
+
+A burst instead of people tapping one step at a time: every update of the
+loadtest.py scenario for every user is queued on the fake Bot API at once
+(step by step across the users, so each chat's updates arrive in order but
+interleaved with everyone else's), and the production dispatcher long-polls
+them. Two builds run side by side in subprocesses:
+
+    task per update   UPDATE_MAX_CONCURRENT=0: aiogram's task per update
+    per-chat queue    middlewares/chat_queue.py, UPDATE_MAX_CONCURRENT=16
+
+both with UPDATE_MAX_PENDING=200, so the burst overflows the queue.
+
+Checks (per-chat queue):
+- each chat's updates ran one at a time, in update_id order, and every user
+  ends with one receipt under review and one question (loadtest.check_db);
+- no more than UPDATE_MAX_CONCURRENT updates ran at once and no more than
+  UPDATE_MAX_PENDING were accepted at once; intake waited (backpressure);
+- the queue gauges are back to 0 and /metrics has the queue wait of every
+  update;
+- no update raised;
+- a 3-item album the admin sends to the broadcast prompt becomes one
+  broadcast job with all 3 items (in both builds).
+
+Run from the repo root:  python benchmarks/bench_chat_queue.py [users]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict
+
+import seed
+
+MODES = {"task per update": "0", "per-chat queue": "16"}
+MAX_PENDING = 200
+# set for the subprocess that measures one build; loadtest.py owns the command line
+MODE = os.environ.get("BENCH_QUEUE_MODE")
+if MODE:
+    os.environ["UPDATE_MAX_CONCURRENT"] = MODES[MODE]
+    os.environ["UPDATE_MAX_PENDING"] = str(MAX_PENDING)
+os.environ["METRICS_PORT"] = "0"
+
+
+async def measure() -> Dict[str, Any]:
+    # loadtest first: it sets the fake token and staff ids before config is read
+    from loadtest import (SCENARIO, TG_OFFSET, UPDATE_IDS, USERS, bot, dp, storage, setup_dispatcher, check_db,
+                          message)
+    import datetime as dt
+    from aiogram import BaseMiddleware
+
+    from config import ALBUM_COLLECT_SECONDS
+    from db import list_broadcast_jobs
+    from handlers.admin.broadcast import BroadcastStates
+    from segments import Segment
+
+    from db_engine import dispose_engines
+    from fake_bot_api import FakeBotAPI
+    from middlewares import polling_options
+    from middlewares.chat_queue import update_chat_key
+    from middlewares.metrics import metrics
+
+    class InFlight(BaseMiddleware):
+        """Updates running at once, queue depth seen meanwhile, and per-chat overlap and order."""
+
+        def __init__(self):
+            self.running = self.peak = self.peak_depth = 0
+            self.by_chat: Dict[int, int] = defaultdict(int)
+            self.last_id: Dict[int, int] = {}
+            self.overlaps = self.reordered = 0
+
+        async def __call__(self, handler, event, data):
+            chat = update_chat_key(event)
+            self.overlaps += self.by_chat[chat] > 0
+            self.reordered += self.last_id.get(chat, 0) > event.update_id
+            self.last_id[chat] = max(self.last_id.get(chat, 0), event.update_id)
+            self.by_chat[chat] += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.peak_depth = max(self.peak_depth, metrics.queue_depth)
+            try:
+                return await handler(event, data)
+            finally:
+                self.running -= 1
+                self.by_chat[chat] -= 1
+
+    async with FakeBotAPI(latency=0.02, global_rate=None, per_chat_interval=None) as api:
+        probe = setup_dispatcher(api)
+        inflight = InFlight()
+        dp.update.outer_middleware(inflight)
+        loop = asyncio.get_running_loop()
+        waiters = []
+        for step, build in SCENARIO:
+            for u in range(TG_OFFSET + 1, TG_OFFSET + USERS + 1):
+                update_id = next(UPDATE_IDS)
+                waiters.append(probe.waiters.setdefault(update_id, loop.create_future()))
+                api.push_update({"update_id": update_id, **build(u, len(waiters))})
+
+        t0 = time.perf_counter()
+        polling = asyncio.create_task(dp.start_polling(bot, polling_timeout=1, handle_signals=False,
+                                                       close_bot_session=False, **polling_options(dp)))
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters), 300)
+            elapsed = time.perf_counter() - t0
+            db_ok = await check_db(TG_OFFSET)
+
+            # the admin (ADMIN_ID=1) sends an album of 3 photos to the broadcast prompt; nobody joined in 2100
+            context = dp.fsm.get_context(bot, chat_id=1, user_id=1)
+            await context.set_state(BroadcastStates.text)
+            await context.update_data(segment=Segment(joined_from=dt.datetime(2100, 1, 1)).to_dict())
+            before = {job["id"] for job in await list_broadcast_jobs(limit=100)}
+            for i in range(3):
+                photo = [{"file_id": f"album-{i}", "file_unique_id": f"a{i}", "width": 800, "height": 600}]
+                api.push_update({"update_id": next(UPDATE_IDS),
+                                 **message(1, 10 ** 6 + i, media_group_id="bench-album", photo=photo)})
+            jobs, deadline = [], time.perf_counter() + ALBUM_COLLECT_SECONDS + 10
+            while not jobs and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+                jobs = [job for job in await list_broadcast_jobs(limit=100) if job["id"] not in before]
+            album = [len(job["payload"].get("items", [job["payload"]])) for job in jobs]
+        finally:
+            await dp.stop_polling()
+            await asyncio.gather(polling, return_exceptions=True)
+            await storage.close()
+            await bot.session.close()
+            await dispose_engines()
+        rendered = metrics.render()
+        return {
+            "updates": len(waiters),
+            "elapsed": elapsed,
+            "errors": probe.errors,
+            "db_ok": db_ok,
+            "peak_running": inflight.peak,
+            "peak_depth": inflight.peak_depth,
+            "overlaps": inflight.overlaps,
+            "reordered": inflight.reordered,
+            "backpressure_waits": metrics.backpressure_waits,
+            "backpressure_seconds": metrics.backpressure_seconds,
+            "queue_waits": metrics.queue_wait.count,
+            "wait_p95": metrics.queue_wait.quantile(0.95),
+            "gauges": [metrics.queue_depth, metrics.queue_running, metrics.queue_chats],
+            "album": album,
+            "rendered": f"bot_update_queue_wait_seconds_count {metrics.queue_wait.count}" in rendered
+                        and "bot_update_queue_depth 0" in rendered,
+        }
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+def main() -> bool:
+    users = sys.argv[1] if len(sys.argv) > 1 else "100"
+    results = {}
+    for mode in MODES:
+        out = subprocess.run([sys.executable, __file__, users], capture_output=True, text=True,
+                             cwd=seed.ROOT, check=True, env={**os.environ, "BENCH_QUEUE_MODE": mode}).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{users} users, the whole scenario queued at once; UPDATE_MAX_PENDING={MAX_PENDING}")
+    print(f"{'build':<16} {'updates/s':>10} {'peak running':>13} {'chat overlaps':>14} {'out of order':>13} "
+          f"{'raised':>7} {'backpressure':>13}")
+    for mode, r in results.items():
+        print(f"{mode:<16} {r['updates'] / r['elapsed']:10.1f} {r['peak_running']:13} {r['overlaps']:14} "
+              f"{r['reordered']:13} {r['errors']:7} {r['backpressure_seconds']:12.2f}s")
+    print("album of 3 sent to the broadcast prompt → items per job: "
+          + ", ".join(f"{mode} {r['album']}" for mode, r in results.items()))
+    print()
+
+    r, cap = results["per-chat queue"], int(MODES["per-chat queue"])
+    ok = check(r["errors"] == 0, f"{r['errors']} updates raised")
+    ok &= check(r["overlaps"] == r["reordered"] == 0,
+                f"each chat's updates ran one at a time ({r['overlaps']} overlaps), in order ({r['reordered']} not)")
+    ok &= check(r["db_ok"], "one receipt under review and one question per user")
+    ok &= check(r["peak_running"] <= cap, f"at most {r['peak_running']} updates ran at once (cap {cap})")
+    ok &= check(r["peak_depth"] <= MAX_PENDING, f"at most {r['peak_depth']} updates accepted at once "
+                                                f"(UPDATE_MAX_PENDING={MAX_PENDING})")
+    ok &= check(r["backpressure_waits"] > 0, f"intake waited {r['backpressure_waits']} times, "
+                                             f"{r['backpressure_seconds']:.2f}s in all")
+    ok &= check(r["gauges"] == [0, 0, 0], f"queue depth/running/chats back to {r['gauges']}")
+    # plus the album, queued as one update
+    ok &= check(r["queue_waits"] == r["updates"] + 1 and r["rendered"],
+                f"/metrics: queue wait of {r['queue_waits']} updates, p95 ≤ {r['wait_p95']}s")
+    for mode, r in results.items():
+        ok &= check(r["album"] == [3], f"{mode}: the album became {len(r['album'])} broadcast job(s) "
+                                       f"with {r['album']} items")
+    return ok
+
+
+if __name__ == "__main__":
+    if MODE:
+        print(json.dumps(asyncio.run(measure())))
+    elif not main():
+        raise SystemExit(1)
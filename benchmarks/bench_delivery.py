@@ -0,0 +1,91 @@
+"""
+benchmarks/bench_delivery.py
+
+The shared send path (delivery.py) against the fake Bot API:
+
+- flood: every send at once through a bot without / with DeliveryMiddleware;
+  without it each 429 loses a user, with it they are retried after retry_after
+- dead chats: two broadcasts to USERS users of whom BLOCKED_SHARE blocked the
+  bot; the first broadcast marks them unreachable, the second never calls them
+- only sends mark: getChatMember failing for a blocked user leaves them
+  reachable (exit code 1 if not)
+
+Run from the repo root:  python benchmarks/bench_delivery.py [users]
+"""
+import sys
+import time
+import asyncio
+
+import seed
+
+import db
+from broadcast import run_broadcast, text_payload
+from delivery import setup_delivery
+from db_engine import dispose_engines
+from fake_bot_api import FakeBotAPI
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+BLOCKED_SHARE = 0.2
+TG_OFFSET = 10_000_000
+
+
+async def flood(api: FakeBotAPI, with_delivery: bool) -> None:
+    bot = api.bot()
+    if with_delivery:
+        setup_delivery(bot)
+    chat_ids = range(TG_OFFSET + 1, TG_OFFSET + 1 + 100)
+    try:
+        api.reset()
+        await asyncio.sleep(1.1)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(bot.send_message(c, "Salom") for c in chat_ids), return_exceptions=True)
+        ok = sum(1 for r in results if not isinstance(r, Exception))
+        label = "with delivery" if with_delivery else "raw bot"
+        print(f"flood, {label:<13} delivered {ok:>4}/100  {time.perf_counter() - t0:6.2f}s  429s: {api.flood_errors}")
+    finally:
+        await bot.session.close()
+
+
+async def broadcast_twice(api: FakeBotAPI) -> bool:
+    seed.seed_users(seed.DB_FILE, USERS, tg_offset=TG_OFFSET)
+    api.blocked = {TG_OFFSET + i for i in range(1, USERS + 1) if i % int(1 / BLOCKED_SHARE) == 0}
+    bot = setup_delivery(api.bot())
+
+    async def chat_ids():
+        async for row in db.iter_recipients():
+            yield row.telegram_id
+
+    try:
+        # a failed non-send call says nothing about whether the user gets messages
+        probe = min(api.blocked)
+        try:
+            await bot.get_chat_member(probe, probe)
+        except Exception as e:
+            print(f"getChatMember({probe}): {e}")
+        reachable = {row.telegram_id async for row in db.iter_recipients()}
+        ok = probe in reachable
+        print("OK " if ok else "ERR", "a failed getChatMember leaves the user reachable")
+
+        for run in (1, 2):
+            api.reset()
+            stats = await run_broadcast(bot, chat_ids(), text_payload("Salom"))
+            print(f"broadcast {run}: sent {stats.sent}, failed {stats.failed}, "
+                  f"API calls {sum(api.calls.values())}")
+    finally:
+        await bot.session.close()
+    return ok
+
+
+async def main() -> bool:
+    print(f"{USERS} users, {len(range(0, USERS, int(1 / BLOCKED_SHARE)))} blocked the bot")
+    async with FakeBotAPI(latency=0.02) as api:
+        await flood(api, with_delivery=False)
+        await flood(api, with_delivery=True)
+        ok = await broadcast_twice(api)
+    await dispose_engines()
+    return ok
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        raise SystemExit(1)
@@ -0,0 +1,128 @@
+"""
+benchmarks/bench_dispatch.py
+
+Dispatch overhead of a text message: the time dp.feed_update spends finding
+the handler, with every router from register_all_handlers included, in two
+builds of the dispatcher:
+
+    linear   each router's filters in turn (register_all_handlers(dp, index_buttons=False))
+    index    ButtonIndex first: one dict lookup for a stateless button press
+
+An inner middleware records which handler was chosen and stops there, so no
+handler body, Bot API call or DB query is timed. Measured texts: the first
+and the last button in router order, a button variant the index normalizes
+(‘ vs ' apostrophe, no emoji), and plain text no handler takes. Plain text
+still walks every router in both builds: Button handlers stay registered for
+presses made inside an FSM state.
+
+Both builds must pick the same handler for every declared button text.
+
+Run from the repo root:  python benchmarks/bench_dispatch.py [updates per text]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import seed
+
+os.environ["BOT_TOKEN"] = "123456:FAKE-token"
+os.environ["FSM_STORAGE"] = "memory"
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+MODE = sys.argv[2] if len(sys.argv) > 2 else None
+PLAIN = "Assalomu alaykum, menda savol bor edi"
+
+
+def message_update(update_id: int, text: str) -> Dict[str, Any]:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": 500, "type": "private"}, "from": {"id": 500, "is_bot": False, "first_name": "U"},
+    }}
+
+
+async def measure(mode: str) -> Dict[str, Any]:
+    from aiogram import BaseMiddleware
+    from aiogram.types import Update
+    from loader import bot, dp
+    from register_all_handlers import register_all_handlers
+    from text_dispatch import Button, normalize_button
+
+    chosen: List[Optional[str]] = [None]
+
+    class Stop(BaseMiddleware):
+        async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+            target = data.get("button_handler") or data["handler"]
+            chosen[0] = f"{target.callback.__module__}.{target.callback.__qualname__}"
+
+    dp.message.middleware(Stop())
+    register_all_handlers(dp, index_buttons=mode == "index")
+
+    buttons = [
+        text
+        for router in dp.chain_tail
+        for handler in router.message.handlers
+        for f in handler.filters or ()
+        if isinstance(f.callback, Button)
+        for text in sorted(f.callback.texts)
+    ]
+    variants = sorted({normalize_button(t) for t in buttons} | {t.replace("'", "‘") for t in buttons} - set(buttons))
+
+    async def resolve(text: str, n: int = 1) -> Tuple[Optional[str], float]:
+        """Handler chosen for `text` and the mean time per update, fed `n` times."""
+        updates = [Update.model_validate(message_update(i + 1, text), context={"bot": bot}) for i in range(n)]
+        chosen[0] = None
+        t0 = time.perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        return chosen[0], (time.perf_counter() - t0) / n
+
+    # a variant of a button from the last routers: the emoji dropped or the other apostrophe
+    variant = next(v for t in reversed(buttons) for v in (normalize_button(t), t.replace("'", "‘")) if v != t)
+    await resolve(buttons[0], 50)  # warm-up
+    timings = {}
+    for label, text in (("first button", buttons[0]), ("last button", buttons[-1]),
+                        ("button variant", variant), ("plain text", PLAIN)):
+        handler, elapsed = await resolve(text, UPDATES)
+        timings[label] = (text, elapsed * 1e6, handler)
+    routes = {text: (await resolve(text))[0] for text in buttons + variants}
+    await bot.session.close()
+    return {"timings": timings, "buttons": buttons, "routes": routes}
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+def main() -> bool:
+    results = {}
+    for mode in ("linear", "index"):
+        out = subprocess.run([sys.executable, __file__, str(UPDATES), mode], capture_output=True, text=True,
+                             cwd=seed.ROOT, check=True).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+
+    linear, index = results["linear"], results["index"]
+    print(f"{len(index['buttons'])} button texts, {UPDATES} updates per text; µs per update")
+    print(f"{'':<16} {'linear':>9} {'index':>9}  text → handler (index)")
+    for label, (text, lin_us, _) in linear["timings"].items():
+        _, idx_us, handler = index["timings"][label]
+        print(f"{label:<16} {lin_us:9.1f} {idx_us:9.1f}  {text!r} → {handler}")
+
+    same = [t for t in index["buttons"] if index["routes"][t] == linear["routes"][t]]
+    ok = check(len(same) == len(index["buttons"]), f"{len(same)}/{len(index['buttons'])} button texts reach the same handler")
+    variants = [t for t in index["routes"] if t not in index["buttons"]]
+    found = [t for t in variants if index["routes"][t]]
+    ok &= check(len(found) == len(variants), f"{len(found)}/{len(variants)} apostrophe/emoji variants resolved by the index")
+    ok &= check(index["timings"]["plain text"][2] is None, "plain text still falls through to no handler")
+    return ok
+
+
+if __name__ == "__main__":
+    if MODE:
+        print(json.dumps(asyncio.run(measure(MODE)), ensure_ascii=False))
+    elif not main():
+        raise SystemExit(1)
@@ -0,0 +1,127 @@
+"""
+benchmarks/bench_metrics.py
+
+Per-handler metrics (middlewares/metrics.py) under the loadtest.py scenario:
+the production dispatcher long-polls the fake Bot API, then /metrics is
+scraped and /dashboard is sent as the admin.
+
+Checks:
+- every update of the run is filed under a handler, and each scenario step
+  under the handler that serves it;
+- Bot API calls counted per method equal what the fake API received;
+- handlers that query the database report SQL statements and DB time;
+- /dashboard lists the handlers.
+
+Prints the per-handler table and the cost of the instrumentation itself
+(the middlewares on an update that no handler takes, with and without them).
+
+Run from the repo root:  python benchmarks/bench_metrics.py [users] [concurrent]
+"""
+import os
+import time
+import asyncio
+from typing import Dict
+
+import seed
+
+os.environ["METRICS_PORT"] = "0"  # this script serves /metrics itself, on a free port
+
+from aiogram import Dispatcher
+from aiogram.types import Update
+from aiohttp import ClientSession
+
+from loadtest import SCENARIO, USERS, CONCURRENT, bot, dp, storage, setup_dispatcher, polling_run, message
+from db_engine import dispose_engines
+from fake_bot_api import FakeBotAPI
+from middlewares.metrics import metrics, start_metrics_server, UpdateMetricsMiddleware, HandlerNameMiddleware
+
+EXPECTED = {
+    "start": "handlers.start.",
+    "ask question": "handlers.ask_question.start_ask_question",
+    "process question": "handlers.ask_question.process_question",
+    "check socials": "handlers.socials.",
+}
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+def parse(text: str) -> Dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+async def instrumentation_cost(n: int = 20000) -> None:
+    """µs per update spent in the metrics middlewares (an update no handler takes)."""
+    results = {}
+    for label, instrumented in (("without", False), ("with", True)):
+        bare = Dispatcher()
+        if instrumented:
+            bare.update.outer_middleware(UpdateMetricsMiddleware())
+            bare.message.middleware(HandlerNameMiddleware())
+        update = Update.model_validate({"update_id": 1, **message(1, 1, text="x")}, context={"bot": bot})
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await bare.feed_update(bot, update)
+        results[label] = (time.perf_counter() - t0) / n * 1e6
+    print(f"instrumentation: {results['with'] - results['without']:.1f} µs per update "
+          f"({results['without']:.1f} → {results['with']:.1f} µs for a bare dispatch)")
+
+
+async def main() -> bool:
+    async with FakeBotAPI(latency=0.02, global_rate=None, per_chat_interval=None) as api:
+        probe = setup_dispatcher(api)
+        runner = await start_metrics_server(port=0)
+        host, port = runner.addresses[0][:2]
+        try:
+            run = await polling_run(api, probe)
+            async with ClientSession() as http:
+                async with http.get(f"http://{host}:{port}/metrics") as response:
+                    content_type = response.headers.get("Content-Type", "")
+                    samples = parse(await response.text())
+
+            print(f"{USERS} users, {CONCURRENT} at a time; {len(run.values('e2e'))} updates\n")
+            print(f"{'handler':<48} {'n':>5} {'avg ms':>7} {'p95 ≤':>7} {'SQL':>5} {'DB ms':>6} {'API':>4}")
+            for r in metrics.summary(top=20):
+                print(f"{r['handler'][-48:]:<48} {r['updates']:>5} {r['avg_ms']:7.1f} {r['p95_ms']:7.0f} "
+                      f"{r['sql_per_update']:5.1f} {r['db_ms_per_update']:6.1f} {r['api_per_update']:4.1f}")
+            print()
+
+            ok = check(content_type.startswith("text/plain"), f"/metrics served as {content_type}")
+            counts = {k[len('bot_handler_duration_seconds_count{handler="'):-2]: v for k, v in samples.items()
+                      if k.startswith("bot_handler_duration_seconds_count")}
+            ok &= check(sum(counts.values()) == USERS * len(SCENARIO),
+                        f"{sum(counts.values()):.0f} updates filed under {len(counts)} handlers")
+            for step, prefix in EXPECTED.items():
+                n = sum(v for name, v in counts.items() if name.startswith(prefix))
+                ok &= check(n == USERS, f"{step}: {n:.0f} updates under {prefix}*")
+            api_counts = {k.split('"')[1].lower(): v for k, v in samples.items()
+                          if k.startswith("bot_telegram_api_duration_seconds_count")}
+            ok &= check(api_counts == dict(api.calls), "Bot API calls by method match what the fake API received")
+            process = "handlers.ask_question.process_question"
+            sql = samples.get(f'bot_handler_sql_statements_total{{handler="{process}"}}', 0)
+            db_s = samples.get(f'bot_handler_db_seconds_total{{handler="{process}"}}', 0)
+            ok &= check(sql >= USERS and db_s > 0, f"process_question: {sql:.0f} SQL statements, {db_s * 1000:.0f} ms in DB")
+
+            api.reset()
+            await dp.feed_update(bot, Update.model_validate(
+                {"update_id": 10 ** 9, **message(1, 1, text="/dashboard")}, context={"bot": bot}))
+            ok &= check("Handlers" in api.last_text.get(1, ""), "/dashboard lists the handlers")
+            await instrumentation_cost()
+            return ok
+        finally:
+            await runner.cleanup()
+            await storage.close()
+            await bot.session.close()
+            await dispose_engines()
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        raise SystemExit(1)
@@ -0,0 +1,63 @@
+"""
+benchmarks/bench_recipients.py
+
+Peak Python memory while walking every broadcast recipient: get_all_users()
+(full User objects in one list) against iter_recipients() (telegram_id only,
+one batch at a time), at growing table sizes. The streaming peak should not
+grow with the table.
+
+Run from the repo root:  python benchmarks/bench_recipients.py [sizes, e.g. 50000,200000]
+"""
+import sys
+import time
+import sqlite3
+import asyncio
+import tracemalloc
+
+import seed
+
+import db
+from db_engine import dispose_engines
+
+SIZES = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [50_000, 200_000]
+
+
+async def walk_all_users() -> int:
+    return sum(1 for u in await db.get_all_users() if u.telegram_id)
+
+
+async def walk_recipients() -> int:
+    n = 0
+    async for row in db.iter_recipients():
+        if row.telegram_id:
+            n += 1
+    return n
+
+
+async def measure(label: str, fn) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = await fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<18} {n:>9} users  {elapsed:7.2f}s  peak {peak / 1024 / 1024:8.1f} MiB")
+
+
+async def main():
+    try:
+        for size in SIZES:
+            conn = sqlite3.connect(seed.DB_FILE)
+            conn.execute("DELETE FROM users")
+            conn.commit()
+            conn.close()
+            seed.seed_users(seed.DB_FILE, size)
+            print(f"{size} users:")
+            await measure("get_all_users", walk_all_users)
+            await measure("iter_recipients", walk_recipients)
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
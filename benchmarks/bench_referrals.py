@@ -0,0 +1,71 @@
+"""
+benchmarks/bench_referrals.py
+
+Referral leaderboard latency at a million users: the original get_top_referrer
+(load every user, count referred_by in Python), an indexed GROUP BY
+referred_by, and get_referral_leaderboard pages.
+
+Run from the repo root:  python benchmarks/bench_referrals.py [users] [repeats]
+"""
+import sys
+import time
+import asyncio
+
+import seed
+
+from sqlalchemy import select, func
+
+import db
+from database import User
+from db_engine import dispose_engines
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+
+async def legacy_top_referrer():
+    async with db.async_session() as session:
+        counts = {}
+        for u in (await session.execute(select(User))).scalars():
+            if u.referred_by:
+                counts[u.referred_by] = counts.get(u.referred_by, 0) + 1
+        top_id = max(counts, key=counts.get)
+        return top_id, counts[top_id]
+
+
+async def group_by_top10():
+    async with db.async_session() as session:
+        cnt = func.count().label("cnt")
+        return (await session.execute(
+            select(User.referred_by, cnt).where(User.referred_by != None)  # noqa: E711
+            .group_by(User.referred_by).order_by(cnt.desc()).limit(10)
+        )).all()
+
+
+async def timed(label, fn, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = await fn()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<40} {best * 1000:10.2f} ms")
+    return result
+
+
+async def main():
+    t0 = time.perf_counter()
+    seed.seed_users(seed.DB_FILE, USERS)
+    print(f"seeded {USERS} users in {time.perf_counter() - t0:.1f}s; best of {REPEATS}")
+    try:
+        await timed("legacy: full scan in Python", legacy_top_referrer, 1)
+        await timed("GROUP BY referred_by (indexed), top 10", group_by_top10, 3)
+        await timed("get_top_referrer", db.get_top_referrer, REPEATS)
+        await timed("get_referral_leaderboard page 1", lambda: db.get_referral_leaderboard(10, 0), REPEATS)
+        await timed("get_referral_leaderboard page 100", lambda: db.get_referral_leaderboard(10, 990), REPEATS)
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
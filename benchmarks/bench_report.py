@@ -0,0 +1,78 @@
+"""
+benchmarks/bench_report.py
+
+Latency of get_report_data over a generated dataset (default 500k users and
+2M payments), for the 1-, 7- and 30-day admin report windows. The original
+implementation (separate queries over the raw tables) runs alongside for
+comparison. Seeding bypasses the helpers, so metrics_daily is rebuilt after it.
+
+Run from the repo root:  python benchmarks/bench_report.py [users] [payments] [repeats]
+"""
+import sys
+import time
+import asyncio
+import datetime as dt
+
+import seed
+
+from sqlalchemy import select, func
+
+import db
+from database import ENGINE, User, PendingPayment
+from db_engine import dispose_engines
+from rollup import backfill_metrics_daily
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+PAYMENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000_000
+REPEATS = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+
+async def legacy_report(start_date, end_date):
+    """get_report_data before the rewrite: one query per figure."""
+    async with db.async_session() as session:
+        approved_in_range = (
+            PendingPayment.status == "approved",
+            PendingPayment.approved_at != None,  # noqa: E711
+            PendingPayment.approved_at >= start_date,
+            PendingPayment.approved_at <= end_date,
+        )
+        await session.execute(
+            select(func.count(User.id)).where(User.created_at >= start_date, User.created_at <= end_date))
+        await session.execute(select(func.coalesce(func.sum(PendingPayment.payable), 0)).where(*approved_in_range))
+        await session.execute(
+            select(PendingPayment.tariff, PendingPayment.plan, func.count(PendingPayment.id))
+            .where(*approved_in_range).group_by(PendingPayment.tariff, PendingPayment.plan))
+        await session.execute(select(func.count(User.id)))
+        await session.execute(select(func.count(User.id)))
+        await session.execute(select(func.count(User.id)).where(User.tariff != None))  # noqa: E711
+
+
+async def timed(fn, start, end) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        await fn(start, end)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+async def main():
+    t0 = time.perf_counter()
+    seed.seed_users(seed.DB_FILE, USERS)
+    seed.seed_payments(seed.DB_FILE, PAYMENTS, USERS)
+    with ENGINE.begin() as conn:
+        backfill_metrics_daily(conn)
+    print(f"seeded {USERS} users / {PAYMENTS} payments in {time.perf_counter() - t0:.1f}s; best of {REPEATS}")
+    try:
+        now = dt.datetime.utcnow()
+        for days in (1, 7, 30):
+            start = now - dt.timedelta(days=days)
+            old_ms = await timed(legacy_report, start, now)
+            new_ms = await timed(db.get_report_data, start, now)
+            print(f"{days:>2}-day report   legacy {old_ms:8.1f} ms   get_report_data {new_ms:8.1f} ms")
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+benchmarks/bench_segments.py
+
+Audience pre-count and streaming for broadcast segments: for each Segment,
+the time of db.count_recipients (what the admin sees before sending), the
+time to stream every recipient with db.iter_recipients, and SQLite's query
+plan for the count, which should search an index rather than scan users.
+
+Run from the repo root:  python benchmarks/bench_segments.py [users]
+"""
+import sys
+import time
+import sqlite3
+import asyncio
+import datetime as dt
+
+import seed
+
+import db
+from db_engine import dispose_engines
+from segments import Segment
+from sqlalchemy import func, select
+from sqlalchemy.dialects import sqlite
+
+from database import User
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+now = dt.datetime.utcnow()
+SEGMENTS = [
+    Segment(),
+    Segment(tariffs=("premium",)),
+    Segment(status="active"),
+    Segment(status="expired"),
+    Segment(seen_within_days=7),
+    Segment(not_seen_days=30),
+    Segment(joined_from=now - dt.timedelta(days=30)),
+    Segment(with_bonus=True),
+    Segment(tariffs=("pro", "premium"), status="active", seen_within_days=30),
+]
+
+
+def plan(segment: Segment) -> str:
+    stmt = select(func.count(User.id)).where(*segment.criteria(), User.unreachable_at.is_(None))
+    sql = str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    conn = sqlite3.connect(seed.DB_FILE)
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    finally:
+        conn.close()
+    return " | ".join(row[-1] for row in rows)
+
+
+async def main():
+    seed.seed_users(seed.DB_FILE, USERS)
+    seed.seed_payments(seed.DB_FILE, USERS // 2, USERS)
+    print(f"{USERS} users")
+    try:
+        for segment in SEGMENTS:
+            t0 = time.perf_counter()
+            count = await db.count_recipients(*segment.criteria())
+            counted = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            streamed = 0
+            async for _ in db.iter_recipients(*segment.criteria()):
+                streamed += 1
+            elapsed = time.perf_counter() - t0
+            mark = "" if streamed == count else f"  MISMATCH (streamed {streamed})"
+            print(f"  {segment.describe():<48} {count:>8}  count {counted * 1000:7.1f} ms  "
+                  f"stream {elapsed:6.2f}s{mark}")
+            print(f"      plan: {plan(segment)}")
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
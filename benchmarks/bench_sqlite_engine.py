@@ -0,0 +1,83 @@
+"""
+benchmarks/bench_sqlite_engine.py
+
+Mixed read/write throughput against SQLite: the old per-module default engine
+(NullPool, rollback journal, readers and writers racing for the lock) versus the
+shared engines from db_engine.py (WAL, pooled readers, one serialized writer).
+
+Workload: CONCURRENCY tasks x OPS operations, ~80% user lookups by telegram_id
+and ~20% last_active updates, like a burst of incoming updates.
+
+Run from the repo root:  python benchmarks/bench_sqlite_engine.py [users] [concurrency] [ops]
+"""
+import sys
+import time
+import random
+import asyncio
+import datetime as dt
+
+import seed  # noqa: F401  (sets DATABASE_URL before project imports)
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import User
+from db_engine import create_read_engine, create_write_engine
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+OPS = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+WRITE_RATIO = 0.2
+SEED_OFFSET = 10_000_000
+
+
+async def _worker(read_engine, write_engine, rnd: random.Random, stats: dict):
+    for _ in range(OPS):
+        tg_id = SEED_OFFSET + rnd.randint(1, USERS)
+        try:
+            if rnd.random() < WRITE_RATIO:
+                async with write_engine.begin() as conn:
+                    await conn.execute(
+                        update(User).where(User.telegram_id == tg_id).values(last_active=dt.datetime.utcnow())
+                    )
+                stats["writes"] += 1
+            else:
+                async with read_engine.connect() as conn:
+                    (await conn.execute(select(User).where(User.telegram_id == tg_id))).first()
+                stats["reads"] += 1
+        except OperationalError:
+            stats["locked"] += 1
+
+
+async def run(label: str, read_engine, write_engine) -> None:
+    stats = {"reads": 0, "writes": 0, "locked": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(read_engine, write_engine, random.Random(i), stats) for i in range(CONCURRENCY)
+    ))
+    elapsed = time.perf_counter() - started
+    done = stats["reads"] + stats["writes"]
+    print(f"{label:<28} {elapsed:7.2f}s  {done / elapsed:9.0f} ops/s  "
+          f"reads={stats['reads']} writes={stats['writes']} errors={stats['locked']}")
+    await read_engine.dispose()
+    if write_engine is not read_engine:
+        await write_engine.dispose()
+
+
+async def main():
+    print(f"users={USERS} concurrency={CONCURRENCY} ops/task={OPS} write_ratio={WRITE_RATIO}")
+
+    before_path = seed.fresh_db("before")
+    seed.seed_users(before_path, USERS, tg_offset=SEED_OFFSET)
+    before = create_async_engine(f"sqlite+aiosqlite:///{before_path}")
+    await run("before: default engine", before, before)
+
+    after_path = seed.fresh_db("after")
+    seed.seed_users(after_path, USERS, tg_offset=SEED_OFFSET)
+    url = f"sqlite+aiosqlite:///{after_path}"
+    await run("after: WAL + single writer", create_read_engine(url), create_write_engine(url))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
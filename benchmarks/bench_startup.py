@@ -0,0 +1,143 @@
+"""
+benchmarks/bench_startup.py
+
+Cold start of `python main.py`: from spawning the process to its first
+getUpdates call on the fake Bot API (TELEGRAM_API_URL), against a database
+file that does not exist yet, so the run includes db.init_db() creating the
+schema. Then the same against the database the first run left behind.
+
+Also prints the import-time profile of `import main` (python -X importtime):
+the project modules and the other packages by cumulative time.
+
+Checks:
+- importing main (and register_all_handlers) creates no database file;
+- the handler modules imported are exactly the ones register_all_handlers
+  includes, plus what those import themselves;
+- the median cold start stays within the budget (exit code 1 if not).
+
+Run from the repo root:
+    python benchmarks/bench_startup.py [budget, s (default 10)] [runs (default 3)]
+"""
+import os
+import ast
+import sys
+import time
+import signal
+import asyncio
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import seed
+
+from fake_bot_api import FakeBotAPI
+
+BUDGET = float(sys.argv[1]) if len(sys.argv) > 1 else float(os.getenv("STARTUP_BUDGET_SECONDS", "10"))
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+ENV = {
+    **os.environ,
+    "BOT_TOKEN": "123456:FAKE-token", "ADMIN_ID": "1", "DOCTOR_ID": "2",
+    "BOT_MODE": "polling", "BOT_WORKERS": "1", "BOT_WORKER_INDEX": "-1", "METRICS_PORT": "0",
+}
+IMPORTS = """
+import sys
+import main
+from loader import dp
+from register_all_handlers import MODULES, register_all_handlers
+register_all_handlers(dp)
+print(repr((sorted(MODULES), sorted(m for m in sys.modules if m.startswith("handlers.")))))
+"""
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+async def cold_start(api: FakeBotAPI, db_path: str) -> float:
+    """Seconds from spawning main.py to its first getUpdates."""
+    api.reset()
+    env = {**ENV, "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}", "TELEGRAM_API_URL": api.base_url}
+    t0 = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(seed.ROOT / "main.py"), env=env, cwd=seed.ROOT,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        while not api.calls["getupdates"]:
+            if process.returncode is not None:
+                raise RuntimeError(f"main.py exited with {process.returncode} before polling")
+            await asyncio.sleep(0.005)
+        return time.perf_counter() - t0
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), 30)
+        except asyncio.TimeoutError:
+            process.kill()
+
+
+def import_profile(db_path: str) -> Tuple[List[Tuple[str, int, int]], str]:
+    """(module, self µs, cumulative µs) rows of `python -X importtime`, and the script's stdout."""
+    env = {**ENV, "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}"}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORTS], env=env, cwd=seed.ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name[1:].rstrip(), int(self_us), int(cumulative)))  # keeps the nesting indent
+    return rows, result.stdout.strip().splitlines()[-1]
+
+
+def report_profile(rows: List[Tuple[str, int, int]]) -> None:
+    project = {p.stem for p in seed.ROOT.glob("*.py")} | {p.name for p in seed.ROOT.iterdir() if p.is_dir()}
+    ours: Dict[str, int] = {}
+    packages: Dict[str, int] = defaultdict(int)
+    for name, _, cumulative in rows:
+        module = name.strip()
+        top = module.split(".")[0]
+        if top in project:
+            ours[module] = max(ours.get(module, 0), cumulative)
+        elif module == top:  # the package's own import, including what it imports
+            packages[top] += cumulative
+    total = sum(cumulative for name, _, cumulative in rows if name == name.strip())
+    print(f"import main + register_all_handlers: {total / 1e6:.2f}s of imports")
+    print(f"{'project module':<34} {'cumulative ms':>14}")
+    for module, us in sorted(ours.items(), key=lambda kv: kv[1], reverse=True)[:15]:
+        print(f"{module:<34} {us / 1000:14.1f}")
+    print(f"{'other package':<34} {'cumulative ms':>14}")
+    for package, us in sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:8]:
+        print(f"{package:<34} {us / 1000:14.1f}")
+    print()
+
+
+async def main() -> bool:
+    db_path = seed.TMP_DIR / "startup.db"
+    rows, out = import_profile(str(db_path))
+    report_profile(rows)
+    modules, imported = ast.literal_eval(out)
+    ok = check(not db_path.exists(), "importing main and the routers leaves the database untouched")
+    extra = sorted(set(imported) - set(modules) - {m.rsplit(".", 1)[0] for m in modules})
+    ok &= check(set(modules) <= set(imported), f"{len(modules)} router modules imported")
+    print(f"    also imported by them: {', '.join(extra) or 'nothing'}")
+
+    async with FakeBotAPI(latency=0.0, global_rate=None, per_chat_interval=None) as api:
+        cold, warm = [], []
+        for i in range(RUNS):
+            path = seed.TMP_DIR / f"startup{i}.db"
+            cold.append(await cold_start(api, str(path)))
+            warm.append(await cold_start(api, str(path)))
+    cold.sort()
+    warm.sort()
+    print(f"start → first getUpdates, {RUNS} runs: new database "
+          + "/".join(f"{t:.2f}" for t in cold) + "s, existing database " + "/".join(f"{t:.2f}" for t in warm) + "s")
+    median = cold[len(cold) // 2]
+    ok &= check(median <= BUDGET, f"cold start {median:.2f}s (median) within the {BUDGET:.1f}s budget")
+    return ok
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        raise SystemExit(1)
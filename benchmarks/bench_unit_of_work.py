@@ -0,0 +1,148 @@
+"""
+benchmarks/bench_unit_of_work.py
+
+Pooled connections and SQL statements per update with one DB session per
+update (middlewares/unit_of_work.py) against a session per helper call, the
+two builds run side by side in subprocesses (DB_SESSION_PER_UPDATE=1 / 0):
+
+    the loadtest.py scenario, long-polled from the fake Bot API
+    → 🧾 Mening tarifim for every user
+    → the admin approves every receipt ([approve_<id>], cb_approve)
+    → 🧾 Mening tarifim again
+
+Checks:
+- per update the shared session checks out no more connections than the
+  helpers did on their own, and the my_tariff reads share one;
+- every approval activated the user's tariff, and get_user_by_tg (served from
+  the user cache) sees it once cb_approve's transaction has committed;
+- no update raised in either build.
+
+Run from the repo root:  python benchmarks/bench_unit_of_work.py [users] [concurrent]
+"""
+import os
+import sys
+import json
+import asyncio
+import subprocess
+from typing import Any, Dict
+
+import seed
+
+MODES = {"session per helper": "0", "session per update": "1"}
+# set for the subprocess that measures one build; loadtest.py owns the command line
+MODE = os.environ.get("BENCH_UOW_MODE")
+if MODE:
+    os.environ["DB_SESSION_PER_UPDATE"] = MODES[MODE]
+os.environ["METRICS_PORT"] = "0"
+
+MY_TARIFF = "🧾 Mening tarifim"
+HANDLERS = [
+    "handlers.start.start_handler",
+    "handlers.purchase.plan_callback",
+    "handlers.purchase.enter_last4",
+    "handlers.ask_question.process_question",
+    "handlers.socials.check_socials",
+    "handlers.my_tariff.my_tariff",
+    "handlers.purchase.cb_approve",
+]
+
+
+async def measure() -> Dict[str, Any]:
+    # loadtest first: it sets the fake token and staff ids before config is read
+    from loadtest import USERS, bot, dp, storage, setup_dispatcher, polling_run, message, callback
+    import datetime as dt
+    from aiogram.types import Update
+    from sqlalchemy import func, select
+
+    import db
+    from database import PendingPayment
+    from db_engine import dispose_engines
+    from fake_bot_api import FakeBotAPI
+    from middlewares.metrics import metrics
+
+    update_ids = iter(range(10 ** 9, 2 * 10 ** 9))
+
+    async def feed(build: Dict[str, Any]) -> None:
+        await dp.feed_update(bot, Update.model_validate({"update_id": next(update_ids), **build}, context={"bot": bot}))
+
+    async with FakeBotAPI(latency=0.02, global_rate=None, per_chat_interval=None) as api:
+        probe = setup_dispatcher(api)
+        try:
+            run = await polling_run(api, probe)
+            users = range(run.first_user + 1, run.first_user + USERS + 1)
+            for u in users:
+                await feed(message(u, 100, text=MY_TARIFF))
+            async with db.async_session() as session:
+                pids = (await session.execute(select(PendingPayment.id).where(
+                    PendingPayment.status == "under_review", PendingPayment.user_tg.in_(list(users)),
+                ))).scalars().all()
+            for i, pid in enumerate(pids):
+                await feed(callback(1, 1000 + i, f"approve_{pid}"))
+            for u in users:
+                await feed(message(u, 101, text=MY_TARIFF))
+
+            async with db.async_session() as session:
+                approved = (await session.execute(select(func.count()).select_from(PendingPayment).where(
+                    PendingPayment.status == "approved", PendingPayment.user_tg.in_(list(users)),
+                ))).scalar()
+            # the 1 haftalik plan: tariff_end moves to a week from now
+            week = dt.datetime.utcnow() + dt.timedelta(days=8)
+            snapshots = [await db.get_user_by_tg(u) for u in users]
+            return {
+                "updates": len(run.values("handler")) + 2 * USERS + len(pids),
+                "errors": probe.errors,
+                "approved": approved,
+                "active": sum(1 for s in snapshots if s and s.tariff == "pro" and s.tariff_end < week),
+                "connections": sum(metrics.connections.values()),
+                "sql": sum(metrics.sql_statements.values()),
+                "handlers": {r["handler"]: r for r in metrics.summary(top=100)},
+            }
+        finally:
+            await storage.close()
+            await bot.session.close()
+            await dispose_engines()
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+def main() -> bool:
+    users = sys.argv[1] if len(sys.argv) > 1 else "100"
+    concurrent = sys.argv[2] if len(sys.argv) > 2 else "25"
+    results = {}
+    for mode in MODES:
+        out = subprocess.run([sys.executable, __file__, users, concurrent], capture_output=True, text=True,
+                             cwd=seed.ROOT, check=True, env={**os.environ, "BENCH_UOW_MODE": mode}).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+
+    legacy, uow = results["session per helper"], results["session per update"]
+    print(f"{users} users; connections / SQL statements per update")
+    print(f"{'handler':<42} {'per helper':>12} {'per update':>12}")
+    for name in HANDLERS:
+        a, b = legacy["handlers"].get(name), uow["handlers"].get(name)
+        if a and b:
+            print(f"{name:<42} {a['connections_per_update']:5.2f} / {a['sql_per_update']:4.1f} "
+                  f"{b['connections_per_update']:5.2f} / {b['sql_per_update']:4.1f}")
+    for mode, r in results.items():
+        print(f"{mode}: {r['connections']} connections, {r['sql']} SQL statements for {r['updates']} updates")
+    print()
+
+    ok = True
+    for mode, r in results.items():
+        ok &= check(r["errors"] == 0, f"{mode}: {r['errors']} updates raised")
+        ok &= check(r["active"] == r["approved"] == int(users),
+                    f"{mode}: {r['approved']} receipts approved, {r['active']} tariffs active via get_user_by_tg")
+    ok &= check(uow["connections"] <= legacy["connections"],
+                f"{uow['connections']} connections with one session per update ≤ {legacy['connections']} per helper")
+    mine = uow["handlers"]["handlers.my_tariff.my_tariff"]["connections_per_update"]
+    ok &= check(mine <= 1, f"my_tariff reads share one connection ({mine:.2f} per update)")
+    return ok
+
+
+if __name__ == "__main__":
+    if MODE:
+        print(json.dumps(asyncio.run(measure())))
+    elif not main():
+        raise SystemExit(1)
@@ -0,0 +1,48 @@
+"""
+benchmarks/bench_webhook.py
+
+Long polling against webhook mode on the same dispatcher and the same load
+(loadtest.py's scenario and synthetic users): per transport, end-to-end and
+handler p50/p95/p99 and sustained throughput. Each run uses its own users.
+
+Polling adds a getUpdates round trip (plus the fake API latency) before an
+update reaches a handler, and fetches updates in batches; the webhook hands
+each update over as soon as it is POSTed.
+
+Run from the repo root:  python benchmarks/bench_webhook.py [users] [concurrent] [api latency, s]
+"""
+import asyncio
+
+import loadtest
+from loadtest import FakeBotAPI, bot, storage, dispose_engines, fmt, check_db
+
+USERS, CONCURRENT, API_LATENCY = loadtest.USERS, loadtest.CONCURRENT, loadtest.API_LATENCY
+
+
+async def main() -> bool:
+    async with FakeBotAPI(latency=API_LATENCY, global_rate=None, per_chat_interval=None) as api:
+        probe = loadtest.setup_dispatcher(api)
+        try:
+            print(f"{USERS} users per run, {CONCURRENT} at a time, fake API latency {API_LATENCY * 1000:.0f} ms")
+            runs = [
+                await loadtest.polling_run(api, probe, first_user=loadtest.TG_OFFSET),
+                await loadtest.webhook_run(api, probe, first_user=loadtest.TG_OFFSET + 1_000_000),
+            ]
+            print(f"{'mode':<8} {'e2e p50/p95/p99, ms':>24}  {'handler p50/p95/p99, ms':>26}  {'updates/s':>9}")
+            for run in runs:
+                handled = run.values("handler")
+                print(f"{run.name:<8} {fmt(run.values('e2e')):>24}  {fmt(handled):>26}  "
+                      f"{len(handled) / run.elapsed:>9.1f}")
+            ok = probe.errors == 0
+            for run in runs:
+                ok = await check_db(run.first_user) and ok
+            return ok
+        finally:
+            await storage.close()
+            await bot.session.close()
+            await dispose_engines()
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        raise SystemExit(1)
@@ -0,0 +1,149 @@
+"""
+benchmarks/bench_workers.py
+
+Multi-process mode (supervisor.py) end to end: `python main.py` runs as a
+real process, once per worker count, against the fake Bot API
+(TELEGRAM_API_URL) and a fresh temp database. Synthetic users walk
+
+    /start → 📑 Savol yozish → question text   (handlers/ask_question.py FSM)
+
+each waiting for the bot's reply before the next step, as a person would.
+Latency is measured from the update being queued on the fake API to the
+bot's reply reaching that chat, so it covers the supervisor hop as well.
+
+Checks: routing keeps every chat on one worker (chat_id % N), every user
+gets a reply to every step, the DB holds one question per user, and the
+process tree exits on SIGTERM.
+
+More workers only pay off with as many free CPU cores: on one core they
+share it and add the supervisor hop, and all of them still write to one
+SQLite file.
+
+Run from the repo root:
+    python benchmarks/bench_workers.py [users] [concurrent] [worker counts, e.g. 1,2,4]
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import itertools
+import sqlite3
+from typing import Any, Dict, List
+
+import seed
+
+from fake_bot_api import FakeBotAPI
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONCURRENT = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+WORKER_COUNTS = [int(n) for n in (sys.argv[3] if len(sys.argv) > 3 else "1,2,4").split(",")]
+TG_OFFSET = 30_000_000
+BASE_PORT = 18100
+STEPS = ["/start", "📑 Savol yozish", "Homiladorlikda qanday vitaminlar kerak?"]
+UPDATE_IDS = itertools.count(1)
+
+
+def message(user_id: int, message_id: int, text: str) -> Dict[str, Any]:
+    return {"message": {
+        "message_id": message_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+    }}
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)] if ordered else 0.0
+
+
+def check(ok: bool, what: str) -> bool:
+    print("OK " if ok else "ERR", what)
+    return ok
+
+
+def check_routing() -> bool:
+    from supervisor import update_chat_id, worker_for
+
+    cb = {"update_id": 1, "callback_query": {"id": "1", "from": {"id": 7}, "chat_instance": "7", "data": "x",
+                                             "message": {"message_id": 1, "date": 0, "chat": {"id": 42}}}}
+    inline = {"update_id": 2, "inline_query": {"id": "1", "from": {"id": 9}, "query": "", "offset": ""}}
+    ok = check(update_chat_id({"update_id": 3, **message(41, 1, "hi")}) == 41, "message routed by chat id")
+    ok &= check(update_chat_id(cb) == 42, "callback routed by the chat of its message")
+    ok &= check(update_chat_id(inline) == 9, "chat-less update routed by sender")
+    ok &= check(worker_for(-1001234567890, 4) in range(4), "channel ids map to a worker")
+    return ok
+
+
+async def ask(api: FakeBotAPI, user_id: int, message_id: int, text: str) -> float:
+    reply = api.expect_reply(user_id)
+    pushed = time.perf_counter()
+    api.push_update({"update_id": next(UPDATE_IDS), **message(user_id, message_id, text)})
+    return await asyncio.wait_for(reply, 60) - pushed
+
+
+async def run(workers: int) -> bool:
+    path = seed.fresh_db(f"workers{workers}")
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:FAKE-token", "ADMIN_ID": "1", "DOCTOR_ID": "2",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{path}",
+        "BOT_MODE": "polling", "BOT_WORKERS": str(workers), "WORKER_BASE_PORT": str(BASE_PORT),
+        "BOT_WORKER_INDEX": "-1", "FSM_STORAGE": "sqlite",
+    }
+    async with FakeBotAPI(latency=0.02, global_rate=None, per_chat_interval=None) as api:
+        env["TELEGRAM_API_URL"] = api.base_url
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, str(seed.ROOT / "main.py"), env=env, cwd=seed.ROOT,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            # warm-up: one chat per worker, so every process is up before timing
+            await asyncio.gather(*(ask(api, TG_OFFSET - workers + i, 1, "/start") for i in range(workers)))
+
+            latencies: List[float] = []
+            replied: Dict[int, int] = {}
+            limit = asyncio.Semaphore(CONCURRENT)
+
+            async def user(user_id: int) -> None:
+                async with limit:
+                    for message_id, text in enumerate(STEPS, 1):
+                        latencies.append(await ask(api, user_id, message_id, text))
+                        replied[user_id] = message_id
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(user(TG_OFFSET + i) for i in range(1, USERS + 1)))
+            elapsed = time.perf_counter() - t0
+            print(f"{workers} worker(s): {len(latencies)} updates in {elapsed:.1f}s, "
+                  f"{len(latencies) / elapsed:.1f} updates/s, reply p50/p95/p99 "
+                  + "/".join(f"{percentile(latencies, p) * 1000:.0f}" for p in (50, 95, 99)) + " ms")
+            ok = check(all(n == len(STEPS) for n in replied.values()) and len(replied) == USERS,
+                       f"{workers} worker(s): every user got a reply to every step")
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                code = await asyncio.wait_for(process.wait(), 30)
+            except asyncio.TimeoutError:
+                process.kill()
+                code = None
+        ok &= check(code is not None, f"{workers} worker(s): stopped on SIGTERM (exit code {code})")
+
+    conn = sqlite3.connect(path)
+    try:
+        questions = conn.execute("SELECT count(*) FROM questions WHERE user_tg > ?", (TG_OFFSET,)).fetchone()[0]
+    finally:
+        conn.close()
+    return check(questions == USERS, f"{workers} worker(s): {questions} questions stored for {USERS} users") and ok
+
+
+async def main() -> bool:
+    ok = check_routing()
+    print(f"{USERS} users, {CONCURRENT} at a time, fake API latency 20 ms")
+    for workers in WORKER_COUNTS:
+        ok &= await run(workers)
+    return ok
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        raise SystemExit(1)
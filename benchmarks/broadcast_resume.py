@@ -0,0 +1,135 @@
+"""
+benchmarks/broadcast_resume.py
+
+Crash/resume check for broadcast jobs against the fake Bot API:
+
+1. start a job to USERS recipients and kill its runner task mid-way (as a
+   restart would), then resume_interrupted_jobs() and let it finish;
+2. pause a second job, resume it, and cancel a third;
+3. run a job with a live progress message to users of whom some blocked the
+   bot: the message is edited a handful of times, not per recipient, and the
+   final per-error-class counts are stored with the job;
+4. run_broadcast with a result callback that raises (as a failed checkpoint
+   write would): the run ends with that error instead of hanging.
+
+Every user must receive the first job at least once; duplicates are allowed
+only for chats sent after the last checkpoint (at most
+BROADCAST_CHECKPOINT_SIZE + BROADCAST_WORKERS). Exits 1 on failure.
+
+Run from the repo root:  python benchmarks/broadcast_resume.py [users]
+"""
+import sys
+import asyncio
+
+import seed
+
+import db
+import broadcast_jobs
+from broadcast import run_broadcast, text_payload, text_spec
+from config import BROADCAST_CHECKPOINT_SIZE, BROADCAST_WORKERS
+from db_engine import dispose_engines
+from fake_bot_api import FakeBotAPI
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+errors = False
+
+
+def check(ok: bool, label: str, detail: str = "") -> None:
+    global errors
+    print("OK " if ok else "ERR", label, detail)
+    errors = errors or not ok
+
+
+async def wait_for(job_id: int, *statuses: str, timeout: float = 120) -> dict:
+    for _ in range(int(timeout * 10)):
+        job = await db.get_broadcast_job(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"job {job_id} still {job['status']}")
+
+
+async def main():
+    seed.seed_users(seed.DB_FILE, USERS)
+    # fast fake API without flood limits: this checks bookkeeping, not pacing
+    async with FakeBotAPI(latency=0.01, global_rate=None, per_chat_interval=None) as api:
+        bot = api.bot()
+        try:
+            # 1. crash mid-way, resume from the checkpoint
+            job_id = await db.create_broadcast_job(text_spec("crash test"), created_by=None)
+            task = await broadcast_jobs.start_job(bot, job_id)
+            while sum(api.sent_to.values()) < USERS // 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            crashed = await db.get_broadcast_job(job_id)
+            print(f"killed at {sum(api.sent_to.values())} sends, checkpoint cursor {crashed['cursor']}, "
+                  f"{crashed['sent']} results stored")
+            check(crashed["status"] == "running", "killed job still 'running'")
+
+            await broadcast_jobs.resume_interrupted_jobs(bot)
+            job = await wait_for(job_id, "done")
+            received = api.sent_to
+            missing = USERS - len(received)
+            duplicates = sum(n - 1 for n in received.values())
+            check(missing == 0, "every user received the message", f"missing {missing}")
+            check(duplicates <= BROADCAST_CHECKPOINT_SIZE + BROADCAST_WORKERS,
+                  "duplicates only since the last checkpoint", f"{duplicates}")
+            check(job["sent"] == USERS, "one result row per user", f"sent {job['sent']}")
+
+            # 2. pause / resume / cancel
+            api.reset()
+            paused_id = await broadcast_jobs.create_job(bot, text_spec("pause test"))
+            await asyncio.sleep(0.2)
+            check(await broadcast_jobs.pause_job(paused_id), "pause")
+            # chats already holding a rate-limit slot still go out (~one second's worth)
+            await asyncio.sleep(1.5)
+            at_pause = sum(api.sent_to.values())
+            await asyncio.sleep(1.0)
+            check(sum(api.sent_to.values()) == at_pause < USERS, "no sends while paused", f"{at_pause}")
+            check(await broadcast_jobs.resume_job(bot, paused_id), "resume")
+            job = await wait_for(paused_id, "done")
+            check(len(api.sent_to) == USERS and job["sent"] == USERS, "resumed job reached everyone")
+
+            cancelled_id = await broadcast_jobs.create_job(bot, text_spec("cancel test"))
+            await asyncio.sleep(0.2)
+            check(await broadcast_jobs.cancel_job(cancelled_id), "cancel")
+            check(not await broadcast_jobs.resume_job(bot, cancelled_id), "cancelled job cannot resume")
+            await broadcast_jobs.stop_all_jobs()
+            job = await db.get_broadcast_job(cancelled_id)
+            check(job["status"] == "cancelled" and job["sent"] < USERS, "cancelled job stopped", f"sent {job['sent']}")
+
+            # 3. progress message and per-error-class stats
+            api.reset()
+            api.blocked = {row.telegram_id async for row in db.iter_recipients() if row.id % 10 == 0}
+            progress_id = await broadcast_jobs.create_job(bot, text_spec("progress test"), progress_chat_id=1)
+            job = await wait_for(progress_id, "done")
+            edits = api.calls["editmessagetext"]
+            print(f"progress: {edits} edits for {USERS} recipients; final text:\n{broadcast_jobs.progress_text(job)}")
+            check(job["total"] == USERS, "total counted up front", f"{job['total']}")
+            check(0 < edits <= 2 + USERS / 30 / 5 + 1, "progress edits throttled", f"{edits}")
+            check(job["blocked"] == len(api.blocked) and job["errors"] == {"unreachable": len(api.blocked)},
+                  "blocked users counted per error class", f"{job['errors']}")
+
+            # 4. the result callback fails: the workers die, the producer must not wait on the full queue
+            async def failing_checkpoint(chat_id, error):
+                raise RuntimeError("checkpoint write failed")
+
+            chat_ids = (row.telegram_id async for row in db.iter_recipients())
+            try:
+                await asyncio.wait_for(run_broadcast(bot, chat_ids, text_payload("failing checkpoint"), workers=2,
+                                                     on_result=failing_checkpoint), 30)
+                raised = None
+            except Exception as e:
+                raised = e
+            check(isinstance(raised, RuntimeError), "failing on_result ends the run with its error", repr(raised))
+        finally:
+            await bot.session.close()
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    if errors:
+        raise SystemExit(1)
+    print("BROADCAST JOBS OK")
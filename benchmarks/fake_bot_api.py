@@ -0,0 +1,233 @@
+"""
+benchmarks/fake_bot_api.py
+
+A local stand-in for api.telegram.org for benchmarks and load tests.
+
+Answers Bot API calls with well-formed results after a configurable latency
+and enforces Telegram-like flood limits (global messages/second and one
+message per second per chat) by replying 429 with retry_after, so clients
+that ignore the limits see what production would do to them. Chat ids in
+`blocked` get 403 "bot was blocked by the user" on sends and 400 "chat not
+found" on getChatMember.
+
+Incoming traffic: push_update() queues an update for getUpdates, which
+long-polls like the real server (offset confirms, timeout waits), so a
+Dispatcher can run start_polling() against it. getChatMember reports every
+other user as a member; sendInvoice answers with an invoice message.
+
+What the bot sent: expect_reply(chat_id) tells when the bot next sends to a
+chat (which times a bot running in another process), last_text holds the
+latest text sent to each chat.
+
+In-process:
+    async with FakeBotAPI(latency=0.05) as api:
+        bot = api.bot()
+Standalone:
+    python benchmarks/fake_bot_api.py [port]
+"""
+import sys
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+SEND_METHODS = {
+    "sendmessage", "sendsticker", "sendphoto", "sendvideo", "senddocument", "copymessage",
+    "sendanimation", "sendaudio", "sendvoice", "sendinvoice",
+}
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+def _total_amount(prices: Any) -> int:
+    if isinstance(prices, str):
+        prices = json.loads(prices)
+    return sum(int(p.get("amount", 0)) for p in prices or ())
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 global_rate: Optional[float] = 30, per_chat_interval: Optional[float] = 1.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.calls: Counter = Counter()
+        self.flood_errors = 0
+        self.sent_to: Counter = Counter()
+        self.last_text: Dict[Any, str] = {}
+        # chats that "blocked the bot": sends to them get 403 Forbidden, getChatMember "chat not found"
+        self.blocked: set = set()
+        self._recent: deque = deque()
+        self._last_by_chat: Dict[int, float] = {}
+        self._message_ids = itertools.count(1)
+        self._updates: deque = deque()
+        self._update_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._reply_waiters: Dict[Any, asyncio.Future] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    # ---- lifecycle ----
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    async def start(self) -> "FakeBotAPI":
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self) -> "FakeBotAPI":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def bot(self, token: str = "123456:FAKE-token"):
+        """An aiogram Bot talking to this server."""
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(token=token, session=session)
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.sent_to.clear()
+        self.last_text.clear()
+        self.flood_errors = 0
+        self._recent.clear()
+        self._last_by_chat.clear()
+
+    # ---- incoming updates ----
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Queue `update` (without update_id) for getUpdates; returns its update_id."""
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **update})
+        self._new_updates.set()
+        return update_id
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """Future resolved with time.perf_counter() of the next message sent to `chat_id`."""
+        waiter = self._reply_waiters[chat_id] = asyncio.get_running_loop().create_future()
+        return waiter
+
+    async def _get_updates(self, params: Dict[str, Any]) -> list:
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return list(itertools.islice(self._updates, limit))
+
+    # ---- request handling ----
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    def _flood_wait(self, chat_id: Optional[int]) -> Optional[int]:
+        now = time.monotonic()
+        if self.global_rate:
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.global_rate:
+                return 1
+        if self.per_chat_interval and chat_id is not None:
+            last = self._last_by_chat.get(chat_id)
+            if last is not None and now - last < self.per_chat_interval:
+                return 1
+            self._last_by_chat[chat_id] = now
+        self._recent.append(now)
+        return None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        chat_id = params.get("chat_id")
+        # numeric ids as int; "@channel" usernames stay strings
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else chat_id or None
+        if method == "getchatmember" and chat_id in self.blocked:
+            return web.json_response({
+                "ok": False, "error_code": 400, "description": "Bad Request: chat not found",
+            }, status=400)
+        if method in SEND_METHODS:
+            if chat_id in self.blocked:
+                return web.json_response({
+                    "ok": False, "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }, status=403)
+            retry_after = self._flood_wait(chat_id)
+            if retry_after:
+                self.flood_errors += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+            self.sent_to[chat_id] += 1
+            if "text" in params:
+                self.last_text[chat_id] = params["text"]
+            waiter = self._reply_waiters.pop(chat_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+        return web.json_response({"ok": True, "result": self._result(method, params, chat_id)})
+
+    def _result(self, method: str, params: Dict[str, Any], chat_id: Optional[int]) -> Any:
+        if method == "copymessage":
+            return {"message_id": next(self._message_ids)}
+        if method in SEND_METHODS:
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            if method == "sendinvoice":
+                message["invoice"] = {
+                    "title": params.get("title", ""), "description": params.get("description", ""),
+                    "start_parameter": params.get("start_parameter", ""),
+                    "currency": params.get("currency", ""), "total_amount": _total_amount(params.get("prices")),
+                }
+            return message
+        if method == "getchatmember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}}
+        if method == "getme":
+            return BOT_USER
+        return True
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    server = FakeBotAPI(port=port)
+    print(f"fake Bot API on http://127.0.0.1:{port} (flood limit {server.global_rate}/s)")
+    web.run_app(server.app(), host="127.0.0.1", port=port, print=None)
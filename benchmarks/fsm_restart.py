@@ -0,0 +1,131 @@
+"""
+benchmarks/fsm_restart.py
+
+Checks and timings for fsm_storage.SQLiteStorage:
+
+1. restart: states and data written by one storage instance are read back by
+   a fresh one (a new process after a deploy), including a PurchaseFSM step;
+2. batching: KEYS state changes reach SQLite in a handful of transactions;
+3. LRU: with a cache far smaller than the key count every key still reads
+   back correctly (misses fall through to SQLite);
+4. clear and TTL: cleared keys leave the table, and keys untouched for the TTL
+   are removed by cleanup();
+5. speed: get/set round trips per second against aiogram's MemoryStorage.
+
+Exits 1 on failure.
+
+Run from the repo root:  python benchmarks/fsm_restart.py [keys]
+"""
+import sys
+import time
+import sqlite3
+import asyncio
+
+import seed
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from db_engine import dispose_engines
+from fsm_storage import SQLiteStorage
+from handlers.purchase import PurchaseFSM
+
+KEYS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+BOT_ID = 123456
+errors = False
+
+
+def check(ok: bool, label: str, detail: str = "") -> None:
+    global errors
+    print("OK " if ok else "ERR", label, detail)
+    errors = errors or not ok
+
+
+def key(i: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=30_000_000 + i, user_id=30_000_000 + i)
+
+
+def rows(where: str = "") -> int:
+    conn = sqlite3.connect(seed.DB_FILE)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM fsm_states {where}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def round_trips(storage, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        k = key(i % 200)
+        await storage.set_state(k, PurchaseFSM.confirm_payment)
+        await storage.update_data(k, {"payment_id": i})
+        await storage.get_state(k)
+        await storage.get_data(k)
+    return n / (time.perf_counter() - t0)
+
+
+async def main():
+    try:
+        await run_checks()
+    finally:
+        await dispose_engines()
+
+
+async def run_checks():
+    # 1. restart
+    first = SQLiteStorage(flush_interval=0.2)
+    for i in range(KEYS):
+        await first.set_state(key(i), PurchaseFSM.upload_receipt)
+        await first.update_data(key(i), {"payment_id": i, "tariff": "pro", "plan": "1 haftalik"})
+    flushes = 0
+    while first.cache_stats()["pending"]:
+        flushes += 1
+        await asyncio.sleep(0.2)
+    await first.close()
+    second = SQLiteStorage()
+    states = [await second.get_state(key(i)) for i in range(KEYS)]
+    data = [await second.get_data(key(i)) for i in range(KEYS)]
+    check(all(s == PurchaseFSM.upload_receipt.state for s in states), "states survive a restart")
+    check(all(d["payment_id"] == i and d["tariff"] == "pro" for i, d in enumerate(data)), "data survives a restart")
+
+    # 2. batching
+    check(rows() == KEYS and flushes <= 5, "state changes written in batches",
+          f"{2 * KEYS} changes, {rows()} rows after ~{flushes} flush intervals")
+
+    # 3. LRU
+    small = SQLiteStorage(cache_size=100)
+    ok = all([(await small.get_data(key(i)))["payment_id"] == i for i in range(KEYS)])
+    check(ok and small.cache_stats()["size"] == 100, "small cache reads every key back", f"{small.cache_stats()}")
+
+    # 4. clear and TTL
+    for i in range(KEYS // 2):
+        await second.set_state(key(i), None)
+        await second.set_data(key(i), {})
+    await second.flush()
+    check(rows() == KEYS - KEYS // 2, "cleared keys deleted", f"{rows()} rows left")
+    conn = sqlite3.connect(seed.DB_FILE)
+    conn.execute("UPDATE fsm_states SET updated_at = datetime('now', '-100 hours')")
+    conn.commit()
+    conn.close()
+    await second.set_state(key(KEYS - 1), PurchaseFSM.enter_last4)
+    await second.flush()
+    removed = await second.cleanup()
+    check(removed == KEYS - KEYS // 2 - 1 and rows() == 1, "abandoned keys removed after the TTL", f"{removed} removed")
+    check(await second.get_state(key(KEYS - 2)) is None and await second.get_state(key(KEYS - 1)) == "PurchaseFSM:enter_last4",
+          "cleanup keeps recently written keys")
+    await second.close()
+    await small.close()
+
+    # 5. speed
+    memory = await round_trips(MemoryStorage(), 5000)
+    persistent = SQLiteStorage()
+    sqlite_rate = await round_trips(persistent, 5000)
+    await persistent.close()
+    print(f"get/set round trips: MemoryStorage {memory:,.0f}/s, SQLiteStorage {sqlite_rate:,.0f}/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    if errors:
+        raise SystemExit(1)
+    print("FSM STORAGE OK")
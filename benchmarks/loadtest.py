@@ -0,0 +1,283 @@
+"""
+benchmarks/loadtest.py
+
+End-to-end load test: the real Dispatcher (loader.dp with every router from
+register_all_handlers and the production middlewares) long-polls the fake Bot
+API, while synthetic users feed updates to it and walk this scenario:
+
+    /start → 🏷 Tarif sotib olish → Pro → [pro_1week] → Sotib olish
+    → receipt photo → card last 4 digits     (handlers/purchase.py FSM)
+    → 📑 Savol yozish → question text        (ask_question.process_question)
+    → [check_socials]                         (getChatMember)
+
+Each user sends its next update only after the previous one was handled, as
+a person tapping through the bot would. A probe middleware (on dp.update,
+right after the per-chat queue of middlewares/chat_queue.py) times every
+update:
+
+    handler  time from the update's turn in its chat queue: filters,
+             middlewares, handler, DB and Bot API calls it makes
+    e2e      from handing the update to the transport to the end of handling,
+             adding the getUpdates round trip (or webhook POST) and the wait
+             in the queue
+
+and the report gives p50/p95/p99 per step and overall, plus sustained
+throughput (updates handled per second of wall time). Afterwards the DB must
+hold one receipt under review and one question per user.
+
+Updates reach the dispatcher through long polling by default, or, with mode
+"webhook", as POSTs to the webhook.py server (see bench_webhook.py).
+
+Run from the repo root:
+    python benchmarks/loadtest.py [users] [concurrent] [api latency, s] [polling|webhook]
+"""
+import os
+import sys
+import time
+import asyncio
+import itertools
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List
+
+import seed
+
+# fake identities: nothing may reach the real bot or staff chats
+os.environ["BOT_TOKEN"] = "123456:FAKE-token"
+os.environ["ADMIN_ID"] = "1"
+os.environ["DOCTOR_ID"] = "2"
+
+from aiogram import BaseMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import TelegramObject
+from sqlalchemy import func, select
+
+import db
+from database import PendingPayment, Question
+from db_engine import dispose_engines
+from config import WEBHOOK_PATH, WEBHOOK_SECRET
+from loader import bot, dp, storage
+from middlewares import setup_middlewares, polling_options
+from register_all_handlers import register_all_handlers
+from broadcast_jobs import setup_broadcast_jobs
+from fake_bot_api import FakeBotAPI
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONCURRENT = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+API_LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+MODE = sys.argv[4] if len(sys.argv) > 4 else "polling"
+TG_OFFSET = 20_000_000
+UPDATE_IDS = itertools.count(1)
+
+# (step name, update builder); builders take (user id, message id)
+SCENARIO: List[tuple] = [
+    ("start", lambda u, m: message(u, m, text="/start")),
+    ("purchase menu", lambda u, m: message(u, m, text="🏷 Tarif sotib olish")),
+    ("choose tariff", lambda u, m: message(u, m, text="Pro")),
+    ("choose plan", lambda u, m: callback(u, m, "pro_1week")),
+    ("confirm payment", lambda u, m: message(u, m, text="Sotib olish")),
+    ("upload receipt", lambda u, m: message(u, m, photo=[{
+        "file_id": f"receipt-{u}", "file_unique_id": f"r{u}", "width": 800, "height": 600,
+    }])),
+    ("card last4", lambda u, m: message(u, m, text="1234")),
+    ("ask question", lambda u, m: message(u, m, text="📑 Savol yozish")),
+    ("process question", lambda u, m: message(u, m, text="Homiladorlikning 12-haftasida nimalarga e'tibor berish kerak?")),
+    ("check socials", lambda u, m: callback(u, m, "check_socials")),
+]
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def message(user_id: int, message_id: int, **content) -> Dict[str, Any]:
+    return {"message": {
+        "message_id": message_id, "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+        "from": _user(user_id), **content,
+    }}
+
+
+def callback(user_id: int, message_id: int, data: str) -> Dict[str, Any]:
+    # the button sits on a message the bot sent earlier
+    bot_message = message(user_id, message_id, text="…")["message"]
+    bot_message["from"] = {"id": 123456, "is_bot": True, "first_name": "Fake"}
+    return {"callback_query": {
+        "id": f"{user_id}-{message_id}", "from": _user(user_id), "chat_instance": str(user_id),
+        "message": bot_message, "data": data,
+    }}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of `values` (p in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class ProbeMiddleware(BaseMiddleware):
+    """Times each update and wakes whoever waits for its update_id."""
+
+    def __init__(self):
+        self.waiters: Dict[int, asyncio.Future] = {}
+        self.errors = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            waiter = self.waiters.pop(event.update_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter() - t0)
+
+
+class Run:
+    """One load run: a transport that delivers updates, and what came back."""
+
+    def __init__(self, name: str, send: Callable[[Dict[str, Any]], Awaitable[None]], first_user: int):
+        self.name = name
+        self.send = send
+        self.first_user = first_user
+        self.results: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        self.elapsed = 0.0
+
+    def values(self, kind: str) -> List[float]:
+        return [v for r in self.results.values() for v in r[kind]]
+
+
+async def run_user(run: Run, probe: ProbeMiddleware, user_id: int) -> None:
+    message_ids = itertools.count(1)
+    loop = asyncio.get_running_loop()
+    for step, build in SCENARIO:
+        update_id = next(UPDATE_IDS)
+        waiter = probe.waiters[update_id] = loop.create_future()
+        pushed = time.perf_counter()
+        await run.send({"update_id": update_id, **build(user_id, next(message_ids))})
+        handler_time = await asyncio.wait_for(waiter, 60)
+        run.results[step]["handler"].append(handler_time)
+        run.results[step]["e2e"].append(time.perf_counter() - pushed)
+
+
+async def drive(run: Run, probe: ProbeMiddleware, users: int = USERS, concurrent: int = CONCURRENT) -> Run:
+    limit = asyncio.Semaphore(concurrent)
+
+    async def one(user_id: int) -> None:
+        async with limit:
+            await run_user(run, probe, user_id)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(run.first_user + i) for i in range(1, users + 1)))
+    run.elapsed = time.perf_counter() - t0
+    return run
+
+
+def fmt(values: List[float]) -> str:
+    return "/".join(f"{percentile(values, p) * 1000:.1f}" for p in (50, 95, 99))
+
+
+def report(run: Run) -> None:
+    print(f"{'step':<18} {'n':>6}  {'handler p50/p95/p99, ms':>26}  {'e2e p50/p95/p99, ms':>24}")
+    for step, _ in SCENARIO:
+        r = run.results[step]
+        print(f"{step:<18} {len(r['handler']):>6}  {fmt(r['handler']):>26}  {fmt(r['e2e']):>24}")
+    handler = run.values("handler")
+    print(f"{'all updates':<18} {len(handler):>6}  {fmt(handler):>26}  {fmt(run.values('e2e')):>24}")
+    print(f"throughput: {len(handler) / run.elapsed:.1f} updates/s sustained "
+          f"({len(handler)} updates in {run.elapsed:.1f}s)")
+
+
+async def check_db(first_user: int, users: int = USERS) -> bool:
+    """Every user of the run ends with one receipt under review and one stored question."""
+    last_user = first_user + users
+    async with db.async_session() as session:
+        receipts = (await session.execute(
+            select(func.count()).select_from(PendingPayment).where(
+                PendingPayment.status == "under_review", PendingPayment.user_tg.between(first_user, last_user),
+            )
+        )).scalar()
+        questions = (await session.execute(
+            select(func.count()).select_from(Question).where(Question.user_tg.between(first_user, last_user))
+        )).scalar()
+    ok = receipts == users and questions == users
+    print("OK " if ok else "ERR", f"{receipts} receipts under review, {questions} questions for {users} users")
+    return ok
+
+
+def setup_dispatcher(api: FakeBotAPI) -> ProbeMiddleware:
+    """Point loader.bot at the fake API and build the production dispatcher around a probe."""
+    bot.session.api = TelegramAPIServer.from_base(api.base_url)
+    register_all_handlers(dp)
+    setup_middlewares(dp)
+    setup_broadcast_jobs(dp)
+    # after the chat queue (middlewares/chat_queue.py): the probe sees an update when its turn comes
+    probe = ProbeMiddleware()
+    dp.update.outer_middleware(probe)
+    return probe
+
+
+async def polling_run(api: FakeBotAPI, probe: ProbeMiddleware, first_user: int = TG_OFFSET) -> Run:
+    """Updates queued on the fake API and fetched by dp.start_polling (getUpdates)."""
+    async def send(update: Dict[str, Any]) -> None:
+        api.push_update(update)
+
+    polling = asyncio.create_task(dp.start_polling(bot, polling_timeout=1, handle_signals=False,
+                                                   close_bot_session=False, **polling_options(dp)))
+    try:
+        return await drive(Run("polling", send, first_user), probe)
+    finally:
+        await dp.stop_polling()
+        await asyncio.gather(polling, return_exceptions=True)
+
+
+async def webhook_run(api: FakeBotAPI, probe: ProbeMiddleware, first_user: int = TG_OFFSET) -> Run:
+    """Updates POSTed to webhook.start_webhook's server, as Telegram would."""
+    from aiohttp import ClientSession
+    from webhook import start_webhook
+
+    runner = await start_webhook(dp, bot, base_url="https://bot.invalid", host="127.0.0.1", port=0)
+    host, port = runner.addresses[0][:2]
+    url = f"http://{host}:{port}{WEBHOOK_PATH}"
+    async with ClientSession() as http:
+        async def send(update: Dict[str, Any]) -> None:
+            async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}) as r:
+                if r.status != 200:
+                    raise RuntimeError(f"webhook answered {r.status}")
+
+        try:
+            async with http.post(url, json={"update_id": 0}) as r:
+                print("OK " if r.status == 401 else "ERR", f"request without the secret token: {r.status}")
+            return await drive(Run("webhook", send, first_user), probe)
+        finally:
+            await runner.cleanup()
+
+
+async def main(mode: str) -> bool:
+    async with FakeBotAPI(latency=API_LATENCY, global_rate=None, per_chat_interval=None) as api:
+        probe = setup_dispatcher(api)
+        try:
+            print(f"{mode}: {USERS} users, {CONCURRENT} at a time, fake API latency {API_LATENCY * 1000:.0f} ms")
+            run = await (webhook_run if mode == "webhook" else polling_run)(api, probe)
+            report(run)
+            print("Bot API calls:", ", ".join(f"{m} {n}" for m, n in sorted(api.calls.items())))
+            ok = probe.errors == 0
+            print("OK " if ok else "ERR", f"{probe.errors} updates raised")
+            return await check_db(run.first_user) and ok
+        finally:
+            await storage.close()
+            await bot.session.close()
+            await dispose_engines()
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main(MODE)):
+        raise SystemExit(1)
@@ -0,0 +1,121 @@
+"""
+benchmarks/seed.py
+
+Shared helpers for the benchmark scripts: a throwaway SQLite file with the
+bot's schema and fast synthetic data, so benchmarks never touch bot.db.
+
+Import this module before anything from the project: it points
+DATABASE_URL at the temp file (db_engine reads it at import time) and gives
+that file the bot's schema. Importing the project touches no database, so the
+schema is made by database.init_schema(), in a child process to keep config
+unread until the benchmark has set its environment.
+"""
+import os
+import sys
+import random
+import sqlite3
+import subprocess
+import tempfile
+import datetime as dt
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="botbench_"))
+DB_FILE = TMP_DIR / "bench.db"
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_FILE}"
+subprocess.run([sys.executable, "-c", "from database import init_schema; init_schema()"], cwd=ROOT, check=True)
+
+TARIFFS = ["pro", "premium", "pregnancy", "farzand ko‘rishni rejalashtirish", None]
+PLANS = ["1 haftalik", "1 oylik", "homiladorlik 1 oy", "homiladorlik 9 oy"]
+
+
+def fresh_db(name: str) -> Path:
+    """Create an empty database file with the bot's tables and return its path."""
+    from sqlalchemy import create_engine
+    from database import Base
+
+    path = TMP_DIR / f"{name}.db"
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return path
+
+
+def seed_users(path: Path, n: int, tg_offset: int = 10_000_000, days: int = 365, seed: int = 1) -> None:
+    """Insert `n` users spread over the last `days` days; ~1/3 referred by an earlier user."""
+    rnd = random.Random(seed)
+    now = dt.datetime.utcnow()
+    conn = sqlite3.connect(path)
+    rows = []
+    for i in range(1, n + 1):
+        created = now - dt.timedelta(seconds=rnd.randint(0, days * 86400))
+        tariff = rnd.choice(TARIFFS)
+        end = (now + dt.timedelta(days=rnd.randint(-60, 300))) if tariff else None
+        rows.append((
+            i, tg_offset + i, f"User {i}", f"+99890{i:07d}", tariff,
+            created if tariff else None, end,
+            rnd.choice([0, 0, 0, 1000, 29000]),
+            rnd.randint(1, i - 1) if i > 1 and rnd.random() < 0.33 else None,
+            created, now - dt.timedelta(seconds=rnd.randint(0, 30 * 86400)),
+        ))
+        if len(rows) >= 50_000:
+            _insert_users(conn, rows)
+            rows = []
+    if rows:
+        _insert_users(conn, rows)
+    # the app keeps referrals_registered equal to the number of referred users
+    conn.execute(
+        "UPDATE users SET referrals_registered = "
+        "(SELECT COUNT(*) FROM users AS r WHERE r.referred_by = users.id) WHERE id <= ?", (n,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def _insert_users(conn: sqlite3.Connection, rows) -> None:
+    conn.executemany(
+        "INSERT INTO users (id, telegram_id, full_name, phone, tariff, tariff_start, tariff_end, "
+        "bonus_balance, referred_by, created_at, last_active, daily_remaining, weekly_remaining, "
+        "monthly_remaining, referrals_added, referrals_registered) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0, 0, 0)",
+        rows,
+    )
+    conn.commit()
+
+
+def seed_payments(path: Path, n: int, users: int, tg_offset: int = 10_000_000, days: int = 365, seed: int = 2) -> None:
+    """Insert `n` pending_payments rows for random users; ~60% approved."""
+    rnd = random.Random(seed)
+    now = dt.datetime.utcnow()
+    statuses = ["approved"] * 6 + ["declined", "under_review", "awaiting_receipt", "awaiting_payment"]
+    conn = sqlite3.connect(path)
+    rows = []
+    for _ in range(n):
+        created = now - dt.timedelta(seconds=rnd.randint(0, days * 86400))
+        status = rnd.choice(statuses)
+        price = rnd.choice([9000, 19000, 29000, 59000, 99000, 199000, 349000])
+        rows.append((
+            tg_offset + rnd.randint(1, users), rnd.choice(TARIFFS[:-1]), rnd.choice(PLANS),
+            price, 0, price, status, created,
+            created + dt.timedelta(minutes=rnd.randint(1, 600)) if status == "approved" else None,
+        ))
+        if len(rows) >= 100_000:
+            _insert_payments(conn, rows)
+            rows = []
+    if rows:
+        _insert_payments(conn, rows)
+    conn.close()
+
+
+def _insert_payments(conn: sqlite3.Connection, rows) -> None:
+    conn.executemany(
+        'INSERT INTO pending_payments (user_tg, tariff, "plan", base_price, bonus_applied, payable, '
+        "status, created_at, approved_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
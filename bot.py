@@ -3,8 +3,12 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from loader import dp, bot  # loader.py dan bot va dp ni olamiz
 from handlers import register_all_handlers
+from db import init_db
 
 async def main():
+    # Jadvallar va migratsiyalar (import paytida emas, shu yerda)
+    await init_db()
+
     # Barcha handlerlarni ro‘yxatdan o‘tkazamiz
     register_all_handlers(dp)
 
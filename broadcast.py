@@ -1,12 +1,294 @@
+"""
+broadcast.py
+
+Broadcast engine used by the admin broadcast handlers.
+
+A producer streams chat ids (usually from db.iter_recipients) into a bounded
+queue; a pool of worker tasks sends the payload to each chat. Every API call
+first passes a BroadcastLimiter: a global token bucket (BROADCAST_RATE
+messages/second) and a per-chat gap (BROADCAST_PER_CHAT_INTERVAL), so a
+payload of several messages to one chat never trips Telegram's flood limits.
+By default that is delivery.limiter, shared with the bot's send path, which
+also retries 429s and flags users who blocked the bot.
+
+Payloads that must survive a restart (broadcast_jobs.py) are stored as plain
+dict specs and rebuilt with payload_from_dict. spec_from_messages composes one
+from whatever the admin sent: text, a photo/video/document/..., an album, or
+(for anything else) a copy of the message. Media go out by the file_id Telegram
+already holds, so each recipient costs one API call (plus the optional sticker).
+"""
+import html
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Optional, Sequence
+
 from aiogram import Bot
-from sqlalchemy.ext.asyncio import AsyncSession
+from aiogram.methods import (
+    CopyMessage, SendAnimation, SendAudio, SendDocument, SendMediaGroup, SendMessage, SendPhoto, SendSticker,
+    SendVideo, SendVoice,
+)
+from aiogram.methods.base import TelegramMethod
+from aiogram.types import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message
+
+from config import BROADCAST_WORKERS, ALBUM_COLLECT_SECONDS
+from delivery import limiter as shared_limiter
+from utils.ratelimit import BroadcastLimiter
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> the API calls to make for that chat, in order
+Payload = Callable[[int], Sequence[TelegramMethod]]
+# called once per chat with the error that stopped it (None when every call succeeded)
+ResultCallback = Callable[[int, Optional[Exception]], Awaitable[None]]
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return (self.sent + self.failed) / self.elapsed if self.elapsed else 0.0
+
+
+def text_payload(text: str, sticker: Optional[str] = None, **kwargs) -> Payload:
+    """Optional sticker, then `text` (extra kwargs go to sendMessage, e.g. parse_mode)."""
+    def build(chat_id: int) -> Sequence[TelegramMethod]:
+        calls = []
+        if sticker:
+            calls.append(SendSticker(chat_id=chat_id, sticker=sticker))
+        calls.append(SendMessage(chat_id=chat_id, text=text, **kwargs))
+        return calls
+    return build
+
+
+# message attribute -> send method for a single media message
+MEDIA_METHODS = {
+    "photo": SendPhoto,
+    "video": SendVideo,
+    "document": SendDocument,
+    "animation": SendAnimation,
+    "audio": SendAudio,
+    "voice": SendVoice,
+}
+# album item kind -> InputMedia type for sendMediaGroup
+ALBUM_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+
+def text_spec(text: str, sticker: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """JSON-serializable form of text_payload(text, sticker, **kwargs)."""
+    return {"type": "text", "text": text, "sticker": sticker, "options": kwargs}
+
+
+def media_spec(kind: str, file_id: str, caption: Optional[str] = None, sticker: Optional[str] = None,
+               **kwargs) -> Dict[str, Any]:
+    """One photo/video/document/animation/audio/voice by file_id (kwargs go to the send method)."""
+    return {"type": "media", "kind": kind, "file_id": file_id, "caption": caption, "sticker": sticker,
+            "options": kwargs}
+
+
+def album_spec(items: Sequence[Dict[str, Any]], sticker: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """An album as [{kind, file_id, caption}, ...]; kwargs (e.g. parse_mode) apply to every caption."""
+    return {"type": "album", "items": list(items), "sticker": sticker, "options": kwargs}
+
+
+def copy_spec(from_chat_id: int, message_id: int, sticker: Optional[str] = None) -> Dict[str, Any]:
+    """
+    copyMessage of an existing message, for content the other specs don't cover
+    (location, poll, video note, ...). The source must stay until the job is done.
+    """
+    return {"type": "copy", "from_chat_id": from_chat_id, "message_id": message_id, "sticker": sticker}
+
+
+def _media_of(message: Message):
+    """(kind, file_id) of a media message, or None."""
+    for kind in MEDIA_METHODS:
+        media = getattr(message, kind, None)
+        if media:
+            # photos come as a list of sizes, largest last
+            return kind, (media[-1] if isinstance(media, list) else media).file_id
+    return None
+
+
+def spec_from_messages(messages: Sequence[Message], prefix: str = "", sticker: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Payload spec for what the admin sent: one message, or every message of an
+    album. `prefix` (plain text, e.g. a signature) goes before the text or the
+    first caption; formatting is kept by re-sending as HTML.
+    """
+    messages = sorted(messages, key=lambda m: m.message_id)
+    first = messages[0]
+
+    def with_prefix(m: Message) -> Optional[str]:
+        body = m.html_text if (m.text or m.caption) else ""
+        return (html.escape(prefix) + body).strip() or None
+
+    if len(messages) > 1:
+        items = []
+        for i, m in enumerate(messages):
+            kind, file_id = _media_of(m) or (None, None)
+            if kind not in ALBUM_MEDIA:
+                raise ValueError(f"Unsupported album item in message {m.message_id}")
+            items.append({"kind": kind, "file_id": file_id, "caption": with_prefix(m) if i == 0 else (
+                m.html_text if m.caption else None)})
+        return album_spec(items, sticker=sticker, parse_mode="HTML")
+    if first.text:
+        return text_spec(with_prefix(first), sticker=sticker, parse_mode="HTML")
+    media = _media_of(first)
+    if media:
+        caption = with_prefix(first)
+        return media_spec(media[0], media[1], caption=caption, sticker=sticker, parse_mode="HTML")
+    return copy_spec(first.chat.id, first.message_id, sticker=sticker)
+
+
+# media_group_id -> album messages received so far (see collect_album)
+_albums: Dict[str, list] = {}
+
+
+async def collect_album(message: Message, album: Optional[list] = None,
+                        wait: float = ALBUM_COLLECT_SECONDS) -> Optional[list]:
+    """
+    Telegram delivers an album as separate messages sharing a media_group_id.
+    The handler call for the first one waits `wait` seconds and gets them all;
+    calls for the rest get None and should return. Plain messages come back as [message].
+    With the chat queue on, AlbumMiddleware (middlewares/chat_queue.py) has
+    collected the album already and the handler passes its `album` argument on.
+    """
+    if album is not None:
+        return album
+    group_id = message.media_group_id
+    if not group_id:
+        return [message]
+    first = group_id not in _albums
+    _albums.setdefault(group_id, []).append(message)
+    if not first:
+        return None
+    await asyncio.sleep(wait)
+    return _albums.pop(group_id)
+
+
+def payload_from_dict(spec: Dict[str, Any]) -> Payload:
+    """Rebuild a payload from its stored spec."""
+    kind = spec.get("type")
+    sticker = spec.get("sticker")
+    options = spec.get("options", {})
+    if kind == "text":
+        return text_payload(spec["text"], sticker=sticker, **options)
+
+    if kind == "media":
+        method = MEDIA_METHODS[spec["kind"]]
+
+        def message(chat_id: int) -> TelegramMethod:
+            return method(chat_id=chat_id, caption=spec.get("caption"), **{spec["kind"]: spec["file_id"]}, **options)
+    elif kind == "album":
+        media = [
+            ALBUM_MEDIA[item["kind"]](media=item["file_id"], caption=item.get("caption"), **options)
+            for item in spec["items"]
+        ]
+
+        def message(chat_id: int) -> TelegramMethod:
+            return SendMediaGroup(chat_id=chat_id, media=media)
+    elif kind == "copy":
+        def message(chat_id: int) -> TelegramMethod:
+            return CopyMessage(chat_id=chat_id, from_chat_id=spec["from_chat_id"], message_id=spec["message_id"])
+    else:
+        raise ValueError(f"Unknown broadcast payload type: {kind!r}")
+
+    def build(chat_id: int) -> Sequence[TelegramMethod]:
+        if sticker:
+            return [SendSticker(chat_id=chat_id, sticker=sticker), message(chat_id)]
+        return [message(chat_id)]
+    return build
+
+
+async def run_broadcast(
+    bot: Bot,
+    recipients: AsyncIterable[int],
+    payload: Payload,
+    workers: int = BROADCAST_WORKERS,
+    limiter: Optional[BroadcastLimiter] = None,
+    on_result: Optional[ResultCallback] = None,
+    stop: Optional[asyncio.Event] = None,
+) -> BroadcastStats:
+    """
+    Send `payload` to every chat id from `recipients`; a chat counts as sent when
+    all its calls succeed. `on_result` is awaited after each chat. Once `stop` is
+    set, chats still waiting in the queue are dropped without a result. If
+    `on_result` (or `recipients`) raises, sending stops and the error is raised.
+    """
+    limiter = limiter or shared_limiter
+    stats = BroadcastStats()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+    started = time.monotonic()
+
+    async def deliver(chat_id: int) -> None:
+        error = None
+        try:
+            for method in payload(chat_id):
+                await limiter.acquire(chat_id)
+                await bot(method)
+            stats.sent += 1
+        except Exception as e:
+            error = e
+            stats.failed += 1
+            logger.warning("Broadcast to %s failed: %s", chat_id, e)
+        if on_result is not None:
+            await on_result(chat_id, error)
+
+    async def worker() -> None:
+        while True:
+            chat_id = await queue.get()
+            try:
+                if chat_id is None:
+                    return
+                if stop is None or not stop.is_set():
+                    await deliver(chat_id)
+            finally:
+                queue.task_done()
+
+    async def produce() -> None:
+        async for chat_id in recipients:
+            if chat_id:
+                await queue.put(int(chat_id))
+        for _ in consumers:
+            await queue.put(None)
+
+    consumers = [asyncio.create_task(worker()) for _ in range(max(1, int(workers)))]
+    tasks = [asyncio.create_task(produce()), *consumers]
+    try:
+        # a dead worker would leave the producer blocked on the full queue: stop at the first error
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        stats.elapsed = time.monotonic() - started
+    return stats
+
+
+async def send_broadcast(bot: Bot, text: str) -> BroadcastStats:
+    """Send `text` to every user."""
+    from db import iter_recipients
+
+    async def chat_ids():
+        async for row in iter_recipients():
+            yield row.telegram_id
+
+    return await run_broadcast(bot, chat_ids(), text_payload(text))
 
-from db import async_session  # Assuming async_session is a sessionmaker configured elsewhere and imported here
 
-async def send_broadcast(bot: Bot, text: str):
-    async with async_session() as session:  # noqa: N806
-        async with session.begin():
-            # Retrieve recipients, then send messages
-            recipients = await get_recipients(session)  
-    for user_id in recipients:
-        await bot.send_message(user_id, text)
\ No newline at end of file
+__all__ = [
+    "BroadcastStats", "Payload", "ResultCallback", "text_payload", "text_spec", "media_spec", "album_spec",
+    "copy_spec", "spec_from_messages", "collect_album", "payload_from_dict", "run_broadcast", "send_broadcast",
+]
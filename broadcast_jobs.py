@@ -0,0 +1,328 @@
+"""
+broadcast_jobs.py
+
+Broadcasts as persistent jobs (tables broadcast_jobs / broadcast_recipients).
+
+A job stores its payload spec, its audience (segments.Segment, counted when
+the job is created), a recipient cursor (users.id) and one result row per
+recipient. The runner streams the recipients after the cursor through
+broadcast.run_broadcast and checkpoints every BROADCAST_CHECKPOINT_SIZE
+results: the batch of result rows and the new cursor commit together. The
+cursor only moves past recipients whose result is in the batch, so after a
+restart a job still marked 'running' resumes from its last checkpoint; rows
+past the cursor that already have a result are skipped. Only chats sent after
+the last checkpoint of a process that died can get the message twice.
+
+While a job runs, its progress message (sent / blocked / failed, rate, ETA)
+is edited in place every BROADCAST_PROGRESS_SECONDS, at most; each edit takes
+a token from the shared send budget. Failures are counted per error class
+(delivery.error_class) and stored with the job at every checkpoint.
+
+Admins pause, resume and cancel with pause_job / resume_job / cancel_job. The
+status changes in the database; a runner in this process is also signalled
+directly, a runner anywhere else stops at its next checkpoint. Chats that
+already hold a rate-limit slot still go out; queued ones wait for resume.
+"""
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramBadRequest
+
+from config import ADMIN_ID, BROADCAST_CHECKPOINT_SIZE, BROADCAST_PROGRESS_SECONDS
+from broadcast import payload_from_dict, run_broadcast
+from delivery import error_class, limiter as shared_limiter
+from keyboards.inline.admin_panel import broadcast_job_kb
+from segments import Segment
+from db import (
+    iter_recipients, count_recipients, create_broadcast_job, get_broadcast_job, list_broadcast_jobs,
+    set_broadcast_job_status, set_broadcast_progress_message, get_broadcast_recipient_ids,
+    checkpoint_broadcast_job,
+)
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("running", "paused")
+JOB_STATUS_LABELS = {
+    "running": "yuborilmoqda",
+    "paused": "to'xtatilgan",
+    "cancelled": "bekor qilingan",
+    "done": "yakunlangan",
+}
+
+# job_id -> runner task / stop signal, for jobs running in this process
+_tasks: Dict[int, asyncio.Task] = {}
+_stops: Dict[int, asyncio.Event] = {}
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} soat {seconds % 3600 // 60} daq"
+    if seconds >= 60:
+        return f"{seconds // 60} daq {seconds % 60} s"
+    return f"{seconds} s"
+
+
+def progress_text(job: Dict[str, Any], rate: Optional[float] = None) -> str:
+    """Progress message body: counters, and rate/ETA while running, error classes once stopped."""
+    done = job["sent"] + job["blocked"] + job["failed"]
+    lines = [
+        f"📨 Xabar #{job['id']} — {JOB_STATUS_LABELS.get(job['status'], job['status'])}",
+        f"👥 {Segment.from_dict(job.get('audience')).describe()}",
+        f"📊 {done}" + (f" / {job['total']}" if job.get("total") else ""),
+        f"✅ Yuborildi: {job['sent']}",
+        f"🚫 Bloklagan: {job['blocked']}",
+        f"❌ Xato: {job['failed']}",
+    ]
+    if rate:
+        line = f"⚡ {rate:.1f} ta/s"
+        if job.get("total") and job["total"] > done:
+            line += f" · ⏳ ~{_duration((job['total'] - done) / rate)} qoldi"
+        lines.append(line)
+    if job["status"] != "running" and job.get("errors"):
+        by_count = sorted(job["errors"].items(), key=lambda kv: -kv[1])
+        lines.append("Xato turlari: " + ", ".join(f"{name} {n}" for name, n in by_count))
+    return "\n".join(lines)
+
+
+async def _edit_progress(bot: Bot, job: Dict[str, Any], rate: Optional[float] = None,
+                         last_text: Optional[str] = None) -> Optional[str]:
+    """Edit the job's progress message in place (one rate-limited call, skipped if nothing changed)."""
+    if not job.get("progress_message_id"):
+        return last_text
+    text = progress_text(job, rate)
+    if text == last_text:
+        return last_text
+    # the edit spends a token of the same budget as the broadcast itself
+    await shared_limiter.bucket.acquire()
+    try:
+        await bot.edit_message_text(
+            text, chat_id=job["progress_chat_id"], message_id=job["progress_message_id"],
+            reply_markup=broadcast_job_kb(job["id"], job["status"]),
+        )
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            logger.warning("Progress edit for job %s failed: %s", job["id"], e)
+    except Exception as e:
+        logger.warning("Progress edit for job %s failed: %s", job["id"], e)
+    return text
+
+
+async def run_job(bot: Bot, job_id: int, stop: Optional[asyncio.Event] = None,
+                  checkpoint_size: int = BROADCAST_CHECKPOINT_SIZE,
+                  progress_interval: float = BROADCAST_PROGRESS_SECONDS) -> Optional[str]:
+    """Deliver a running job from its checkpoint until it is done or stopped; returns its status."""
+    job = await get_broadcast_job(job_id)
+    if not job or job["status"] != "running":
+        return job["status"] if job else None
+    stop = stop or asyncio.Event()
+    payload = payload_from_dict(job["payload"])
+    audience = Segment.from_dict(job["audience"]).criteria()
+    already_done = await get_broadcast_recipient_ids(job_id, after_id=job["cursor"])
+
+    # users.id -> finished?, in recipient order: the cursor only passes a finished prefix
+    window: "OrderedDict[int, bool]" = OrderedDict()
+    user_of_chat: Dict[int, int] = {}
+    results: List[Dict[str, Any]] = []
+    # live counters for the progress message; the database catches up at each checkpoint
+    live = dict(job, errors=Counter(job["errors"]))
+    state = {"cursor": job["cursor"], "status": "running"}
+    lock = asyncio.Lock()
+
+    async def checkpoint() -> None:
+        nonlocal results
+        while window and next(iter(window.values())):
+            state["cursor"], _ = window.popitem(last=False)
+        batch, results = results, []
+        status = await checkpoint_broadcast_job(job_id, state["cursor"], batch, dict(live["errors"]))
+        state["status"] = status or "cancelled"
+        if state["status"] != "running":
+            stop.set()
+
+    async def chat_ids():
+        async for row in iter_recipients(*audience, after_id=job["cursor"]):
+            if stop.is_set():
+                return
+            if row.id in already_done or not row.telegram_id:
+                continue
+            window[row.id] = False
+            user_of_chat[row.telegram_id] = row.id
+            yield row.telegram_id
+
+    async def on_result(chat_id: int, error: Optional[Exception]) -> None:
+        user_id = user_of_chat.pop(chat_id)
+        window[user_id] = True
+        if error is None:
+            status = "sent"
+        else:
+            kind = error_class(error)
+            status = "blocked" if kind == "unreachable" else "failed"
+            live["errors"][kind] += 1
+        live[status] += 1
+        results.append({
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "status": status,
+            "error": None if error is None else str(error)[:200],
+        })
+        if len(results) >= checkpoint_size:
+            async with lock:
+                if len(results) >= checkpoint_size:
+                    await checkpoint()
+
+    async def report_progress() -> None:
+        started, done_before = time.monotonic(), live["sent"] + live["blocked"] + live["failed"]
+        last_text = None
+        while True:
+            await asyncio.sleep(progress_interval)
+            done = live["sent"] + live["blocked"] + live["failed"] - done_before
+            last_text = await _edit_progress(bot, live, done / (time.monotonic() - started), last_text)
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await run_broadcast(bot, chat_ids(), payload, on_result=on_result, stop=stop)
+    finally:
+        reporter.cancel()
+    async with lock:
+        await checkpoint()
+
+    if state["status"] == "running" and not stop.is_set():
+        await set_broadcast_job_status(job_id, "done", "running")
+        state["status"] = "done"
+        await _notify_done(bot, job_id)
+    # stopped by shutdown: the job stays 'running' and resumes on the next start
+    final = await get_broadcast_job(job_id)
+    if final:
+        await _edit_progress(bot, final)
+    return state["status"]
+
+
+async def _notify_done(bot: Bot, job_id: int) -> None:
+    job = await get_broadcast_job(job_id)
+    try:
+        if job["created_by"]:
+            await bot.send_message(
+                job["created_by"],
+                f"✅ Xabar #{job_id}: {job['sent']} ta foydalanuvchiga yuborildi"
+                + (f", {job['blocked'] + job['failed']} ta yuborilmadi." if job["blocked"] + job["failed"] else "."),
+            )
+        if job["sent"] == 0 and job["payload"].get("text"):
+            # nobody got it: send a test copy to the admin so they still see the content
+            await bot.send_message(ADMIN_ID, f"[TEST BROADCAST]\n{job['payload']['text']}")
+    except Exception as e:
+        logger.warning("Could not report broadcast job %s: %s", job_id, e)
+
+
+async def start_job(bot: Bot, job_id: int) -> asyncio.Task:
+    """Run `job_id` in a background task of this process (waits for a previous runner to drain)."""
+    previous = _tasks.get(job_id)
+    if previous is not None and not previous.done():
+        await asyncio.wait([previous])
+    stop = _stops[job_id] = asyncio.Event()
+    task = asyncio.create_task(run_job(bot, job_id, stop))
+    _tasks[job_id] = task
+
+    def _finished(t: asyncio.Task) -> None:
+        if _tasks.get(job_id) is t:
+            _tasks.pop(job_id, None)
+            _stops.pop(job_id, None)
+        if not t.cancelled() and t.exception() is not None:
+            # the job stays 'running' in the database and resumes on the next start
+            logger.error("Broadcast job %s crashed", job_id, exc_info=t.exception())
+
+    task.add_done_callback(_finished)
+    return task
+
+
+async def create_job(bot: Bot, spec: Dict[str, Any], created_by: Optional[int] = None,
+                     progress_chat_id: Optional[int] = None, audience: Optional[Segment] = None) -> int:
+    """
+    Store a new job for payload `spec` (see broadcast.spec_from_messages) sent to
+    `audience` (everyone if None), post its progress message to
+    `progress_chat_id` and start sending.
+    """
+    audience = audience or Segment()
+    total = await count_recipients(*audience.criteria())
+    job_id = await create_broadcast_job(
+        spec, created_by, total, audience=None if audience.is_everyone else audience.to_dict(),
+    )
+    if progress_chat_id:
+        try:
+            message = await bot.send_message(
+                progress_chat_id, progress_text(await get_broadcast_job(job_id)),
+                reply_markup=broadcast_job_kb(job_id, "running"),
+            )
+            await set_broadcast_progress_message(job_id, progress_chat_id, message.message_id)
+        except Exception as e:
+            logger.warning("Could not post progress message for job %s: %s", job_id, e)
+    await start_job(bot, job_id)
+    return job_id
+
+
+async def pause_job(job_id: int) -> bool:
+    if not await set_broadcast_job_status(job_id, "paused", "running"):
+        return False
+    if job_id in _stops:
+        _stops[job_id].set()
+    return True
+
+
+async def resume_job(bot: Bot, job_id: int) -> bool:
+    if not await set_broadcast_job_status(job_id, "running", "paused"):
+        return False
+    await start_job(bot, job_id)
+    return True
+
+
+async def cancel_job(job_id: int) -> bool:
+    if not await set_broadcast_job_status(job_id, "cancelled", *ACTIVE_STATUSES):
+        return False
+    if job_id in _stops:
+        _stops[job_id].set()
+    return True
+
+
+async def resume_interrupted_jobs(bot: Bot) -> List[int]:
+    """Restart every job left 'running' by a previous process."""
+    job_ids = [job["id"] for job in await list_broadcast_jobs("running", limit=1000)]
+    for job_id in reversed(job_ids):
+        if job_id not in _tasks:
+            await start_job(bot, job_id)
+            logger.info("Resumed broadcast job %s", job_id)
+    return job_ids
+
+
+async def stop_all_jobs(timeout: float = 10.0) -> None:
+    """Stop local runners at a checkpoint without changing their status (they resume on the next start)."""
+    for stop in _stops.values():
+        stop.set()
+    tasks = [t for t in _tasks.values() if not t.done()]
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+
+
+def setup_broadcast_jobs(dp: Dispatcher, resume: bool = True) -> None:
+    """
+    Resume interrupted jobs on startup (unless resume=False: with several worker
+    processes only the leader does) and checkpoint running ones on shutdown.
+    """
+    async def _on_startup(bot: Bot):
+        try:
+            await resume_interrupted_jobs(bot)
+        except Exception:
+            logger.exception("Could not resume broadcast jobs")
+
+    if resume:
+        dp.startup.register(_on_startup)
+    dp.shutdown.register(stop_all_jobs)
+
+
+__all__ = [
+    "run_job", "start_job", "create_job", "pause_job", "resume_job", "cancel_job",
+    "resume_interrupted_jobs", "stop_all_jobs", "setup_broadcast_jobs", "progress_text",
+    "ACTIVE_STATUSES", "JOB_STATUS_LABELS",
+]
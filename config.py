@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
 # Load .env file if present (no error if missing)
@@ -40,11 +41,104 @@ STICKER_SOCIALS = os.getenv("STICKER_SOCIALS", None)
 # Misc: retry/timeouts or other configurable values (optional)
 HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "15"))
 
+# SQLite tuning (applied by db_engine.py to every connection)
+# DATABASE_URL defaults to bot.db next to the code; override for tests/benchmarks.
+DATABASE_URL = os.getenv("DATABASE_URL", None)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+# One DB session per update, injected into handlers as `session` (0 = every helper opens its own)
+DB_SESSION_PER_UPDATE = os.getenv("DB_SESSION_PER_UPDATE", "1") not in ("0", "false", "no")
+
+# How often buffered users.last_active values are written (seconds)
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "5"))
+
+# get_user_by_tg cache: max cached users and seconds before an entry is re-read (off with BOT_WORKERS > 1)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Expired tariffs are cleared this many users per write transaction
+EXPIRY_CHUNK_SIZE = int(os.getenv("EXPIRY_CHUNK_SIZE", "500"))
+
+# Rows fetched per query when streaming broadcast recipients
+RECIPIENT_BATCH_SIZE = int(os.getenv("RECIPIENT_BATCH_SIZE", "1000"))
+
+# Broadcast engine: global messages/second, concurrent senders, min seconds between calls to one chat
+# (a little over Telegram's 1/s so network jitter cannot bunch two calls together)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "32"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.2"))
+# Broadcasts lead with STICKER_TARIFF only if enabled: the sticker is a second API call per recipient
+BROADCAST_WITH_STICKER = os.getenv("BROADCAST_WITH_STICKER", "0").lower() in ("1", "true", "yes")
+# Seconds to wait for the rest of an album after its first message arrives
+ALBUM_COLLECT_SECONDS = float(os.getenv("ALBUM_COLLECT_SECONDS", "1.0"))
+# Times one API call is retried after a 429 (TelegramRetryAfter) before giving up
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+# Broadcast jobs commit per-recipient results and their cursor every N recipients
+BROADCAST_CHECKPOINT_SIZE = int(os.getenv("BROADCAST_CHECKPOINT_SIZE", "100"))
+# Minimum seconds between edits of a broadcast's live progress message
+BROADCAST_PROGRESS_SECONDS = float(os.getenv("BROADCAST_PROGRESS_SECONDS", "5"))
+
+# How updates arrive: "polling" (getUpdates) or "webhook" (Telegram POSTs them to WEBHOOK_URL + WEBHOOK_PATH)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Public https base URL Telegram can reach, e.g. https://bot.example.com (webhook mode only)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram sends this back in X-Telegram-Bot-Api-Secret-Token; requests without it get 401.
+# Defaults to a digest of the token, so it is stable across restarts and processes.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+# Local address the webhook server listens on (PORT is what most PaaS hosts provide)
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", os.getenv("PORT", "8080")))
+# Updates processed at once in webhook mode; further requests wait before being acknowledged
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", "100"))
+# Parallel HTTPS connections Telegram may open to the webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Updates of one chat run one at a time, in order; at most UPDATE_MAX_CONCURRENT chats run at once
+# (0 = off: every update runs as soon as it arrives; not allowed with BOT_WORKERS > 1). Past
+# UPDATE_MAX_PENDING accepted updates, polling stops fetching and webhook requests wait (middlewares/chat_queue.py)
+UPDATE_MAX_CONCURRENT = int(os.getenv("UPDATE_MAX_CONCURRENT", "32"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "500"))
+
+# FSM storage: "sqlite" keeps conversation states in the database (survive restarts, shared by workers), "memory" does not
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+# States kept in the in-process LRU cache, and how often changed states are written out (seconds)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_SECONDS = float(os.getenv("FSM_FLUSH_SECONDS", "1.0"))
+# States not written for this many hours are abandoned flows and get deleted
+FSM_STATE_TTL_HOURS = float(os.getenv("FSM_STATE_TTL_HOURS", "72"))
+
+# Bot API server base URL; empty = api.telegram.org (set it for a self-hosted telegram-bot-api server)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Worker processes: above 1, main.py supervises this many workers and routes each chat's updates to one of them
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Worker i listens on 127.0.0.1:WORKER_BASE_PORT + i for updates forwarded by the supervisor
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Set by the supervisor in each worker's environment (-1 = not a worker); worker 0 is the leader
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "-1"))
+
+# Prometheus /metrics endpoint, local only; 0 = off. Worker i of a multi-process bot serves METRICS_PORT + 1 + i
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+
 # Expose __all__ for clarity
 __all__ = [
     "BOT_TOKEN", "ADMIN_ID", "DOCTOR_ID",
     "PAYMENT_CARD", "PAYMENT_CARD_HOLDER",
     "STRIPE_PROVIDER_TOKEN", "PAYMENT_CURRENCY",
     "STICKER_WELCOME", "STICKER_TARIFF", "STICKER_SOCIALS",
-    "HTTP_TIMEOUT"
+    "HTTP_TIMEOUT",
+    "DATABASE_URL", "SQLITE_BUSY_TIMEOUT_MS", "SQLITE_MMAP_SIZE", "DB_READ_POOL_SIZE",
+    "DB_SESSION_PER_UPDATE",
+    "ACTIVITY_FLUSH_SECONDS", "USER_CACHE_SIZE", "USER_CACHE_TTL",
+    "EXPIRY_CHUNK_SIZE", "RECIPIENT_BATCH_SIZE",
+    "BROADCAST_RATE", "BROADCAST_WORKERS", "BROADCAST_PER_CHAT_INTERVAL", "BROADCAST_CHECKPOINT_SIZE",
+    "BROADCAST_PROGRESS_SECONDS", "SEND_MAX_RETRIES", "BROADCAST_WITH_STICKER", "ALBUM_COLLECT_SECONDS",
+    "BOT_MODE", "WEBHOOK_URL", "WEBHOOK_PATH", "WEBHOOK_SECRET", "WEBAPP_HOST", "WEBAPP_PORT",
+    "WEBHOOK_MAX_CONCURRENT", "WEBHOOK_MAX_CONNECTIONS", "UPDATE_MAX_CONCURRENT", "UPDATE_MAX_PENDING",
+    "FSM_STORAGE", "FSM_CACHE_SIZE", "FSM_FLUSH_SECONDS", "FSM_STATE_TTL_HOURS",
+    "TELEGRAM_API_URL", "BOT_WORKERS", "WORKER_BASE_PORT", "BOT_WORKER_INDEX",
+    "METRICS_HOST", "METRICS_PORT",
 ]
@@ -8,19 +8,30 @@ This file provides:
 - Helper CRUD functions used by handlers (create_user, get_user_by_tg, create_pending_payment, update_pending_payment, get_latest_pending_by_user, activate_tariff, bonus helpers, etc.)
 
 All session usage is safe (session closed in finally blocks).
+
+Importing this module touches no database: tables are created and migrations
+applied by init_schema() (or its async twin db.init_db(), which main.py runs
+once at startup).
+
+Handlers must not call these blocking helpers on the event loop; they use the
+awaitable equivalents in db.py, which share the models and row helpers below.
 """
-from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from dataclasses import dataclass
 import datetime as dt
+import json
 
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, func
+    Column, Integer, String, Date, DateTime, Index, func, select, union_all
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "bot.db"
-ENGINE = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
+from config import EXPIRY_CHUNK_SIZE
+from db_engine import BASE_DIR, DB_PATH, get_engine
+
+# Shared, WAL-tuned engine (see db_engine.py); never create a second engine for bot.db
+ENGINE = get_engine()
 SessionLocal = sessionmaker(bind=ENGINE, autoflush=False)
 
 Base = declarative_base()
@@ -47,6 +58,27 @@ class User(Base):
     created_at = Column(DateTime, default=dt.datetime.utcnow)
     device_id = Column(String, nullable=True)
     last_active = Column(DateTime, default=dt.datetime.utcnow)
+    birth_year = Column(Integer, nullable=True)
+    address = Column(String, nullable=True)
+    # set when Telegram answers that the user blocked the bot or deleted the account;
+    # recipient queries skip these users, and any new update from them clears it
+    unreachable_at = Column(DateTime, nullable=True)
+
+    # Same names as migration 2 (migrations.py), which adds them to existing databases
+    __table_args__ = (
+        Index("ix_users_created_at", "created_at"),
+        Index("ix_users_phone", "phone"),
+        Index("ix_users_tariff_end", "tariff_end"),
+        Index("ix_users_tariff", "tariff"),
+        Index("ix_users_referred_by", "referred_by"),
+        # broadcast segments (segments.py)
+        Index("ix_users_last_active", "last_active"),
+        Index("ix_users_bonus_balance", "bonus_balance"),
+    )
+
+
+# Referral leaderboard order (see referral_leaderboard_statement); DESC needs a column expression
+Index("ix_users_referral_rank", User.referrals_registered.desc(), User.id)
 
 
 class PendingPayment(Base):
@@ -66,6 +98,11 @@ class PendingPayment(Base):
     approved_at = Column(DateTime, nullable=True)
     declined_at = Column(DateTime, nullable=True)
 
+    __table_args__ = (
+        Index("ix_pending_payments_user_status_created", "user_tg", "status", "created_at"),
+        Index("ix_pending_payments_report", "status", "approved_at", "tariff", "plan", "payable"),
+    )
+
 
 class UsefulFreeClaim(Base):
     __tablename__ = "useful_free_claims"
@@ -84,13 +121,424 @@ class Question(Base):
     answer_snippet = Column(String, nullable=True)
 
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=ENGINE)
+class MetricsDaily(Base):
+    """
+    Per-day rollup for reports, kept in step with users / pending_payments in the
+    same transaction (see metrics_bump) and rebuilt by rollup.py.
+    The row with tariff == "" holds the day's new users; every other row holds
+    approved sales and revenue for one tariff/plan.
+    """
+    __tablename__ = "metrics_daily"
+    day = Column(Date, primary_key=True)
+    tariff = Column(String, primary_key=True, default="")
+    plan = Column(String, primary_key=True, default="")
+    new_users = Column(Integer, nullable=False, default=0)
+    sales = Column(Integer, nullable=False, default=0)
+    revenue = Column(Integer, nullable=False, default=0)
+
+
+class BroadcastJob(Base):
+    """
+    A broadcast that survives restarts (see broadcast_jobs.py). `payload` is a
+    JSON spec for broadcast.payload_from_dict; every recipient with users.id <= `cursor`
+    already has a broadcast_recipients row. status: running, paused, cancelled, done.
+    `errors` is a JSON object of failure counts per error class (delivery.error_class);
+    the progress message is edited in place while the job runs.
+    """
+    __tablename__ = "broadcast_jobs"
+    id = Column(Integer, primary_key=True)
+    payload = Column(String, nullable=False)
+    # segments.Segment.to_dict() JSON; NULL = every reachable user
+    audience = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="running")
+    cursor = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    errors = Column(String, nullable=False, default="{}")
+    progress_chat_id = Column(Integer, nullable=True)
+    progress_message_id = Column(Integer, nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=dt.datetime.utcnow)
+    updated_at = Column(DateTime, default=dt.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BroadcastRecipient(Base):
+    """Delivery result of one broadcast job for one user: status 'sent', 'blocked' or 'failed'."""
+    __tablename__ = "broadcast_recipients"
+    job_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)
+    error = Column(String, nullable=True)
+    at = Column(DateTime, default=dt.datetime.utcnow)
+
+
+class FsmState(Base):
+    """aiogram FSM state and data of one storage key (see fsm_storage.SQLiteStorage)."""
+    __tablename__ = "fsm_states"
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(String, nullable=False, default="{}")
+    updated_at = Column(DateTime, nullable=False, default=dt.datetime.utcnow, index=True)
+
+
+def init_schema(engine=None) -> List[int]:
+    """Create missing tables, then bring existing ones up to date; returns the migrations applied."""
+    from migrations import run_migrations
+
+    engine = engine or ENGINE
+    Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
 
 # Expose Session alias for code that expects `Session`
 Session = SessionLocal
 
 
+# --------------------
+# Shared row helpers (also used by the async layer in db.py)
+# --------------------
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Read-only copy of a users row; safe to cache and share between handlers."""
+    id: int
+    telegram_id: int
+    full_name: Optional[str] = None
+    phone: Optional[str] = None
+    tariff: Optional[str] = None
+    tariff_start: Optional[dt.datetime] = None
+    tariff_end: Optional[dt.datetime] = None
+    daily_remaining: int = 0
+    weekly_remaining: int = 0
+    monthly_remaining: int = 0
+    referrals_added: int = 0
+    referrals_registered: int = 0
+    bonus_balance: int = 0
+    referred_by: Optional[int] = None
+    created_at: Optional[dt.datetime] = None
+    device_id: Optional[str] = None
+    last_active: Optional[dt.datetime] = None
+    birth_year: Optional[int] = None
+    address: Optional[str] = None
+    unreachable_at: Optional[dt.datetime] = None
+
+
+def user_snapshot(u: User) -> UserSnapshot:
+    return UserSnapshot(**{c.name: getattr(u, c.name) for c in User.__table__.columns})
+
+
+def payment_to_dict(pp: PendingPayment) -> Dict[str, Any]:
+    return {
+        "id": pp.id,
+        "user_tg": pp.user_tg,
+        "tariff": pp.tariff,
+        "plan": pp.plan,
+        "label": pp.label,
+        "base_price": pp.base_price,
+        "bonus_applied": pp.bonus_applied,
+        "payable": pp.payable,
+        "status": pp.status,
+        "created_at": pp.created_at,
+        "receipt_file_id": pp.receipt_file_id,
+        "payer_last4": pp.payer_last4,
+        "approved_at": pp.approved_at,
+        "declined_at": pp.declined_at
+    }
+
+
+def question_to_dict(q: Question) -> Dict[str, Any]:
+    return {
+        "id": q.id,
+        "user_tg": q.user_tg,
+        "text": q.text,
+        "created_at": q.created_at,
+        "answered_at": q.answered_at,
+        "answer_snippet": q.answer_snippet,
+    }
+
+
+def broadcast_job_to_dict(job: BroadcastJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "payload": json.loads(job.payload),
+        "audience": json.loads(job.audience) if job.audience else None,
+        "status": job.status,
+        "cursor": job.cursor,
+        "sent": job.sent,
+        "failed": job.failed,
+        "blocked": job.blocked,
+        "total": job.total,
+        "errors": json.loads(job.errors or "{}"),
+        "progress_chat_id": job.progress_chat_id,
+        "progress_message_id": job.progress_message_id,
+        "created_by": job.created_by,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def metrics_bump(day: dt.date, tariff: str = "", plan: str = "", new_users: int = 0, sales: int = 0, revenue: int = 0):
+    """Upsert adding the given deltas to one metrics_daily row; execute it in the writer's transaction."""
+    stmt = sqlite_insert(MetricsDaily).values(
+        day=day, tariff=tariff, plan=plan, new_users=new_users, sales=sales, revenue=revenue,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["day", "tariff", "plan"],
+        set_={
+            "new_users": MetricsDaily.new_users + stmt.excluded.new_users,
+            "sales": MetricsDaily.sales + stmt.excluded.sales,
+            "revenue": MetricsDaily.revenue + stmt.excluded.revenue,
+        },
+    )
+
+
+def approved_sale(pp: PendingPayment) -> Optional[tuple]:
+    """(day, tariff, plan, payable) if the payment counts as an approved sale, else None."""
+    if pp.status != "approved" or not isinstance(pp.approved_at, dt.datetime):
+        return None
+    return (pp.approved_at.date(), pp.tariff or "unknown", pp.plan or "", int(pp.payable or 0))
+
+
+def sale_rollup_statements(before: Optional[tuple], after: Optional[tuple]) -> list:
+    """metrics_bump statements moving a payment's approved_sale() from `before` to `after`."""
+    if before == after:
+        return []
+    stmts = []
+    if before:
+        day, tariff, plan, payable = before
+        stmts.append(metrics_bump(day, tariff, plan, sales=-1, revenue=-payable))
+    if after:
+        day, tariff, plan, payable = after
+        stmts.append(metrics_bump(day, tariff, plan, sales=1, revenue=payable))
+    return stmts
+
+
+def expire_tariffs_statement(now: dt.datetime, limit: int):
+    """
+    Clear the tariff of at most `limit` users whose tariff_end is <= now, as one
+    UPDATE ... RETURNING telegram_id, unreachable_at (found through
+    ix_users_tariff_end). Run it repeatedly until it returns fewer than `limit` rows.
+    """
+    users = User.__table__
+    due = (
+        select(users.c.id)
+        .where(users.c.tariff_end != None, users.c.tariff_end <= now)  # noqa: E711
+        .limit(int(limit))
+        .scalar_subquery()
+    )
+    return (
+        users.update()
+        .where(users.c.id.in_(due))
+        .values(
+            tariff=None, tariff_start=None, tariff_end=None,
+            daily_remaining=0, weekly_remaining=0, monthly_remaining=0,
+        )
+        .returning(users.c.telegram_id, users.c.unreachable_at)
+    )
+
+
+def referral_leaderboard_statement(limit: int = 10, offset: int = 0):
+    """
+    Referrers ranked by referrals_registered, highest first (ties by id).
+    The counter is bumped by credit_referrer in the same transaction that sets
+    the referred user's referred_by, so it equals COUNT(*) GROUP BY referred_by
+    (migration 5 re-syncs it); reading it through ix_users_referral_rank makes a
+    page an index range read instead of an aggregate over every user.
+    """
+    return (
+        select(User.id, User.telegram_id, User.full_name, User.phone, User.referrals_registered)
+        .where(User.referrals_registered > 0)
+        .order_by(User.referrals_registered.desc(), User.id)
+        .limit(int(limit))
+        .offset(int(offset))
+    )
+
+
+def leaderboard_rows_to_dicts(rows, offset: int = 0) -> list:
+    return [
+        {"rank": offset + i + 1, "id": uid, "telegram_id": tg_id, "name": name, "phone": phone, "count": int(cnt)}
+        for i, (uid, tg_id, name, phone, cnt) in enumerate(rows)
+    ]
+
+
+def _day_start(value: dt.datetime) -> dt.datetime:
+    return dt.datetime(value.year, value.month, value.day)
+
+
+def report_statements(start_date: dt.datetime, end_date: dt.datetime):
+    """
+    The two statements behind get_report_data.
+
+    Whole days inside the range are read from metrics_daily; only the partial
+    days at either edge touch users / pending_payments (through
+    ix_users_created_at and ix_pending_payments_report), so the cost no longer
+    grows with the length of the range.
+
+    users_stmt returns (total, new in range, purchased) in one row. Each figure is
+    made of scalar subqueries rather than a SUM(CASE ...) over users: that lets
+    SQLite count the whole table from the b-tree and the rest from index ranges
+    instead of decoding every row.
+    sales_stmt yields (tariff, plan, count, revenue) rows; a tariff/plan may
+    appear once per source, build_report adds them up.
+    """
+    first_full = _day_start(start_date)
+    if first_full < start_date:
+        first_full += dt.timedelta(days=1)
+    last_full = _day_start(end_date)
+
+    # (from, to, to_inclusive) windows answered from raw rows
+    if first_full < last_full:
+        raw_windows = [(start_date, first_full, False), (last_full, end_date, True)]
+    else:
+        raw_windows = [(start_date, end_date, True)]
+
+    def _upto(column, bound, inclusive):
+        return column <= bound if inclusive else column < bound
+
+    new_users = [
+        select(func.count()).select_from(User)
+        .where(User.created_at >= lo, _upto(User.created_at, hi, inclusive)).scalar_subquery()
+        for lo, hi, inclusive in raw_windows
+    ]
+    sales = [
+        select(
+            PendingPayment.tariff,
+            PendingPayment.plan,
+            func.count(PendingPayment.id),
+            func.coalesce(func.sum(PendingPayment.payable), 0),
+        )
+        .where(
+            PendingPayment.status == "approved",
+            PendingPayment.approved_at >= lo,
+            _upto(PendingPayment.approved_at, hi, inclusive),
+        )
+        .group_by(PendingPayment.tariff, PendingPayment.plan)
+        for lo, hi, inclusive in raw_windows
+    ]
+    if first_full < last_full:
+        full_days = (MetricsDaily.day >= first_full.date(), MetricsDaily.day < last_full.date())
+        new_users.append(
+            select(func.coalesce(func.sum(MetricsDaily.new_users), 0))
+            .where(*full_days, MetricsDaily.tariff == "").scalar_subquery()
+        )
+        sales.append(
+            select(MetricsDaily.tariff, MetricsDaily.plan, func.sum(MetricsDaily.sales), func.sum(MetricsDaily.revenue))
+            .where(*full_days, MetricsDaily.tariff != "")
+            .group_by(MetricsDaily.tariff, MetricsDaily.plan)
+        )
+
+    new_users_expr = new_users[0]
+    for part in new_users[1:]:
+        new_users_expr = new_users_expr + part
+    users_stmt = select(
+        select(func.count()).select_from(User).scalar_subquery(),
+        new_users_expr,
+        select(func.count()).select_from(User).where(User.tariff != None).scalar_subquery(),  # noqa: E711
+    )
+    sales_stmt = sales[0] if len(sales) == 1 else union_all(*sales)
+    return users_stmt, sales_stmt
+
+
+def build_report(start_date: dt.datetime, end_date: dt.datetime, users_row, sales_rows) -> Dict[str, Any]:
+    """Turn the rows of report_statements() into the get_report_data dict."""
+    total_users, new_users, purchased = (int(v or 0) for v in users_row)
+    total_sum = 0
+    # Build nested dict: { tariff: { plan: count, ... }, ... }
+    tariff_sales = {}
+    for tariff, plan, cnt, revenue in sales_rows:
+        plans = tariff_sales.setdefault(tariff or "unknown", {})
+        plans[plan] = plans.get(plan, 0) + int(cnt or 0)
+        total_sum += int(revenue or 0)
+    return {
+        "start": start_date,
+        "end": end_date,
+        "new_users": new_users,
+        "total_sum": total_sum,
+        "tariff_sales": tariff_sales,
+        # useful_sales placeholder: count of users (replace with real data if available)
+        "useful_sales": {"subscribers": total_users},
+        "total_users": total_users,
+        "purchased": purchased,
+        "not_purchased": total_users - purchased,
+    }
+
+
+def new_user_row(tg_id: int, full_name: str = None, phone: str = None, device_id: str = None,
+                 birth_year: int = None, address: str = None) -> User:
+    """Build a fresh User row with the default free (pro-level) access."""
+    # New users: give them free access by default (pro-level quotas) per admin request
+    now = dt.datetime.utcnow()
+    future = now + dt.timedelta(days=3650)  # 10 years free access
+    return User(
+        telegram_id=int(tg_id),
+        full_name=full_name,
+        phone=phone,
+        tariff='pro',
+        tariff_start=now,
+        tariff_end=future,
+        daily_remaining=999,
+        weekly_remaining=9999,
+        monthly_remaining=99999,
+        referrals_added=0,
+        referrals_registered=0,
+        bonus_balance=0,
+        referred_by=None,
+        device_id=device_id,
+        birth_year=birth_year,
+        address=address,
+        created_at=dt.datetime.utcnow()
+    )
+
+
+def credit_referrer(ref: User) -> None:
+    ref.referrals_added = (ref.referrals_added or 0) + 1
+    ref.referrals_registered = (ref.referrals_registered or 0) + 1
+    ref.bonus_balance = (ref.bonus_balance or 0) + REFERRAL_BONUS
+
+
+def apply_tariff_quotas(user: User, tariff: str, days: int) -> None:
+    """Set tariff dates and remaining quotas on a User row (no commit)."""
+    now = dt.datetime.utcnow()
+    user.tariff = tariff
+    user.tariff_start = now
+    user.tariff_end = now + dt.timedelta(days=int(days))
+
+    # Set remaining quotas based on tariff type
+    if tariff == "free":
+        user.daily_remaining = 0
+        user.weekly_remaining = 2
+        user.monthly_remaining = 2
+    elif tariff == "pro":
+        user.daily_remaining = 19
+        user.weekly_remaining = 133
+        user.monthly_remaining = 570
+    elif tariff == "premium":
+        user.daily_remaining = 49
+        user.weekly_remaining = 343
+        user.monthly_remaining = 1470
+    elif tariff == "pregnancy":
+        if int(days) == 30:
+            user.daily_remaining = 20
+            user.weekly_remaining = 140
+            user.monthly_remaining = 599
+        else:
+            user.daily_remaining = 22
+            user.weekly_remaining = 154
+            user.monthly_remaining = 666
+    elif tariff == "planning":
+        user.daily_remaining = 149
+        user.weekly_remaining = 1043
+        user.monthly_remaining = 4470
+    else:
+        user.daily_remaining = max(0, int(days))
+        user.weekly_remaining = max(0, int(days) // 7)
+        user.monthly_remaining = max(0, int(days) // 30)
+
+
 # --------------------
 # Helper functions
 # --------------------
@@ -120,14 +568,7 @@ def get_question(qid: int) -> Optional[Dict[str, Any]]:
         q = session.query(Question).filter(Question.id == int(qid)).first()
         if not q:
             return None
-        return {
-            "id": q.id,
-            "user_tg": q.user_tg,
-            "text": q.text,
-            "created_at": q.created_at,
-            "answered_at": q.answered_at,
-            "answer_snippet": q.answer_snippet,
-        }
+        return question_to_dict(q)
     finally:
         session.close()
 
@@ -155,7 +596,8 @@ def get_user_by_phone(phone: str) -> Optional[User]:
         session.close()
 
 
-def create_user(tg_id: int, full_name: str = None, phone: str = None, device_id: str = None, referred_by: int = None) -> User:
+def create_user(tg_id: int, full_name: str = None, phone: str = None, device_id: str = None, referred_by: int = None,
+                birth_year: int = None, address: str = None) -> User:
     """
     Create a new user if not exists. Returns existing user if present.
     If referred_by is set (telegram id of referrer), credit that referrer with referral bonus.
@@ -166,27 +608,9 @@ def create_user(tg_id: int, full_name: str = None, phone: str = None, device_id:
         if existing:
             return existing
 
-        # New users: give them free access by default (pro-level quotas) per admin request
-        now = dt.datetime.utcnow()
-        future = now + dt.timedelta(days=3650)  # 10 years free access
-        user = User(
-            telegram_id=int(tg_id),
-            full_name=full_name,
-            phone=phone,
-            tariff='pro',
-            tariff_start=now,
-            tariff_end=future,
-            daily_remaining=999,
-            weekly_remaining=9999,
-            monthly_remaining=99999,
-            referrals_added=0,
-            referrals_registered=0,
-            bonus_balance=0,
-            referred_by=None,
-            device_id=device_id,
-            created_at=dt.datetime.utcnow()
-        )
+        user = new_user_row(tg_id, full_name, phone, device_id, birth_year, address)
         session.add(user)
+        session.execute(metrics_bump(user.created_at.date(), new_users=1))
         session.commit()
         session.refresh(user)
 
@@ -195,9 +619,7 @@ def create_user(tg_id: int, full_name: str = None, phone: str = None, device_id:
             try:
                 ref = session.query(User).filter(User.telegram_id == int(referred_by)).first()
                 if ref:
-                    ref.referrals_added = (ref.referrals_added or 0) + 1
-                    ref.referrals_registered = (ref.referrals_registered or 0) + 1
-                    ref.bonus_balance = (ref.bonus_balance or 0) + REFERRAL_BONUS
+                    credit_referrer(ref)
                     session.add(ref)
                     # link the new user's referred_by to ref.id (DB-level referential)
                     user.referred_by = ref.id
@@ -251,9 +673,7 @@ def process_referral(ref_code: str, new_user: User) -> None:
         if not referrer:
             return
         # increment stats
-        referrer.referrals_added = (referrer.referrals_added or 0) + 1
-        referrer.referrals_registered = (referrer.referrals_registered or 0) + 1
-        referrer.bonus_balance = (referrer.bonus_balance or 0) + REFERRAL_BONUS
+        credit_referrer(referrer)
         # link new user
         target = session.query(User).filter(User.telegram_id == new_user.telegram_id).first()
         if target:
@@ -283,6 +703,8 @@ def create_pending_payment(payload: Dict[str, Any]) -> int:
             payer_last4=payload.get("payer_last4")
         )
         session.add(pp)
+        for stmt in sale_rollup_statements(None, approved_sale(pp)):
+            session.execute(stmt)
         session.commit()
         session.refresh(pp)
         return int(pp.id)
@@ -296,22 +718,7 @@ def get_pending_payment(pid: int) -> Optional[Dict[str, Any]]:
         pp = session.query(PendingPayment).filter(PendingPayment.id == int(pid)).first()
         if not pp:
             return None
-        return {
-            "id": pp.id,
-            "user_tg": pp.user_tg,
-            "tariff": pp.tariff,
-            "plan": pp.plan,
-            "label": pp.label,
-            "base_price": pp.base_price,
-            "bonus_applied": pp.bonus_applied,
-            "payable": pp.payable,
-            "status": pp.status,
-            "created_at": pp.created_at,
-            "receipt_file_id": pp.receipt_file_id,
-            "payer_last4": pp.payer_last4,
-            "approved_at": pp.approved_at,
-            "declined_at": pp.declined_at
-        }
+        return payment_to_dict(pp)
     finally:
         session.close()
 
@@ -322,10 +729,14 @@ def update_pending_payment(pid: int, updates: Dict[str, Any]) -> None:
         pp = session.query(PendingPayment).filter(PendingPayment.id == int(pid)).first()
         if not pp:
             return
+        before = approved_sale(pp)
         for k, v in updates.items():
             if hasattr(pp, k):
                 setattr(pp, k, v)
         session.add(pp)
+        # keep metrics_daily in the same transaction as the status change
+        for stmt in sale_rollup_statements(before, approved_sale(pp)):
+            session.execute(stmt)
         session.commit()
     finally:
         session.close()
@@ -344,22 +755,7 @@ def get_latest_pending_by_user(tg_id: int) -> Optional[Dict[str, Any]]:
         ).order_by(PendingPayment.created_at.desc()).first()
         if not pp:
             return None
-        return {
-            "id": pp.id,
-            "user_tg": pp.user_tg,
-            "tariff": pp.tariff,
-            "plan": pp.plan,
-            "label": pp.label,
-            "base_price": pp.base_price,
-            "bonus_applied": pp.bonus_applied,
-            "payable": pp.payable,
-            "status": pp.status,
-            "created_at": pp.created_at,
-            "receipt_file_id": pp.receipt_file_id,
-            "payer_last4": pp.payer_last4,
-            "approved_at": pp.approved_at,
-            "declined_at": pp.declined_at
-        }
+        return payment_to_dict(pp)
     finally:
         session.close()
 
@@ -374,42 +770,7 @@ def activate_tariff(user_db_id: int, tariff: str, days: int) -> None:
         user = session.query(User).filter(User.id == int(user_db_id)).first()
         if not user:
             return
-        now = dt.datetime.utcnow()
-        user.tariff = tariff
-        user.tariff_start = now
-        user.tariff_end = now + dt.timedelta(days=int(days))
-
-        # Set remaining quotas based on tariff type
-        if tariff == "free":
-            user.daily_remaining = 0
-            user.weekly_remaining = 2
-            user.monthly_remaining = 2
-        elif tariff == "pro":
-            user.daily_remaining = 19
-            user.weekly_remaining = 133
-            user.monthly_remaining = 570
-        elif tariff == "premium":
-            user.daily_remaining = 49
-            user.weekly_remaining = 343
-            user.monthly_remaining = 1470
-        elif tariff == "pregnancy":
-            if int(days) == 30:
-                user.daily_remaining = 20
-                user.weekly_remaining = 140
-                user.monthly_remaining = 599
-            else:
-                user.daily_remaining = 22
-                user.weekly_remaining = 154
-                user.monthly_remaining = 666
-        elif tariff == "planning":
-            user.daily_remaining = 149
-            user.weekly_remaining = 1043
-            user.monthly_remaining = 4470
-        else:
-            user.daily_remaining = max(0, int(days))
-            user.weekly_remaining = max(0, int(days) // 7)
-            user.monthly_remaining = max(0, int(days) // 30)
-
+        apply_tariff_quotas(user, tariff, days)
         session.add(user)
         session.commit()
     finally:
@@ -451,24 +812,21 @@ def get_useful_subscribers():
         session.close()
 
 
-def deactivate_expired_tariffs():
+def deactivate_expired_tariffs(chunk_size: int = EXPIRY_CHUNK_SIZE) -> list:
     """
-    Find users with tariff_end in the past, clear their tariff and return list of affected users.
+    Clear tariffs whose tariff_end has passed and return the affected telegram_ids.
+    Works in chunks of `chunk_size`, committing each, so the write lock is short.
     """
+    now = dt.datetime.utcnow()
+    expired = []
     session = SessionLocal()
     try:
-        now = dt.datetime.utcnow()
-        expired = session.query(User).filter(User.tariff_end != None, User.tariff_end <= now).all()
-        for u in expired:
-            u.tariff = None
-            u.tariff_start = None
-            u.tariff_end = None
-            u.daily_remaining = 0
-            u.weekly_remaining = 0
-            u.monthly_remaining = 0
-            session.add(u)
-        session.commit()
-        return expired
+        while True:
+            rows = session.execute(expire_tariffs_statement(now, chunk_size)).all()
+            session.commit()
+            expired.extend(row.telegram_id for row in rows)
+            if len(rows) < chunk_size:
+                return expired
     finally:
         session.close()
 
@@ -479,76 +837,32 @@ def get_report_data(start_date: dt.datetime, end_date: dt.datetime) -> Dict[str,
     Returns dict with keys: start, end, new_users, total_sum, tariff_sales, useful_sales
     Note: total_sum and tariff_sales computed from pending_payments approved in range.
     """
+    users_stmt, sales_stmt = report_statements(start_date, end_date)
     session = SessionLocal()
     try:
-        new_users = session.query(func.count(User.id)).filter(User.created_at >= start_date, User.created_at <= end_date).scalar() or 0
-
-        # total_sum: sum of approved pending payments in the range
-        total_sum = session.query(func.coalesce(func.sum(PendingPayment.payable), 0)).filter(
-            PendingPayment.status == "approved",
-            PendingPayment.approved_at != None,
-            PendingPayment.approved_at >= start_date,
-            PendingPayment.approved_at <= end_date,
-        ).scalar() or 0
-
-        # tariff sales breakdown by tariff and by plan (more detailed)
-        rows = session.query(PendingPayment.tariff, PendingPayment.plan, func.count(PendingPayment.id)).filter(
-            PendingPayment.status == "approved",
-            PendingPayment.approved_at != None,
-            PendingPayment.approved_at >= start_date,
-            PendingPayment.approved_at <= end_date,
-        ).group_by(PendingPayment.tariff, PendingPayment.plan).all()
-        # Build nested dict: { tariff: { plan: count, ... }, ... }
-        tariff_sales = {}
-        for tariff, plan, cnt in rows:
-            t = tariff or "unknown"
-            tariff_sales.setdefault(t, {})
-            tariff_sales[t][plan] = int(cnt)
-
-        # useful_sales placeholder: count of users (replace with real data if available)
-        useful_sales = {"subscribers": session.query(func.count(User.id)).scalar() or 0}
-
-        # compute overall user counts: total, purchased (tariff != None), not purchased
-        total_users = session.query(func.count(User.id)).scalar() or 0
-        purchased = session.query(func.count(User.id)).filter(User.tariff != None).scalar() or 0
-        not_purchased = int(total_users) - int(purchased)
-
-        return {
-            "start": start_date,
-            "end": end_date,
-            "new_users": int(new_users),
-            "total_sum": int(total_sum),
-            "tariff_sales": tariff_sales,
-            "useful_sales": useful_sales,
-            "total_users": int(total_users),
-            "purchased": int(purchased),
-            "not_purchased": int(not_purchased),
-        }
+        users_row = session.execute(users_stmt).one()
+        sales_rows = session.execute(sales_stmt).all()
+        return build_report(start_date, end_date, users_row, sales_rows)
     finally:
         session.close()
 
 
-def get_top_referrer():
-    """Return the user who referred the most registered users."""
+def get_referral_leaderboard(limit: int = 10, offset: int = 0) -> list:
+    """Top referrers page: [{rank, id, telegram_id, name, phone, count}, ...]."""
     session = SessionLocal()
     try:
-        row = session.query(User, func.count(User.id).label("cnt")).filter(User.referred_by != None).join(User, User.id == User.referred_by)
-        # Fallback: compute by scanning users
-        # Simple approach: count referrals by referred_by id
-        referral_counts = {}
-        users = session.query(User).all()
-        for u in users:
-            if u.referred_by:
-                referral_counts[u.referred_by] = referral_counts.get(u.referred_by, 0) + 1
-        if not referral_counts:
-            return None
-        top_id = max(referral_counts, key=referral_counts.get)
-        ref = session.query(User).filter(User.id == top_id).first()
-        return {"id": ref.id, "name": ref.full_name, "phone": ref.phone, "count": referral_counts[top_id]} if ref else None
+        rows = session.execute(referral_leaderboard_statement(limit, offset)).all()
+        return leaderboard_rows_to_dicts(rows, offset)
     finally:
         session.close()
 
 
+def get_top_referrer():
+    """Return the user who referred the most registered users."""
+    top = get_referral_leaderboard(limit=1)
+    return top[0] if top else None
+
+
 def get_referral_counts(user_db_id: int) -> Dict[str, int]:
     """Return referrals_added and referrals_registered for a user id."""
     session = SessionLocal()
@@ -2,68 +2,706 @@
 Async DB module (SQLAlchemy + aiosqlite by default).
 
 Provides:
-- engine, async_session
-- Base, User, PendingPayment ORM models
-- init_db() to create tables
+- engine, async_session (pooled readers) and write_session (single serialized writer)
+- Base, User, PendingPayment ORM models (the same models database.py uses)
+- init_db() to create tables and apply migrations: the explicit startup step
+  (nothing touches the database at import)
 - get_session() async generator helper
+- awaitable equivalents of every helper in database.py, so handlers never
+  run blocking SQLite I/O on the event loop
+- record_activity() / flush_activity(): write-behind buffer for users.last_active
+- broadcast job helpers: the persistent state behind broadcast_jobs.py
+- get_user_by_tg() is served from a TTL/LRU cache of immutable UserSnapshot rows;
+  every helper that changes a user invalidates it (see user_cache_stats())
+- update_session / transaction(): one session per update (see
+  middlewares/unit_of_work.py). The helpers handlers call take an optional
+  `session=`; without it they open their own, as before.
+
+Helpers keep the names, arguments and return values of their database.py
+counterparts; only `await` is new at the call site.
+
+Per-update sessions route reads to the pooled reader engine; as soon as a
+helper writes, the rest of that transaction runs on the writer connection
+(so it reads its own writes and read-modify-write is serialized). Outside
+transaction() every writing helper commits on its own, as before; inside it
+they only flush and the block commits once. User cache invalidations wait
+for the commit.
 """
 
-import os
-from datetime import datetime
-from dotenv import load_dotenv
+import json
+import asyncio
+import logging
+import datetime as dt
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+from sqlalchemy import event, select, update, bindparam, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from sqlalchemy.orm import Session
+
+from database import (
+    Base, User, PendingPayment, UsefulFreeClaim, Question, UserSnapshot,
+    user_snapshot, payment_to_dict, question_to_dict, new_user_row, credit_referrer, apply_tariff_quotas,
+    report_statements, build_report, metrics_bump, approved_sale, sale_rollup_statements,
+    referral_leaderboard_statement, leaderboard_rows_to_dicts, expire_tariffs_statement,
+    BroadcastJob, BroadcastRecipient, broadcast_job_to_dict,
+)
+from config import (
+    ACTIVITY_FLUSH_SECONDS, USER_CACHE_SIZE, USER_CACHE_TTL, EXPIRY_CHUNK_SIZE, RECIPIENT_BATCH_SIZE,
+    BOT_WORKERS, BOT_WORKER_INDEX,
+)
+from migrations import run_migrations
+from db_engine import ASYNC_URL as DATABASE_URL, get_read_engine, get_write_engine
+from utils.cache import TTLCache, MISSING
+
+engine = get_read_engine()
+write_engine = get_write_engine()
+
+
+class _HookedSession(Session):
+    """Runs the callables queued in info["on_commit"] once the transaction has committed."""
+
 
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy import Column, Integer, String, DateTime, Text
-from sqlalchemy.orm import declarative_base
+class _UpdateSession(_HookedSession):
+    """Reads on the reader pool until the transaction writes; from then on everything on the writer."""
 
-load_dotenv()
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("write") or self._flushing or getattr(clause, "is_dml", False):
+            self.info["write"] = True
+            return write_engine.sync_engine
+        return engine.sync_engine
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot.db")
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+@event.listens_for(_HookedSession, "after_commit")
+def _run_commit_hooks(session):
+    session.info.pop("write", None)
+    for hook in session.info.pop("on_commit", ()):
+        hook()
+
+
+@event.listens_for(_HookedSession, "after_rollback")
+def _drop_commit_hooks(session):
+    session.info.pop("write", None)
+    session.info.pop("on_commit", None)
+
+
+# Reads run concurrently on the pooled engine; every write goes through write_session,
+# whose single connection serializes writers instead of tripping "database is locked".
 async_session = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+write_session = async_sessionmaker(bind=write_engine, expire_on_commit=False, class_=AsyncSession,
+                                   sync_session_class=_HookedSession)
+# One per update (middlewares/unit_of_work.py); connects only when a helper first uses it
+update_session = async_sessionmaker(expire_on_commit=False, class_=AsyncSession, sync_session_class=_UpdateSession)
 
-Base = declarative_base()
-
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, index=True, nullable=False)
-    full_name = Column(String, nullable=True)
-    phone = Column(String, nullable=True)
-    bonus_balance = Column(Integer, default=0)
-    current_tariff = Column(String, nullable=True)
-    tariff_started_at = Column(DateTime, nullable=True)
-    tariff_ends_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-
-class PendingPayment(Base):
-    __tablename__ = "pending_payments"
-    id = Column(Integer, primary_key=True)
-    user_tg = Column(Integer, nullable=False)
-    tariff = Column(String, nullable=True)
-    plan = Column(String, nullable=True)
-    label = Column(String, nullable=True)
-    base_price = Column(Integer, default=0)
-    bonus_applied = Column(Integer, default=0)
-    payable = Column(Integer, default=0)
-    status = Column(String, default="pending")
-    receipt_file_id = Column(String, nullable=True)
-    payer_last4 = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    approved_at = Column(DateTime, nullable=True)
-    declined_at = Column(DateTime, nullable=True)
+_OPEN_PAYMENT_STATUSES = ["under_review", "awaiting_receipt", "awaiting_payment"]
+
+logger = logging.getLogger(__name__)
+
+# telegram_id -> UserSnapshot (or None for unknown users); see get_user_by_tg.
+# Invalidation is local to the process, so with worker processes (supervisor.py) a change
+# committed by another one would be served stale for up to USER_CACHE_TTL: no cache there.
+_user_cache = TTLCache(maxsize=0 if BOT_WORKERS > 1 or BOT_WORKER_INDEX >= 0 else USER_CACHE_SIZE,
+                       ttl=USER_CACHE_TTL)
 
 
 async def init_db():
-    """Create database tables (async)."""
-    async with engine.begin() as conn:
+    """Create missing tables and apply pending migrations (async)."""
+    async with write_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    async with write_engine.connect() as conn:
+        await conn.run_sync(run_migrations)
 
 
 async def get_session():
     """Async generator to yield an AsyncSession instance."""
     async with async_session() as session:
         yield session
+
+
+@asynccontextmanager
+async def _reading(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """The caller's session, or a reader session of our own."""
+    if session is not None:
+        yield session
+    else:
+        async with async_session() as own:
+            yield own
+
+
+@asynccontextmanager
+async def _writing(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """
+    Session for one helper's writes, committed when the block ends: our own
+    writer session, or the caller's (only flushed inside transaction()).
+    """
+    if session is None:
+        async with write_session() as own:
+            yield own
+            await own.commit()
+        return
+    session.info["write"] = True
+    try:
+        yield session
+        if session.info.get("atomic"):
+            await session.flush()
+        else:
+            await session.commit()
+    except BaseException:
+        if not session.info.get("atomic"):
+            await session.rollback()
+        raise
+
+
+@asynccontextmanager
+async def transaction(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """
+    Several helper writes as one transaction on the writer connection:
+
+        async with transaction(session) as s:
+            await update_pending_payment(pid, {...}, session=s)
+            await activate_tariff(user_id, tariff, days, session=s)
+
+    Nested blocks join the outer one.
+    """
+    if session is None:
+        async with update_session() as own:
+            async with transaction(own) as s:
+                yield s
+        return
+    if session.info.get("atomic"):
+        yield session
+        return
+    if session.in_transaction():
+        await session.commit()  # end the read snapshot taken so far
+    session.info["atomic"] = True
+    session.info["write"] = True
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    finally:
+        session.info.pop("atomic", None)
+
+
+def release_reads(session: AsyncSession) -> Any:
+    """
+    End a per-update session's read transaction so its pooled connection goes
+    back before slow I/O (a Bot API call); a no-op inside transaction().
+    Returns an awaitable, or None if there is nothing to release.
+    """
+    if session.info.get("atomic") or not session.in_transaction():
+        return None
+    return session.commit()
+
+
+def _invalidate_on_commit(session: AsyncSession, *tg_ids: int) -> None:
+    session.info.setdefault("on_commit", []).append(lambda: invalidate_user(*tg_ids))
+
+
+async def _user_by(session: AsyncSession, *criteria, fresh: bool = False) -> Optional[User]:
+    stmt = select(User).where(*criteria).limit(1)
+    if fresh:
+        # reload rows the session already holds: writes must start from the current values
+        stmt = stmt.execution_options(populate_existing=True)
+    return (await session.execute(stmt)).scalars().first()
+
+
+# --------------------
+# User helpers
+# --------------------
+async def get_user_by_tg(tg_id: int, session: Optional[AsyncSession] = None) -> Optional[UserSnapshot]:
+    """
+    Cached lookup by Telegram id; returns a read-only UserSnapshot or None.
+    Inside a write transaction (transaction(), or after a helper wrote) the row
+    is read fresh: values computed from it are written back.
+    """
+    tg_id = int(tg_id)
+    writing = session is not None and bool(session.info.get("write") or session.info.get("atomic"))
+    if not writing:
+        cached = _user_cache.get(tg_id)
+        if cached is not MISSING:
+            return cached
+    generation = _user_cache.generation
+    async with _reading(session) as s:
+        user = await _user_by(s, User.telegram_id == tg_id, fresh=writing)
+        snapshot = user_snapshot(user) if user else None
+        # rows read inside an uncommitted write transaction are not cached
+        uncommitted = s.info.get("write", False)
+    if not uncommitted:
+        # dropped if a write invalidated the cache while we were reading
+        _user_cache.put(tg_id, snapshot, generation)
+    return snapshot
+
+
+def invalidate_user(*tg_ids: int) -> None:
+    """Drop cached snapshots for these Telegram ids (call after committing a change to them)."""
+    _user_cache.invalidate(*(int(t) for t in tg_ids if t is not None))
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and size of the get_user_by_tg cache."""
+    return _user_cache.stats()
+
+
+async def get_user_by_phone(phone: str, session: Optional[AsyncSession] = None) -> Optional[User]:
+    async with _reading(session) as s:
+        return await _user_by(s, User.phone == phone)
+
+
+async def create_user(tg_id: int, full_name: str = None, phone: str = None, device_id: str = None, referred_by: int = None,
+                      birth_year: int = None, address: str = None, session: Optional[AsyncSession] = None) -> User:
+    """Async create_user: returns the existing user or creates one, crediting the referrer."""
+    async with _writing(session) as s:
+        existing = await _user_by(s, User.telegram_id == int(tg_id), fresh=True)
+        if existing:
+            return existing
+
+        user = new_user_row(tg_id, full_name, phone, device_id, birth_year, address)
+        s.add(user)
+        await s.execute(metrics_bump(user.created_at.date(), new_users=1))
+        ref = await _user_by(s, User.telegram_id == int(referred_by), fresh=True) if referred_by else None
+        if ref:
+            credit_referrer(ref)
+            await s.flush()
+            user.referred_by = ref.id
+        _invalidate_on_commit(s, tg_id, *([ref.telegram_id] if ref else []))
+        return user
+
+
+async def update_user_profile(tg_id: int, full_name: str = None, phone: str = None, birth_year: int = None,
+                              address: str = None, session: Optional[AsyncSession] = None) -> bool:
+    """Write the registration fields given (None = leave as is) to an existing user; False if there is none."""
+    async with _writing(session) as s:
+        user = await _user_by(s, User.telegram_id == int(tg_id), fresh=True)
+        if not user:
+            return False
+        for field, value in (("full_name", full_name), ("phone", phone), ("birth_year", birth_year),
+                             ("address", address)):
+            if value is not None:
+                setattr(user, field, value)
+        _invalidate_on_commit(s, tg_id)
+        return True
+
+
+async def get_user_bonus(user_db_id: int, session: Optional[AsyncSession] = None) -> int:
+    async with _reading(session) as s:
+        bonus = (await s.execute(
+            select(User.bonus_balance).where(User.id == int(user_db_id))
+        )).scalar()
+        return int(bonus or 0)
+
+
+async def set_user_bonus(user_db_id: int, amount: int, session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        user = await s.get(User, int(user_db_id), populate_existing=True)
+        if not user:
+            return
+        user.bonus_balance = int(amount)
+        _invalidate_on_commit(s, user.telegram_id)
+
+
+async def process_referral(ref_code: str, new_user: User, session: Optional[AsyncSession] = None) -> None:
+    """Async process_referral: credit the referrer and link new_user.referred_by."""
+    if not ref_code:
+        return
+    try:
+        ref_tg = int(ref_code)
+    except Exception:
+        return
+    async with _writing(session) as s:
+        referrer = await _user_by(s, User.telegram_id == ref_tg, fresh=True)
+        if not referrer:
+            return
+        credit_referrer(referrer)
+        target = await _user_by(s, User.telegram_id == new_user.telegram_id, fresh=True)
+        if target:
+            target.referred_by = referrer.id
+        _invalidate_on_commit(s, referrer.telegram_id, new_user.telegram_id)
+
+
+async def activate_tariff(user_db_id: int, tariff: str, days: int, session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        user = await s.get(User, int(user_db_id), populate_existing=True)
+        if not user:
+            return
+        apply_tariff_quotas(user, tariff, days)
+        _invalidate_on_commit(s, user.telegram_id)
+
+
+async def update_last_active(user_id: int, session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        user = await s.get(User, int(user_id), populate_existing=True)
+        if user:
+            user.last_active = dt.datetime.utcnow()
+
+
+async def get_referral_counts(user_db_id: int, session: Optional[AsyncSession] = None) -> Dict[str, int]:
+    async with _reading(session) as s:
+        row = (await s.execute(
+            select(User.referrals_added, User.referrals_registered).where(User.id == int(user_db_id))
+        )).first()
+        if not row:
+            return {"added": 0, "registered": 0}
+        return {"added": int(row[0] or 0), "registered": int(row[1] or 0)}
+
+
+# --------------------
+# Activity (write-behind last_active)
+# --------------------
+# Latest activity per telegram_id, waiting to be written. Repeated updates from the
+# same user between flushes collapse into one row of a single executemany.
+_pending_activity: Dict[int, dt.datetime] = {}
+
+_LAST_ACTIVE_UPDATE = (
+    User.__table__.update()
+    .where(User.__table__.c.telegram_id == bindparam("tg_id"))
+    # a user who sends us anything can be messaged again
+    .values(last_active=bindparam("seen_at"), unreachable_at=None)
+)
+
+
+def record_activity(tg_id: int, seen_at: dt.datetime = None) -> None:
+    """Remember that a Telegram user was active; no I/O, written by flush_activity()."""
+    _pending_activity[int(tg_id)] = seen_at or dt.datetime.utcnow()
+
+
+async def flush_activity() -> int:
+    """Write all buffered last_active values in one transaction; returns how many users were written."""
+    global _pending_activity
+    if not _pending_activity:
+        return 0
+    batch, _pending_activity = _pending_activity, {}
+    try:
+        async with write_engine.begin() as conn:
+            await conn.execute(
+                _LAST_ACTIVE_UPDATE,
+                [{"tg_id": tg_id, "seen_at": seen_at} for tg_id, seen_at in batch.items()],
+            )
+    except Exception:
+        # keep the batch for the next flush unless a newer timestamp arrived meanwhile
+        for tg_id, seen_at in batch.items():
+            _pending_activity.setdefault(tg_id, seen_at)
+        raise
+    return len(batch)
+
+
+async def run_activity_flusher(interval: float = ACTIVITY_FLUSH_SECONDS) -> None:
+    """Flush the activity buffer every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_activity()
+        except Exception:
+            logger.exception("Failed to flush last_active buffer")
+
+
+# --------------------
+# Question helpers
+# --------------------
+async def create_question(user_tg: int, text: str, session: Optional[AsyncSession] = None) -> int:
+    async with _writing(session) as s:
+        q = Question(user_tg=int(user_tg), text=text)
+        s.add(q)
+        await s.flush()
+        return int(q.id)
+
+
+async def get_question(qid: int, session: Optional[AsyncSession] = None) -> Optional[Dict[str, Any]]:
+    async with _reading(session) as s:
+        q = await s.get(Question, int(qid))
+        return question_to_dict(q) if q else None
+
+
+async def mark_question_answered(qid: int, answer_snippet: str = None, session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        q = await s.get(Question, int(qid), populate_existing=True)
+        if not q:
+            return
+        q.answered_at = dt.datetime.utcnow()
+        if answer_snippet:
+            q.answer_snippet = answer_snippet[:240]
+
+
+# --------------------
+# PendingPayment helpers
+# --------------------
+async def create_pending_payment(payload: Dict[str, Any], session: Optional[AsyncSession] = None) -> int:
+    async with _writing(session) as s:
+        pp = PendingPayment(
+            user_tg=int(payload["user_tg"]),
+            tariff=payload["tariff"],
+            plan=payload["plan"],
+            label=payload.get("label"),
+            base_price=int(payload.get("base_price", 0)),
+            bonus_applied=int(payload.get("bonus_applied", 0)),
+            payable=int(payload.get("payable", 0)),
+            status=payload.get("status", "awaiting_receipt"),
+            created_at=payload.get("created_at", dt.datetime.utcnow()),
+            receipt_file_id=payload.get("receipt_file_id"),
+            payer_last4=payload.get("payer_last4")
+        )
+        s.add(pp)
+        for stmt in sale_rollup_statements(None, approved_sale(pp)):
+            await s.execute(stmt)
+        await s.flush()
+        return int(pp.id)
+
+
+async def get_pending_payment(pid: int, session: Optional[AsyncSession] = None) -> Optional[Dict[str, Any]]:
+    async with _reading(session) as s:
+        pp = await s.get(PendingPayment, int(pid), populate_existing=True)
+        return payment_to_dict(pp) if pp else None
+
+
+async def update_pending_payment(pid: int, updates: Dict[str, Any], session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        pp = await s.get(PendingPayment, int(pid), populate_existing=True)
+        if not pp:
+            return
+        before = approved_sale(pp)
+        for k, v in updates.items():
+            if hasattr(pp, k):
+                setattr(pp, k, v)
+        # keep metrics_daily in the same transaction as the status change
+        for stmt in sale_rollup_statements(before, approved_sale(pp)):
+            await s.execute(stmt)
+
+
+async def get_latest_pending_by_user(tg_id: int, session: Optional[AsyncSession] = None) -> Optional[Dict[str, Any]]:
+    """Return the latest open (under_review/awaiting_*) payment dict for a Telegram user."""
+    async with _reading(session) as s:
+        pp = (await s.execute(
+            select(PendingPayment).where(
+                PendingPayment.user_tg == int(tg_id),
+                PendingPayment.status.in_(_OPEN_PAYMENT_STATUSES),
+            ).order_by(PendingPayment.created_at.desc()).limit(1)
+        )).scalars().first()
+        return payment_to_dict(pp) if pp else None
+
+
+# --------------------
+# Admin / reporting helpers
+# --------------------
+async def get_all_users() -> List[User]:
+    async with async_session() as session:
+        return list((await session.execute(select(User))).scalars().all())
+
+
+async def iter_recipients(*criteria, columns=(User.telegram_id,), batch_size: int = RECIPIENT_BATCH_SIZE,
+                          after_id: int = 0, reachable_only: bool = True) -> AsyncIterator[Any]:
+    """
+    Stream users matching `criteria` (SQLAlchemy expressions on User) in users.id
+    order, as rows of (id, *columns): e.g. `async for row in iter_recipients(): row.telegram_id`.
+    Users marked unreachable (see mark_unreachable) are skipped unless reachable_only=False.
+
+    Memory stays at one batch regardless of table size. Each batch is its own
+    short keyset query (id > last seen id) rather than one long-lived cursor: a
+    broadcast runs for minutes or hours, and an open read transaction that long
+    would keep SQLite from checkpointing the WAL. `after_id` resumes after a
+    previously seen row.
+    """
+    if reachable_only:
+        criteria += (User.unreachable_at.is_(None),)
+    stmt = select(User.id, *columns).where(*criteria).order_by(User.id).limit(int(batch_size))
+    last_id = int(after_id)
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(stmt.where(User.id > last_id))).all()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+async def count_recipients(*criteria, reachable_only: bool = True) -> int:
+    """COUNT of the users iter_recipients(*criteria) would stream."""
+    if reachable_only:
+        criteria += (User.unreachable_at.is_(None),)
+    async with async_session() as session:
+        return int((await session.execute(select(func.count(User.id)).where(*criteria))).scalar() or 0)
+
+
+async def get_useful_subscribers(batch_size: int = RECIPIENT_BATCH_SIZE) -> AsyncIterator[Any]:
+    """Stream (id, telegram_id) rows of useful-info subscribers."""
+    # Placeholder (same as database.py): every user counts as a subscriber.
+    async for row in iter_recipients(batch_size=batch_size):
+        yield row
+
+
+async def iter_expired_tariffs(chunk_size: int = EXPIRY_CHUNK_SIZE,
+                               reachable_only: bool = False) -> AsyncIterator[List[int]]:
+    """
+    Clear tariffs whose tariff_end has passed, one short write transaction per
+    chunk, yielding each chunk's telegram_ids right after it commits. Other
+    writers get the connection between chunks. With reachable_only, unreachable
+    users are expired too but left out of the yielded ids (nobody to notify).
+    """
+    now = dt.datetime.utcnow()
+    while True:
+        async with write_engine.begin() as conn:
+            rows = (await conn.execute(expire_tariffs_statement(now, chunk_size))).all()
+        invalidate_user(*(row.telegram_id for row in rows))
+        ids = [row.telegram_id for row in rows if not (reachable_only and row.unreachable_at)]
+        if ids:
+            yield ids
+        if len(rows) < chunk_size:
+            return
+
+
+async def deactivate_expired_tariffs(chunk_size: int = EXPIRY_CHUNK_SIZE) -> List[int]:
+    """Clear expired tariffs and return all affected telegram_ids (prefer iter_expired_tariffs)."""
+    expired = []
+    async for ids in iter_expired_tariffs(chunk_size):
+        expired.extend(ids)
+    return expired
+
+
+async def get_report_data(start_date: dt.datetime, end_date: dt.datetime) -> Dict[str, Any]:
+    """Async get_report_data; same two aggregated statements and dict as database.get_report_data."""
+    users_stmt, sales_stmt = report_statements(start_date, end_date)
+    async with async_session() as session:
+        users_row = (await session.execute(users_stmt)).one()
+        sales_rows = (await session.execute(sales_stmt)).all()
+    return build_report(start_date, end_date, users_row, sales_rows)
+
+
+async def get_referral_leaderboard(limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+    """Top referrers page: [{rank, id, telegram_id, name, phone, count}, ...]."""
+    async with async_session() as session:
+        rows = (await session.execute(referral_leaderboard_statement(limit, offset))).all()
+    return leaderboard_rows_to_dicts(rows, offset)
+
+
+async def get_top_referrer() -> Optional[Dict[str, Any]]:
+    """Return the user who referred the most registered users."""
+    top = await get_referral_leaderboard(limit=1)
+    return top[0] if top else None
+
+
+async def mark_unreachable(*tg_ids: int) -> int:
+    """Flag users Telegram refuses to deliver to (blocked the bot / deleted account); returns rows changed."""
+    if not tg_ids:
+        return 0
+    async with write_engine.begin() as conn:
+        changed = (await conn.execute(
+            update(User)
+            .where(User.telegram_id.in_([int(t) for t in tg_ids]), User.unreachable_at.is_(None))
+            .values(unreachable_at=dt.datetime.utcnow())
+        )).rowcount
+    invalidate_user(*tg_ids)
+    return changed
+
+
+# --------------------
+# Broadcast jobs
+# --------------------
+async def create_broadcast_job(payload: Dict[str, Any], created_by: int = None, total: int = None,
+                               audience: Optional[Dict[str, Any]] = None) -> int:
+    async with write_session() as session:
+        job = BroadcastJob(payload=json.dumps(payload, ensure_ascii=False), status="running",
+                           created_by=created_by, total=total,
+                           audience=json.dumps(audience, ensure_ascii=False) if audience else None)
+        session.add(job)
+        await session.commit()
+        return int(job.id)
+
+
+async def get_broadcast_job(job_id: int) -> Optional[Dict[str, Any]]:
+    async with async_session() as session:
+        job = await session.get(BroadcastJob, int(job_id))
+        return broadcast_job_to_dict(job) if job else None
+
+
+async def list_broadcast_jobs(*statuses: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Newest jobs first, optionally only those in `statuses`."""
+    stmt = select(BroadcastJob).order_by(BroadcastJob.id.desc()).limit(int(limit))
+    if statuses:
+        stmt = stmt.where(BroadcastJob.status.in_(statuses))
+    async with async_session() as session:
+        return [broadcast_job_to_dict(j) for j in (await session.execute(stmt)).scalars()]
+
+
+async def set_broadcast_job_status(job_id: int, status: str, *from_statuses: str) -> bool:
+    """Move a job to `status` (only from `from_statuses`, if given); False when nothing changed."""
+    now = dt.datetime.utcnow()
+    values = {"status": status, "updated_at": now}
+    if status in ("cancelled", "done"):
+        values["finished_at"] = now
+    stmt = update(BroadcastJob).where(BroadcastJob.id == int(job_id)).values(**values)
+    if from_statuses:
+        stmt = stmt.where(BroadcastJob.status.in_(from_statuses))
+    async with write_engine.begin() as conn:
+        return (await conn.execute(stmt)).rowcount > 0
+
+
+async def get_broadcast_recipient_ids(job_id: int, after_id: int = 0) -> set:
+    """users.id values that already have a result for the job beyond `after_id` (past the checkpoint)."""
+    async with async_session() as session:
+        return set((await session.execute(
+            select(BroadcastRecipient.user_id).where(
+                BroadcastRecipient.job_id == int(job_id), BroadcastRecipient.user_id > int(after_id),
+            )
+        )).scalars())
+
+
+async def set_broadcast_progress_message(job_id: int, chat_id: int, message_id: int) -> None:
+    async with write_engine.begin() as conn:
+        await conn.execute(
+            update(BroadcastJob).where(BroadcastJob.id == int(job_id))
+            .values(progress_chat_id=int(chat_id), progress_message_id=int(message_id))
+        )
+
+
+async def checkpoint_broadcast_job(job_id: int, cursor: int, results: List[Dict[str, Any]],
+                                   errors: Optional[Dict[str, int]] = None) -> Optional[str]:
+    """
+    Record a batch of per-recipient results ({user_id, chat_id, status, error})
+    and move the job's cursor forward, in one transaction; `errors` replaces the
+    per-error-class totals. Returns the job's current status so the runner
+    notices a pause/cancel from anywhere.
+    """
+    now = dt.datetime.utcnow()
+    counts = {"sent": 0, "blocked": 0, "failed": 0}
+    for r in results:
+        counts[r["status"]] += 1
+    values = dict(
+        cursor=func.max(BroadcastJob.cursor, int(cursor)),
+        sent=BroadcastJob.sent + counts["sent"],
+        blocked=BroadcastJob.blocked + counts["blocked"],
+        failed=BroadcastJob.failed + counts["failed"],
+        updated_at=now,
+    )
+    if errors is not None:
+        values["errors"] = json.dumps(errors)
+    async with write_engine.begin() as conn:
+        if results:
+            await conn.execute(
+                sqlite_insert(BroadcastRecipient).on_conflict_do_nothing(),
+                [{"job_id": int(job_id), "at": now, **r} for r in results],
+            )
+        return (await conn.execute(
+            update(BroadcastJob).where(BroadcastJob.id == int(job_id)).values(**values)
+            .returning(BroadcastJob.status)
+        )).scalar()
+
+
+async def has_claimed_free_useful(user_db_id: int, session: Optional[AsyncSession] = None) -> bool:
+    async with _reading(session) as s:
+        row = (await s.execute(
+            select(UsefulFreeClaim.id).where(UsefulFreeClaim.user_id == int(user_db_id)).limit(1)
+        )).first()
+        return bool(row)
+
+
+async def mark_claimed_free_useful(user_db_id: int, session: Optional[AsyncSession] = None) -> None:
+    async with _writing(session) as s:
+        existing = (await s.execute(
+            select(UsefulFreeClaim.id).where(UsefulFreeClaim.user_id == int(user_db_id)).limit(1)
+        )).first()
+        if existing:
+            return
+        s.add(UsefulFreeClaim(user_id=int(user_db_id), claimed=1))
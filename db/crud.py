@@ -1,14 +1,12 @@
 from typing import Optional, Dict, Any
-from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 import datetime as dt
-from .models import Base, User, PendingPayment
-from pathlib import Path
+from .models import User, PendingPayment
+from db_engine import get_engine
 
-DB_PATH = Path(__file__).resolve().parent.parent / "bot.db"
-ENGINE = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
+# Same process-wide engine as database.py (see db_engine.py)
+ENGINE = get_engine()
 SessionLocal = sessionmaker(bind=ENGINE, autoflush=False)
-Base.metadata.create_all(bind=ENGINE)
 
 REFERRAL_BONUS = 1000
 
@@ -0,0 +1,130 @@
+"""
+db_engine.py
+
+Process-wide SQLAlchemy engines for bot.db.
+
+Every module shares the engines built here instead of calling create_engine /
+create_async_engine on its own, so all connections get the same SQLite tuning:
+- journal_mode=WAL: readers never block the writer and the writer never blocks readers
+- synchronous=NORMAL: safe with WAL and avoids an fsync per commit
+- mmap_size: pages are read through the OS page cache without read() syscalls
+- busy_timeout: a competing writer waits instead of failing with "database is locked"
+
+Async side: a pooled reader engine plus a writer engine that owns exactly one
+connection. Checking out that connection is the serialized writer queue: write
+transactions wait their turn (FIFO) on the pool instead of racing for SQLite's
+write lock. The sync engine (database.py helpers, scripts) uses the same pragmas.
+"""
+from functools import lru_cache
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import DATABASE_URL, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, DB_READ_POOL_SIZE
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "bot.db"
+
+ASYNC_URL = DATABASE_URL or f"sqlite+aiosqlite:///{DB_PATH}"
+SYNC_URL = ASYNC_URL.replace("+aiosqlite", "")
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def apply_sqlite_pragmas(engine: Engine) -> None:
+    """Run the tuning pragmas on every new DBAPI connection of `engine` (sync engine or AsyncEngine.sync_engine)."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+            cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+
+def create_sync_engine(url: str = SYNC_URL) -> Engine:
+    if not _is_sqlite(url):
+        return create_engine(url, pool_pre_ping=True)
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        poolclass=QueuePool,
+        pool_size=DB_READ_POOL_SIZE,
+        max_overflow=0,
+    )
+    apply_sqlite_pragmas(engine)
+    return engine
+
+
+def create_read_engine(url: str = ASYNC_URL) -> AsyncEngine:
+    if not _is_sqlite(url):
+        return create_async_engine(url, pool_size=DB_READ_POOL_SIZE, pool_pre_ping=True)
+    engine = create_async_engine(
+        url,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_READ_POOL_SIZE,
+        max_overflow=0,
+    )
+    apply_sqlite_pragmas(engine.sync_engine)
+    return engine
+
+
+def create_write_engine(url: str = ASYNC_URL) -> AsyncEngine:
+    if not _is_sqlite(url):
+        # Server databases handle concurrent writers themselves; share the reader pool settings.
+        return create_async_engine(url, pool_size=DB_READ_POOL_SIZE, pool_pre_ping=True)
+    # One connection, no overflow: callers queue on pool checkout, so writes are serialized.
+    engine = create_async_engine(
+        url,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=60,
+    )
+    apply_sqlite_pragmas(engine.sync_engine)
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_engine() -> Engine:
+    """Shared sync engine (database.py helpers, scripts)."""
+    return create_sync_engine()
+
+
+@lru_cache(maxsize=None)
+def get_read_engine() -> AsyncEngine:
+    """Shared async engine for read-only sessions."""
+    return create_read_engine()
+
+
+@lru_cache(maxsize=None)
+def get_write_engine() -> AsyncEngine:
+    """Shared single-connection async engine; all async writes go through it."""
+    return create_write_engine()
+
+
+async def dispose_engines() -> None:
+    """Close pooled connections (call on shutdown)."""
+    for getter in (get_read_engine, get_write_engine):
+        if getter.cache_info().currsize:
+            await getter().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
+
+
+__all__ = [
+    "DB_PATH", "ASYNC_URL", "SYNC_URL",
+    "apply_sqlite_pragmas", "create_sync_engine", "create_read_engine", "create_write_engine",
+    "get_engine", "get_read_engine", "get_write_engine", "dispose_engines",
+]
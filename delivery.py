@@ -0,0 +1,120 @@
+"""
+delivery.py
+
+The shared send path: a request middleware on the bot's session, so every API
+call the bot makes (broadcasts, expiry notices, staff replies, plain handler
+answers) goes through it.
+
+- TelegramRetryAfter: the whole bot backs off. The shared limiter pauses every
+  sender for retry_after seconds and halves the broadcast rate, which then
+  recovers call by call. The call itself is retried up to SEND_MAX_RETRIES times.
+- Blocked the bot / deactivated account / chat not found on a send (send*,
+  copyMessage, forwardMessage): the user is marked unreachable in `users`
+  (db.mark_unreachable) and the error is re-raised;
+  iter_recipients skips such users from then on, and their next update to the
+  bot clears the flag.
+
+`limiter` is the one BroadcastLimiter shared by every broadcast in the process,
+so concurrent jobs together stay under Telegram's global limit.
+"""
+import logging
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+
+from config import BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL, SEND_MAX_RETRIES
+from utils.ratelimit import BroadcastLimiter
+
+logger = logging.getLogger(__name__)
+
+limiter = BroadcastLimiter(BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL)
+
+# TelegramBadRequest descriptions that also mean "this chat will never accept messages"
+_GONE_CHAT_ERRORS = ("chat not found", "user is deactivated")
+# besides send*: the methods that deliver a message to chat_id
+_DELIVERING_METHODS = ("copyMessage", "copyMessages", "forwardMessage", "forwardMessages")
+
+
+def is_unreachable_error(error: Exception) -> bool:
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and any(m in str(error).lower() for m in _GONE_CHAT_ERRORS)
+
+
+def error_class(error: Exception) -> str:
+    """Short name of a failure for broadcast statistics."""
+    if is_unreachable_error(error):
+        return "unreachable"
+    if isinstance(error, TelegramRetryAfter):
+        return "flood"
+    if isinstance(error, TelegramBadRequest):
+        return "bad_request"
+    if isinstance(error, TelegramNetworkError):
+        return "network"
+    if isinstance(error, TelegramServerError):
+        return "server"
+    return type(error).__name__
+
+
+def _recipient(method: TelegramMethod) -> Optional[int]:
+    """The user chat a message-sending call delivers to; None for every other call (getChatMember, edits...)."""
+    name = method.__api_method__
+    if not (name.startswith("send") or name in _DELIVERING_METHODS):
+        return None
+    chat_id = getattr(method, "chat_id", None)
+    return chat_id if isinstance(chat_id, int) else None
+
+
+class DeliveryMiddleware(BaseRequestMiddleware):
+    def __init__(self, shared: BroadcastLimiter = limiter, max_retries: int = SEND_MAX_RETRIES):
+        self.limiter = shared
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        attempt = 0
+        while True:
+            await self.limiter.bucket.wait_paused()
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.on_retry_after(e.retry_after)
+                attempt += 1
+                logger.warning("Flood control on %s: retry after %ss (attempt %s)",
+                               method.__api_method__, e.retry_after, attempt)
+                if attempt > self.max_retries:
+                    raise
+                continue
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                chat_id = _recipient(method)
+                if chat_id is not None and is_unreachable_error(e):
+                    await _mark_unreachable(chat_id, e)
+                raise
+            # a long poll returning says nothing about the send rate
+            if not isinstance(method, GetUpdates):
+                self.limiter.on_success()
+            return response
+
+
+async def _mark_unreachable(chat_id: int, error: Any) -> None:
+    from db import mark_unreachable
+
+    try:
+        if await mark_unreachable(chat_id):
+            logger.info("Chat %s marked unreachable: %s", chat_id, error)
+    except Exception:
+        logger.exception("Could not mark chat %s unreachable", chat_id)
+
+
+def setup_delivery(bot: Bot) -> Bot:
+    """Route all of `bot`'s API calls through DeliveryMiddleware (once per bot)."""
+    if not any(isinstance(m, DeliveryMiddleware) for m in bot.session.middleware):
+        bot.session.middleware(DeliveryMiddleware())
+    return bot
+
+
+__all__ = ["limiter", "DeliveryMiddleware", "is_unreachable_error", "error_class", "setup_delivery"]
@@ -0,0 +1,175 @@
+"""
+fsm_storage.py
+
+SQLiteStorage: aiogram FSM storage kept in the bot's database (table
+fsm_states), so purchase flows, registrations and staff replies in progress
+survive restarts and deploys, and worker processes share one store.
+
+- Every change goes into an in-process LRU cache (FSM_CACHE_SIZE keys)
+  immediately, so the next read of that key never waits for the database.
+  Reads that miss the cache cost one primary-key lookup.
+- Changed keys are written out in batches: every FSM_FLUSH_SECONDS one write
+  transaction upserts all of them (keys cleared by state.clear() are deleted),
+  and close() flushes what is left. A crash loses at most that window.
+- Keys not written for FSM_STATE_TTL_HOURS are abandoned flows; the flusher
+  deletes them every CLEANUP_SECONDS.
+
+The cache assumes one process owns a chat's keys at a time (one bot process,
+or workers sharded by chat id); its entries expire after the TTL anyway.
+"""
+import copy
+import json
+import time
+import asyncio
+import logging
+import datetime as dt
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import FSM_CACHE_SIZE, FSM_FLUSH_SECONDS, FSM_STATE_TTL_HOURS
+from database import FsmState
+from db import async_session, write_engine
+from utils.cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_SECONDS = 600
+
+# (state, data) of one key; a cleared key is (None, {})
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+_upsert = sqlite_insert(FsmState)
+_UPSERT = _upsert.on_conflict_do_update(
+    index_elements=[FsmState.key],
+    set_={"state": _upsert.excluded.state, "data": _upsert.excluded.data, "updated_at": _upsert.excluded.updated_at},
+)
+_DELETE = delete(FsmState).where(FsmState.key == bindparam("k"))
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_SECONDS,
+                 ttl_hours: float = FSM_STATE_TTL_HOURS, key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True,
+        )
+        self.flush_interval = float(flush_interval)
+        self.ttl = dt.timedelta(hours=ttl_hours)
+        self._cache = TTLCache(maxsize=cache_size, ttl=self.ttl.total_seconds())
+        # changed since the last flush, and the batch a running flush is writing
+        self._pending: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_cleanup = 0.0
+
+    # ---- reads and writes ----
+    async def _record(self, key: str) -> Record:
+        for batch in (self._pending, self._flushing):
+            if key in batch:
+                return batch[key]
+        record = self._cache.get(key)
+        if record is not MISSING:
+            return record
+        generation = self._cache.generation
+        async with async_session() as session:
+            row = (await session.execute(
+                select(FsmState.state, FsmState.data).where(FsmState.key == key)
+            )).first()
+        record = (row.state, json.loads(row.data)) if row else (None, {})
+        # dropped if the key was written while we were reading
+        self._cache.put(key, record, generation)
+        return record
+
+    def _write(self, key: str, record: Record) -> None:
+        self._pending[key] = record
+        self._cache.invalidate(key)
+        self._cache.put(key, record)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        _, data = await self._record(k)
+        self._write(k, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(self.key_builder.build(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        state, _ = await self._record(k)
+        self._write(k, (state, copy.deepcopy(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._record(self.key_builder.build(key)))[1])
+
+    # ---- persistence ----
+    async def flush(self) -> int:
+        """Write every key changed since the last flush in one transaction; returns how many."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        self._flushing = batch
+        now = dt.datetime.utcnow()
+        upserts = [
+            {"key": k, "state": state, "data": json.dumps(data, ensure_ascii=False), "updated_at": now}
+            for k, (state, data) in batch.items() if state is not None or data
+        ]
+        deletes = [{"k": k} for k, (state, data) in batch.items() if state is None and not data]
+        try:
+            async with write_engine.begin() as conn:
+                if upserts:
+                    await conn.execute(_UPSERT, upserts)
+                if deletes:
+                    await conn.execute(_DELETE, deletes)
+        except BaseException:
+            # retry with the next flush unless the key changed again meanwhile (also on cancellation)
+            for k, record in batch.items():
+                self._pending.setdefault(k, record)
+            raise
+        finally:
+            self._flushing = {}
+        return len(batch)
+
+    async def cleanup(self) -> int:
+        """Delete keys not written for the TTL; returns how many."""
+        cutoff = dt.datetime.utcnow() - self.ttl
+        async with write_engine.begin() as conn:
+            keys = (await conn.execute(
+                delete(FsmState).where(FsmState.updated_at < cutoff).returning(FsmState.key)
+            )).scalars().all()
+        self._cache.invalidate(*(k for k in keys if k not in self._pending))
+        self._last_cleanup = time.monotonic()
+        return len(keys)
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_cleanup >= CLEANUP_SECONDS:
+                    removed = await self.cleanup()
+                    if removed:
+                        logger.info("Removed %s abandoned FSM states", removed)
+            except Exception:
+                logger.exception("FSM storage flush failed")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "pending": len(self._pending)}
+
+    async def close(self) -> None:
+        """Stop the flusher and write out pending changes."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+
+__all__ = ["SQLiteStorage"]
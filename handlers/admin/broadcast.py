@@ -1,12 +1,21 @@
 # handlers/admin/broadcast.py
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from config import ADMIN_ID, STICKER_TARIFF
-from database import get_all_users
+from config import ADMIN_ID, DOCTOR_ID, STICKER_TARIFF, BROADCAST_WITH_STICKER
+from db import get_broadcast_job, list_broadcast_jobs, count_recipients
+from broadcast import collect_album, spec_from_messages
+from broadcast_jobs import (
+    ACTIVE_STATUSES, JOB_STATUS_LABELS, create_job, pause_job, resume_job, cancel_job, progress_text,
+)
+from keyboards.inline.admin_panel import broadcast_job_kb, segment_kb
+from segments import Segment, SEGMENT_TARIFFS, NO_TARIFF
 from loader import bot, answer_with_sticker
+import datetime as dt
 import logging
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -14,17 +23,33 @@ router = Router()
 
 
 class BroadcastStates(StatesGroup):
+    audience = State()
     text = State()
 
 
+PROMPT_TEXT = "✏️ Tanlangan foydalanuvchilarga yuboriladigan xabarni yuboring (matn, rasm, video, hujjat yoki albom):"
+
+
+def _audience_text(segment: Segment, count: int) -> str:
+    return f"👥 Auditoriya: {segment.describe()}\nQabul qiluvchilar: {count}\n\nFiltrlarni tanlang:"
+
+
+async def start_audience_picker(message: Message, state: FSMContext):
+    """First broadcast step: pick a segment; the count is refreshed on every change."""
+    segment = Segment()
+    count = await count_recipients(*segment.criteria())
+    await state.set_state(BroadcastStates.audience)
+    await state.update_data(segment=segment.to_dict())
+    await message.answer(_audience_text(segment, count), reply_markup=segment_kb(segment, count))
+
+
 @router.callback_query(F.data == "broadcast_all")
 async def broadcast_start(call: CallbackQuery, state: FSMContext):
-    """Ask admin to enter broadcast text and set FSM state."""
+    """Start a broadcast: audience picker first, then the message."""
     try:
         caller = call.from_user.id
         logger.info("broadcast_start requested by %s", caller)
         if caller != ADMIN_ID:
-            from config import DOCTOR_ID
             if caller != DOCTOR_ID:
                 return await call.answer("⛔ Siz admin emassiz!", show_alert=True)
 
@@ -34,16 +59,7 @@ async def broadcast_start(call: CallbackQuery, state: FSMContext):
         except Exception:
             pass
 
-        try:
-            await answer_with_sticker(call.message, "✏️ Barcha foydalanuvchilarga yuboriladigan xabar matnini kiriting:", sticker_file_id=STICKER_TARIFF)
-        except Exception as e:
-            logger.exception("Failed to prompt admin for broadcast text: %s", e)
-            try:
-                await call.message.answer("✏️ Barcha foydalanuvchilarga yuboriladigan xabar matnini kiriting:")
-            except Exception:
-                pass
-
-        await state.set_state(BroadcastStates.text)
+        await start_audience_picker(call.message, state)
     except Exception as exc:
         logger.exception("Error in broadcast_start: %s", exc)
         try:
@@ -52,48 +68,79 @@ async def broadcast_start(call: CallbackQuery, state: FSMContext):
             pass
 
 
+def _toggle(segment: Segment, kind: str, value: str) -> Segment:
+    if kind == "t":
+        key = NO_TARIFF if value == "n" else SEGMENT_TARIFFS[int(value)][0]
+        tariffs = tuple(t for t in segment.tariffs if t != key)
+        return segment.update(tariffs=tariffs if key in segment.tariffs else tariffs + (key,))
+    if kind == "s":
+        return segment.update(status=None if segment.status == value else value)
+    if kind == "a":
+        days = int(value)
+        return segment.update(seen_within_days=None if segment.seen_within_days == days else days,
+                              not_seen_days=None)
+    if kind == "i":
+        days = int(value)
+        return segment.update(not_seen_days=None if segment.not_seen_days == days else days,
+                              seen_within_days=None)
+    if kind == "j":
+        joined_from = segment.as_of - dt.timedelta(days=int(value))
+        return segment.update(joined_from=None if segment.joined_from == joined_from else joined_from)
+    if kind == "b":
+        return segment.update(with_bonus=not segment.with_bonus)
+    if kind == "reset":
+        return Segment()
+    return segment
+
+
+@router.callback_query(BroadcastStates.audience, F.data.startswith("seg:"))
+async def broadcast_audience(call: CallbackQuery, state: FSMContext):
+    """seg:<filter>:<value> toggles a filter and re-counts; seg:go moves on to the message."""
+    if call.from_user.id not in (ADMIN_ID, DOCTOR_ID):
+        return await call.answer("⛔ Siz admin emassiz!", show_alert=True)
+    try:
+        _, kind, value = call.data.split(":")
+    except ValueError:
+        return await call.answer()
+    segment = Segment.from_dict((await state.get_data()).get("segment"))
+
+    if kind == "go":
+        await call.answer()
+        await state.set_state(BroadcastStates.text)
+        try:
+            await answer_with_sticker(call.message, PROMPT_TEXT, sticker_file_id=STICKER_TARIFF)
+        except Exception as e:
+            logger.exception("Failed to prompt admin for broadcast text: %s", e)
+            await call.message.answer(PROMPT_TEXT)
+        return
+
+    segment = _toggle(segment, kind, value)
+    await state.update_data(segment=segment.to_dict())
+    # one COUNT over the indexed filters: instant even on large tables
+    count = await count_recipients(*segment.criteria())
+    await call.answer()
+    try:
+        await call.message.edit_text(_audience_text(segment, count), reply_markup=segment_kb(segment, count))
+    except Exception:
+        pass
+
+
 @router.message(BroadcastStates.text)
-async def broadcast_process(message: Message, state: FSMContext):
-    """Send provided message.text to all users returned by get_all_users()."""
+async def broadcast_process(message: Message, state: FSMContext, album: Optional[list] = None):
+    """Turn whatever the admin sent (text, media, album) into a broadcast job sent in the background."""
+    messages = await collect_album(message, album)
+    if messages is None:
+        # later part of an album: the call for its first message handles the whole group
+        return
     try:
-        users = get_all_users()
-        if not users:
-            await message.answer("Foydalanuvchi topilmadi. Test sifatida xabar adminga yuboriladi.")
-            # Send to admin for verification
-            try:
-                await bot.send_message(ADMIN_ID, f"[TEST BROADCAST]\n{message.text}")
-            except Exception:
-                pass
-            await state.clear()
-            return
-
-        count = 0
-        for user in users:
-            user_id = getattr(user, "telegram_id", None)
-            if not user_id:
-                continue
-            try:
-                if STICKER_TARIFF:
-                    try:
-                        await bot.send_sticker(user_id, STICKER_TARIFF)
-                    except Exception:
-                        pass
-                # prepend a clinic/doctor signature to make the broadcast look official
-                signature = "Doctor Mirsaid"
-                await bot.send_message(user_id, f"{signature}: {message.text}")
-                count += 1
-            except Exception as e:
-                # log and continue on per-user failures
-                logger.exception("Failed to send broadcast to %s: %s", user_id, e)
-                continue
-
-        if count == 0:
-            # no successful sends, send a test copy to admin so they can see text
-            try:
-                await bot.send_message(ADMIN_ID, f"[TEST BROADCAST]\n{message.text}")
-            except Exception:
-                pass
-        await answer_with_sticker(message, f"✅ {count} ta foydalanuvchiga xabar yuborildi.", sticker_file_id=STICKER_TARIFF)
+        # prepend a clinic/doctor signature to make the broadcast look official
+        signature = "Doctor Mirsaid: "
+        spec = spec_from_messages(messages, prefix=signature,
+                                  sticker=STICKER_TARIFF if BROADCAST_WITH_STICKER else None)
+        segment = Segment.from_dict((await state.get_data()).get("segment"))
+        # the job posts its own live progress message into this chat
+        await create_job(bot, spec, created_by=message.from_user.id, progress_chat_id=message.chat.id,
+                         audience=segment)
     except Exception as exc:
         logger.exception("Error during broadcast_process: %s", exc)
         await message.answer("Xatolik yuz berdi: broadcast amalga oshirilmadi.")
@@ -103,3 +150,50 @@ async def broadcast_process(message: Message, state: FSMContext):
         except Exception:
             pass
 
+
+def _job_line(job) -> str:
+    return (f"#{job['id']} — {JOB_STATUS_LABELS.get(job['status'], job['status'])}: {job['sent']} yuborildi, "
+            f"{job['blocked']} bloklagan, {job['failed']} xato")
+
+
+@router.message(Command("broadcasts"))
+async def broadcast_jobs_list(message: Message):
+    """Recent broadcast jobs, with controls for the unfinished ones."""
+    if message.from_user.id not in (ADMIN_ID, DOCTOR_ID):
+        return await message.answer("⛔ Siz admin emassiz!")
+    jobs = await list_broadcast_jobs(limit=10)
+    if not jobs:
+        return await message.answer("Hali xabar yuborilmagan.")
+    await message.answer("📢 Oxirgi xabarlar:\n" + "\n".join(_job_line(job) for job in jobs))
+    for job in jobs:
+        if job["status"] in ACTIVE_STATUSES:
+            await message.answer(progress_text(job), reply_markup=broadcast_job_kb(job["id"], job["status"]))
+
+
+@router.callback_query(F.data.startswith("bjob:"))
+async def broadcast_job_control(call: CallbackQuery):
+    """bjob:<pause|resume|cancel>:<job_id>"""
+    if call.from_user.id not in (ADMIN_ID, DOCTOR_ID):
+        return await call.answer("⛔ Siz admin emassiz!", show_alert=True)
+    try:
+        _, action, job_id = call.data.split(":")
+        job_id = int(job_id)
+    except ValueError:
+        return await call.answer()
+
+    if action == "pause":
+        changed = await pause_job(job_id)
+    elif action == "resume":
+        changed = await resume_job(bot, job_id)
+    elif action == "cancel":
+        changed = await cancel_job(job_id)
+    else:
+        return await call.answer()
+
+    job = await get_broadcast_job(job_id)
+    await call.answer("✅" if changed else "Holat o'zgarmadi")
+    if job:
+        try:
+            await call.message.edit_text(progress_text(job), reply_markup=broadcast_job_kb(job_id, job["status"]))
+        except Exception:
+            pass
@@ -1,9 +1,10 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from loader import bot
-from database import Session, User, PendingPayment
+from db import async_session, flush_activity, user_cache_stats, User, PendingPayment
 from config import ADMIN_ID
-from sqlalchemy import func
+from middlewares.metrics import metrics, LATENCY_BUCKETS
+from sqlalchemy import select, func
 from datetime import datetime, timedelta
 
 router = Router()
@@ -14,34 +15,56 @@ async def admin_dashboard(message: Message):
         await message.answer("⛔ Siz admin emassiz!")
         return
 
-    session = Session()
+    # Write buffered activity first so the 15-minute window is current
     try:
+        await flush_activity()
+    except Exception:
+        pass
+    async with async_session() as session:
         # Active users in the last 15 minutes
-        active_users = session.query(func.count(User.id)).filter(
-            User.last_active >= datetime.utcnow() - timedelta(minutes=15)
-        ).scalar()
+        active_users = (await session.execute(
+            select(func.count(User.id)).where(
+                User.last_active >= datetime.utcnow() - timedelta(minutes=15)
+            )
+        )).scalar()
 
         # Active subscriptions
-        active_subscriptions = session.query(
-            User.tariff, func.count(User.id)
-        ).filter(User.tariff.isnot(None)).group_by(User.tariff).all()
+        active_subscriptions = (await session.execute(
+            select(User.tariff, func.count(User.id))
+            .where(User.tariff.isnot(None)).group_by(User.tariff)
+        )).all()
 
         # Daily questions and answers
-        daily_questions = session.query(func.count(PendingPayment.id)).filter(
-            PendingPayment.created_at >= datetime.utcnow().date()
-        ).scalar()
-
-        # Build dashboard text
-        text = (
-            "📊 *Real-Time Dashboard*\n\n"
-            f"👥 *Active Users*: {active_users}\n\n"
-            "📦 *Active Subscriptions:*\n"
-        )
-        for tariff, count in active_subscriptions:
-            text += f"  - {tariff}: {count}\n"
-
-        text += f"\n💬 *Daily Questions*: {daily_questions}\n"
-
-        await message.answer(text, parse_mode="Markdown")
-    finally:
-        session.close()
+        daily_questions = (await session.execute(
+            select(func.count(PendingPayment.id)).where(
+                PendingPayment.created_at >= datetime.utcnow().date()
+            )
+        )).scalar()
+
+    # Build dashboard text
+    text = (
+        "📊 *Real-Time Dashboard*\n\n"
+        f"👥 *Active Users*: {active_users}\n\n"
+        "📦 *Active Subscriptions:*\n"
+    )
+    for tariff, count in active_subscriptions:
+        text += f"  - {tariff}: {count}\n"
+
+    text += f"\n💬 *Daily Questions*: {daily_questions}\n"
+
+    cache = user_cache_stats()
+    text += f"\n🗂 *User cache*: {cache['hits']} hit / {cache['misses']} miss ({cache['hit_rate']:.0%}), {cache['size']} cached\n"
+
+    # Slowest handlers since start (total time), per-update averages
+    rows = metrics.summary(top=5)
+    if rows:
+        text += "\n⏱ *Handlers* (avg / p95 ms, SQL, DB ms, API calls per update):\n"
+        for r in rows:
+            name = r["handler"].rsplit(".", 2)
+            name = ".".join(name[-2:]).replace("_", "\\_")
+            errors = f", {r['errors']} xato" if r["errors"] else ""
+            p95 = f"≤{r['p95_ms']:.0f}" if r["p95_ms"] != float("inf") else f">{LATENCY_BUCKETS[-1] * 1000:.0f}"
+            text += (f"  - {name}: {r['updates']} ta, {r['avg_ms']:.0f} / {p95}, "
+                     f"{r['sql_per_update']:.1f} SQL, {r['db_ms_per_update']:.0f} ms, {r['api_per_update']:.1f} API{errors}\n")
+
+    await message.answer(text, parse_mode="Markdown")
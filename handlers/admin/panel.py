@@ -1,17 +1,28 @@
 from aiogram import Router, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery
+from aiogram.types import (
+    Message, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from text_dispatch import Button
 from datetime import datetime, timedelta
 import logging
+from typing import Optional
 
 from loader import bot, answer_with_sticker
-from config import ADMIN_ID, DOCTOR_ID, STICKER_TARIFF
-from database import get_report_data, get_all_users, deactivate_expired_tariffs, get_top_referrer
+from config import ADMIN_ID, DOCTOR_ID, STICKER_TARIFF, BROADCAST_WITH_STICKER
+from db import get_report_data, iter_expired_tariffs, get_referral_leaderboard
+from broadcast import run_broadcast, text_payload, collect_album, spec_from_messages
+from broadcast_jobs import create_job
+from segments import Segment
+from handlers.admin.broadcast import start_audience_picker
+from delivery import is_unreachable_error
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+LEADERBOARD_PAGE_SIZE = 10
+
 
 class BroadcastStates(StatesGroup):
     text = State()
@@ -73,49 +84,34 @@ async def admin_entry(message: Message, state: FSMContext | None = None):
 
 
 # Broadcast flow
-@router.message(lambda m: m.text == '📢 Barchaga xabar yuborish')
+@router.message(Button('📢 Barchaga xabar yuborish'))
 async def admin_broadcast_start(message: Message, state: FSMContext):
     caller = message.from_user.id
     if caller not in (ADMIN_ID, DOCTOR_ID):
         return await message.answer("⛔ Siz bu amalni bajarishga ruxsatga ega emassiz.")
-    await answer_with_sticker(message, "✏️ Iltimos, barcha foydalanuvchilarga yuboriladigan matnni kiriting:", sticker_file_id=STICKER_TARIFF)
-    await state.set_state(BroadcastStates.text)
+    await start_audience_picker(message, state)
 
 
 @router.message(BroadcastStates.text)
-async def admin_broadcast_process(message: Message, state: FSMContext):
-    text = message.text or ""
+async def admin_broadcast_process(message: Message, state: FSMContext, album: Optional[list] = None):
+    messages = await collect_album(message, album)
+    if messages is None:
+        return
     signature = "Bakumov Qiziriq Klinikasi"
-    full_text = f"{signature}:\n\n{text}"
 
     try:
-        users = get_all_users()
+        spec = spec_from_messages(messages, prefix=f"{signature}:\n\n",
+                                  sticker=STICKER_TARIFF if BROADCAST_WITH_STICKER else None)
+        segment = Segment.from_dict((await state.get_data()).get("segment"))
+        # the job posts its own live progress message into this chat
+        await create_job(bot, spec, created_by=message.from_user.id, progress_chat_id=message.chat.id,
+                         audience=segment)
     except Exception as e:
-        logger.exception("Failed to get users for broadcast: %s", e)
-        await message.answer("Xatolik: foydalanuvchilar ro'yxatini olishda xatolik yuz berdi.")
+        logger.exception("Failed to start broadcast job: %s", e)
+        await message.answer("Xatolik: xabarni yuborishni boshlab bo'lmadi.")
         await state.clear()
         return
 
-    sent = 0
-    for u in users:
-        try:
-            user_id = getattr(u, 'telegram_id', None)
-            if not user_id:
-                continue
-            await bot.send_message(user_id, full_text)
-            sent += 1
-        except Exception as e:
-            logger.exception("Broadcast send failed for %s: %s", user_id, e)
-            continue
-
-    if sent == 0:
-        # send test copy to admin so they see the broadcast content
-        try:
-            await bot.send_message(ADMIN_ID, f"[TEST BROADCAST]\n{full_text}")
-        except Exception:
-            pass
-
-    await answer_with_sticker(message, f"✅ {sent} ta foydalanuvchiga xabar yuborildi.", sticker_file_id=STICKER_TARIFF)
     await state.clear()
     await answer_with_sticker(message, "Admin panelga qaytildi.", sticker_file_id=STICKER_TARIFF, reply_markup=admin_main_keyboard())
 
@@ -123,7 +119,7 @@ async def admin_broadcast_process(message: Message, state: FSMContext):
 # Reports
 async def _send_report_for_range(message: Message, start: datetime, end: datetime, title: str):
     try:
-        report = get_report_data(start, end)
+        report = await get_report_data(start, end)
     except Exception as e:
         logger.exception("get_report_data failed: %s", e)
         await message.answer("Hisobot olinayotganda xatolik yuz berdi.")
@@ -161,7 +157,7 @@ async def _send_report_for_range(message: Message, start: datetime, end: datetim
     await message.answer(text, reply_markup=kb)
 
 
-@router.message(lambda m: m.text == '📊 Hisobot olish')
+@router.message(Button('📊 Hisobot olish'))
 async def admin_reports_menu(message: Message):
     caller = message.from_user.id
     if caller not in (ADMIN_ID, DOCTOR_ID):
@@ -169,21 +165,21 @@ async def admin_reports_menu(message: Message):
     await answer_with_sticker(message, "📊 Hisobot turini tanlang:", sticker_file_id=STICKER_TARIFF, reply_markup=report_options_keyboard())
 
 
-@router.message(lambda m: m.text == '1 kunlik hisobot')
+@router.message(Button('1 kunlik hisobot'))
 async def report_1day(message: Message):
     now = datetime.now()
     start = datetime(now.year, now.month, now.day)
     await _send_report_for_range(message, start, now, '1 kunlik hisobot')
 
 
-@router.message(lambda m: m.text == '1 haftalik hisobot')
+@router.message(Button('1 haftalik hisobot'))
 async def report_7day(message: Message):
     now = datetime.now()
     start = now - timedelta(days=7)
     await _send_report_for_range(message, start, now, '7 kunlik hisobot')
 
 
-@router.message(lambda m: m.text == '1 oylik hisobot')
+@router.message(Button('1 oylik hisobot'))
 async def report_30day(message: Message):
     now = datetime.now()
     start = now - timedelta(days=30)
@@ -348,6 +344,10 @@ async def staff_send_reply(message: Message, state: FSMContext):
         else:
             await message.answer('❌ Xatolik: xabar yuborilmadi. Iltimos qayta urinib ko\'ring.')
     except Exception as e:
+        if is_unreachable_error(e):
+            await message.answer('❌ Foydalanuvchi botni bloklagan yoki akkaunti o\'chirilgan.')
+            await state.clear()
+            return
         logger.exception('Failed to send staff reply to %s: %s', target, e)
         try:
             await message.answer(f'Xatolik yuborishda: {e}')
@@ -357,11 +357,64 @@ async def staff_send_reply(message: Message, state: FSMContext):
     await state.clear()
 
 
+# Referral leaderboard: /referrals, paged with inline buttons (callback "reflb_<offset>")
+async def _leaderboard_page(offset: int):
+    # one extra row tells whether a next page exists without a COUNT(*)
+    rows = await get_referral_leaderboard(limit=LEADERBOARD_PAGE_SIZE + 1, offset=offset)
+    has_next = len(rows) > LEADERBOARD_PAGE_SIZE
+    rows = rows[:LEADERBOARD_PAGE_SIZE]
+
+    if not rows:
+        text = "🏆 Referallar reytingi\n\nHozircha referallar yo'q."
+    else:
+        text = "🏆 Referallar reytingi\n\n"
+        for row in rows:
+            text += f"{row['rank']}. {row.get('name') or '—'} ({row.get('phone') or '—'}) - {row['count']} foydalanuvchi\n"
+
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"reflb_{max(offset - LEADERBOARD_PAGE_SIZE, 0)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"reflb_{offset + LEADERBOARD_PAGE_SIZE}"))
+    kb = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return text, kb
+
+
+@router.message(lambda m: m.text == '/referrals')
+async def admin_referral_leaderboard(message: Message):
+    caller = message.from_user.id
+    if caller not in (ADMIN_ID, DOCTOR_ID):
+        return await message.answer("⛔ Siz bu amalni bajarishga ruxsatga ega emassiz.")
+    text, kb = await _leaderboard_page(0)
+    await message.answer(text, reply_markup=kb)
+
+
+@router.callback_query(lambda c: c.data and c.data.startswith('reflb_'))
+async def admin_referral_leaderboard_page(call: CallbackQuery):
+    caller = call.from_user.id
+    if caller not in (ADMIN_ID, DOCTOR_ID):
+        return await call.answer("⛔ Siz bu amalni bajarishga ruxsatga ega emassiz.", show_alert=True)
+    try:
+        offset = max(int(call.data.split('_', 1)[1]), 0)
+    except Exception:
+        offset = 0
+    text, kb = await _leaderboard_page(offset)
+    try:
+        await call.message.edit_text(text, reply_markup=kb)
+    except Exception:
+        # e.g. message not modified; nothing to update
+        pass
+    try:
+        await call.answer()
+    except Exception:
+        pass
+
+
 # Scheduler helpers
 async def send_10_day_report():
     now = datetime.utcnow()
     start = now - timedelta(days=10)
-    report = get_report_data(start, now)
+    report = await get_report_data(start, now)
     text = (
         f"📊 10 kunlik hisobot\n"
         f"📅 {start.strftime('%d.%m.%Y')} - {now.strftime('%d.%m.%Y')}\n"
@@ -375,7 +428,7 @@ async def send_10_day_report():
 async def send_monthly_report():
     now = datetime.utcnow()
     start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    report = get_report_data(start, now)
+    report = await get_report_data(start, now)
     text = (
         f"📊 Oylik hisobot\n"
         f"📅 {start.strftime('%d.%m.%Y')} - {now.strftime('%d.%m.%Y')}\n"
@@ -383,26 +436,31 @@ async def send_monthly_report():
         f"💰 Umumiy daromad: {report.get('total_sum', 0):,} UZS\n"
         f"Jami foydalanuvchilar: {report.get('total_users', 0)}\n"
     )
-    top = None
+    top = []
     try:
-        top = get_top_referrer()
+        top = await get_referral_leaderboard(limit=3)
     except Exception:
         pass
     if top:
-        text += f"\n🏆 Eng yaxshi referal: {top.get('name')} ({top.get('phone')}) - {top.get('count')} foydalanuvchi"
+        text += "\n🏆 Eng yaxshi referallar:\n"
+        for row in top:
+            text += f"{row['rank']}. {row.get('name')} ({row.get('phone')}) - {row.get('count')} foydalanuvchi\n"
     await bot.send_message(ADMIN_ID, text)
 
 
 async def manage_expired_subscriptions():
+    async def expired_chat_ids():
+        # each chunk is already committed when it arrives; users who blocked the bot are not notified
+        async for chunk in iter_expired_tariffs(reachable_only=True):
+            for tgid in chunk:
+                yield tgid
+
     try:
-        expired = deactivate_expired_tariffs()
-        for u in expired:
-            try:
-                tgid = getattr(u, 'telegram_id', None)
-                if not tgid:
-                    continue
-                await bot.send_message(tgid, "❗ Sizning tarifingiz muddati tugadi. Yangi tarif sotib olish uchun botdan foydalaning.")
-            except Exception:
-                pass
+        stats = await run_broadcast(
+            bot, expired_chat_ids(),
+            text_payload("❗ Sizning tarifingiz muddati tugadi. Yangi tarif sotib olish uchun botdan foydalaning."),
+        )
+        if stats.sent or stats.failed:
+            logger.info("Expiry notices: %s sent, %s failed", stats.sent, stats.failed)
     except Exception as e:
         logger.exception("manage_expired_subscriptions failed: %s", e)
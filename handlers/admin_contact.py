@@ -7,9 +7,10 @@ router = Router()
 
 
 from aiogram.fsm.context import FSMContext
+from text_dispatch import Button
 
 
-@router.message(lambda m: m.text in ["Admin bilan bog'lanish", "Admin bilan bog‘lanish", "📞 Admin bilan bog‘lanish"])
+@router.message(Button("Admin bilan bog'lanish", "Admin bilan bog‘lanish", "📞 Admin bilan bog‘lanish"))
 async def admin_contact(message: types.Message, state: FSMContext | None = None):
     if state is not None:
         try:
@@ -3,10 +3,12 @@ from aiogram import Router
 from aiogram.types import Message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 from config import ADMIN_ID, DOCTOR_ID, STICKER_TARIFF
 from keyboards import get_menu_for
 from loader import bot, answer_with_sticker
-from database import get_user_by_tg, Session
+from db import get_user_by_tg, create_question
 
 router = Router()
 
@@ -16,9 +18,9 @@ class QuestionFSM(StatesGroup):
 
 
 # --- Savol yozish tugmasi: sets FSM state ---
-@router.message(lambda m: m.text in ["📑 Savol yozish", "Savol yozish"])
-async def start_ask_question(message: Message, state: FSMContext):
-    user = get_user_by_tg(message.from_user.id)
+@router.message(Button("📑 Savol yozish", "Savol yozish"))
+async def start_ask_question(message: Message, state: FSMContext, session: AsyncSession = None):
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if not user:
         await answer_with_sticker(
             message,
@@ -33,9 +35,8 @@ async def start_ask_question(message: Message, state: FSMContext):
 
 # --- Process question only when FSM state is active ---
 @router.message(QuestionFSM.waiting_for_text)
-async def process_question(message: Message, state: FSMContext):
-    session = Session()
-    user = get_user_by_tg(message.from_user.id)
+async def process_question(message: Message, state: FSMContext, session: AsyncSession = None):
+    user = await get_user_by_tg(message.from_user.id, session=session)
 
     if not user:
         await answer_with_sticker(
@@ -44,29 +45,18 @@ async def process_question(message: Message, state: FSMContext):
             sticker_file_id=STICKER_TARIFF
         )
         await state.clear()
-        session.close()
         return
 
-    # Userni DB session orqali olish
-    user_db = session.query(type(user)).filter_by(id=user.id).first()
-
-    # Quotas and tariffs disabled: allow unlimited questions for users.
-    # Keep DB session for compatibility but do not decrement any counters.
-    try:
-        session.commit()
-    except Exception:
-        try:
-            session.rollback()
-        except Exception:
-            pass
+    # Quotas and tariffs disabled: allow unlimited questions for users,
+    # so no counters are decremented here.
 
     question_text = message.text.strip()
     info = (
         f"📩 Yangi savol!\n\n"
         f"👤 Ismi: {user.full_name}\n"
         f"📞 Telefon raqami: {user.phone or '—'}\n"
-        f"📌 Tarif: {user_db.tariff or 'Bepul (2 ta savol)'}\n"
-        f"🔢 Qolgan kunlik savollar: {user_db.daily_remaining}\n\n"
+        f"📌 Tarif: {user.tariff or 'Bepul (2 ta savol)'}\n"
+        f"🔢 Qolgan kunlik savollar: {user.daily_remaining}\n\n"
         f"❓ Savol: {question_text}"
     )
 
@@ -78,8 +68,7 @@ async def process_question(message: Message, state: FSMContext):
         from aiogram.exceptions import TelegramBadRequest
     # Persist question so replies can reference which question was answered
     try:
-        from database import create_question
-        qid = create_question(user.telegram_id, question_text)
+        qid = await create_question(user.telegram_id, question_text, session=session)
     except Exception:
         qid = None
 
@@ -131,4 +120,3 @@ async def process_question(message: Message, state: FSMContext):
         )
 
     await state.clear()
-    session.close()
@@ -1,5 +1,6 @@
 from aiogram import Router
 from aiogram.types import Message
+from text_dispatch import Button
 from keyboards import main_menu_keyboard
 from loader import answer_with_sticker
 from config import STICKER_WELCOME
@@ -7,7 +8,7 @@ from config import STICKER_WELCOME
 router = Router()
 
 # Doctor haqida ma'lumot
-@router.message(lambda m: m.text == "Doctor Mirsaid haqida")
+@router.message(Button("Doctor Mirsaid haqida"))
 async def doctor_info(message: Message):
     text = (
         "👨‍⚕ **Doctor MIRSAID haqida**\n\n"
@@ -1,12 +1,13 @@
 from aiogram import Router
 from aiogram.types import Message
+from text_dispatch import Button
 from keyboards import main_menu_keyboard
 from loader import answer_with_sticker
 from config import STICKER_WELCOME
 
 router = Router()
 
-@router.message(lambda m: m.text == "Bot haqida ma'lumot")
+@router.message(Button("Bot haqida ma'lumot"))
 async def bot_info(message: Message):
     text = (
         "ℹ️ *Bot haqida ma'lumot*\n\n"
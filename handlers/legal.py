@@ -2,6 +2,8 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 from keyboards.inline.legal import legal_accept_kb, legal_menu_kb
 from loader import answer_with_sticker
 from config import STICKER_WELCOME
@@ -12,7 +14,7 @@ class LegalForm(StatesGroup):
     awaiting_acceptance = State()
 
 # Privacy Policy handler
-@router.message(F.text == "Maxfiylik siyosati")
+@router.message(Button("Maxfiylik siyosati"))
 async def privacy_policy(message: Message):
     text = (
         "📜 *Maxfiylik siyosati*\n\n"
@@ -28,7 +30,7 @@ async def privacy_policy(message: Message):
     )
 
 # Medical Disclaimer handler
-@router.message(F.text == "Tibbiy maslahatlar ogohlantirishi")
+@router.message(Button("Tibbiy maslahatlar ogohlantirishi"))
 async def medical_disclaimer(message: Message):
     text = (
         "⚠️ *Tibbiy maslahatlar ogohlantirishi*\n\n"
@@ -44,7 +46,7 @@ async def medical_disclaimer(message: Message):
     )
 
 # Enforce acceptance during registration
-@router.message(F.text == "Ro'yxatdan o'tish")
+@router.message(Button("Ro'yxatdan o'tish"))
 async def start_registration(message: Message, state: FSMContext):
     await state.set_state(LegalForm.awaiting_acceptance)
     text = (
@@ -64,7 +66,7 @@ async def start_registration(message: Message, state: FSMContext):
     )
 
 @router.callback_query(F.data == "accept_legal")
-async def accept_legal(callback: CallbackQuery, state: FSMContext):
+async def accept_legal(callback: CallbackQuery, state: FSMContext, session: AsyncSession = None):
     await state.clear()
     # Acknowledge callback to remove loading indicator
     try:
@@ -79,4 +81,4 @@ async def accept_legal(callback: CallbackQuery, state: FSMContext):
     )
     # Redirect to registration flow
     from handlers.register import start_register
-    await start_register(callback.message, state)
+    await start_register(callback.message, state, session=session)
@@ -1,13 +1,14 @@
 # file: handlers/main_menu.py
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from text_dispatch import Button
 from loader import answer_with_sticker
 from keyboards import get_menu_for
 from config import STICKER_WELCOME
 
 router = Router()
 
-@router.message(F.text == "ℹ️ Bot haqida ma'lumot")
+@router.message(Button("ℹ️ Bot haqida ma'lumot"))
 async def bot_info(message: Message):
     text = (
         "ℹ️ Bot haqida:\n\n"
@@ -16,7 +17,7 @@ async def bot_info(message: Message):
     )
     await answer_with_sticker(message, text, sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "👨‍⚕️ Doctor Mirsaid haqida")
+@router.message(Button("👨‍⚕️ Doctor Mirsaid haqida"))
 async def doctor_info(message: Message):
     text = (
         "👨‍⚕️ Doctor Mirsaid haqida:\n\n"
@@ -25,7 +26,7 @@ async def doctor_info(message: Message):
     )
     await answer_with_sticker(message, text, sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "📌 Tariflar haqida")
+@router.message(Button("📌 Tariflar haqida"))
 async def tariffs_info(message: Message):
     # Full tariff descriptions (as requested)
     text = (
@@ -61,7 +62,7 @@ async def tariffs_info(message: Message):
 
     await answer_with_sticker(message, text, sticker_file_id=STICKER_WELCOME, reply_markup=tariffs_kb)
 
-@router.message(F.text == "🏷 Tarif sotib olish")
+@router.message(Button("🏷 Tarif sotib olish"))
 async def buy_tariff_entry(message: Message):
     # This handler purposely delegates to purchase flow which listens to the exact text "Tarif sotib olish".
     # The purchase handler will start the FSM. Here we simply redirect user to press the same button,
@@ -69,11 +70,11 @@ async def buy_tariff_entry(message: Message):
     # (which also handles F.text == "Tarif sotib olish") will be triggered. To be safe, send a short hint.
     await answer_with_sticker(message, "Sizni sotib olish sahifasiga yo'naltiryapmiz… Iltimos, kerakli tarifni tanlang.", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "🧾 Mening tarifim")
+@router.message(Button("🧾 Mening tarifim"))
 async def my_tariff(message: Message):
     await answer_with_sticker(message, "📄 Sizning joriy tarifingiz: bu yerda joriy tarif va qolgan savollar ko'rsatiladi. (Agar ro'yxatdan o'tmagan bo'lsangiz, /start bilan ro'yxatdan o'ting.)", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "➕ Botga odam qo‘shish")
+@router.message(Button("➕ Botga odam qo‘shish"))
 async def add_user(message: Message):
     # Provide referral link
     me = await message.bot.get_me()
@@ -85,27 +86,27 @@ async def add_user(message: Message):
         ref_link = f"https://t.me/{user_id}"
     await answer_with_sticker(message, f"📢 Sizning referal havolangiz:\n{ref_link}\nHar bir ro'yxatdan o'tgan do'stingiz uchun 1000 so'm bonus olasiz.", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "🌐 Mirsaid BAKUMOVning ijtimoiy tarmoqlari")
+@router.message(Button("🌐 Mirsaid BAKUMOVning ijtimoiy tarmoqlari"))
 async def socials(message: Message):
     await answer_with_sticker(message, "🌐 Ijtimoiy tarmoqlar:\nTelegram kanal: https://t.me/MirsaidKanal\nTelegram guruh: https://t.me/MirsaidGuruh\nInstagram: https://instagram.com/mirsaid_bakumov\nYouTube: https://youtube.com/@mirsaidbakumov", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
 # 'Foydali ma'lumotlar' menu removed per request
 
-@router.message(lambda m: m.text in ["📞 Admin bilan bog‘lanish", "Admin bilan bog'lanish", "Admin bilan bog‘lanish"])
+@router.message(Button("📞 Admin bilan bog‘lanish", "Admin bilan bog'lanish", "Admin bilan bog‘lanish"))
 async def contact_admin(message: Message):
     # Delegate to the central admin_contact handler to keep behavior consistent
     from handlers import admin_contact as admin_mod
     await admin_mod.admin_contact(message)
 
-@router.message(F.text == "📑 Savol yozish")
+@router.message(Button("📑 Savol yozish"))
 async def ask_question(message: Message):
     await answer_with_sticker(message, "✍️ Savol yozish: Iltimos, savolingizni yozib yuboring. Doctor Mirsaid yoki admin tez orada javob beradi.", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
 
-@router.message(F.text == "📜 Maxfiylik siyosati")
+@router.message(Button("📜 Maxfiylik siyosati"))
 async def privacy_policy(message: Message):
     await answer_with_sticker(message, "📜 Maxfiylik siyosati: Foydalanuvchi ma'lumotlari faqat xizmat ko'rsatish uchun saqlanadi va uchinchi tomonlarga berilmaydi.", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id), parse_mode="Markdown")
 
-@router.message(F.text == "⚠️ Tibbiy maslahatlar ogohlantirishi")
+@router.message(Button("⚠️ Tibbiy maslahatlar ogohlantirishi"))
 async def medical_warning(message: Message):
     await answer_with_sticker(message, "⚠️ Tibbiy maslahatlar ogohlantirishi: Bot tomonidan berilgan ma'lumotlar umumiy maslahat sifatida taqdim etiladi; aniq tashxis va davolash uchun shifokorga murojaat qiling.", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id), parse_mode="Markdown")
 # (Clean end of file - duplicate/garbled blocks removed)
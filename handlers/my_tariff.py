@@ -3,7 +3,7 @@ from aiogram import Router
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from loader import answer_with_sticker, bot
 from config import STICKER_TARIFF, ADMIN_ID
-from database import get_user_by_tg, get_user_bonus, get_referral_counts
+from db import get_user_by_tg, get_user_bonus, get_referral_counts
 import random
 
 router = Router()
@@ -21,22 +21,24 @@ bonus_keyboard = ReplyKeyboardMarkup(
 
 
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 
 
-@router.message(lambda m: m.text in ["🧾 Mening tarifim", "Mening tarifim"])
-async def my_tariff(message: Message, state: FSMContext):
+@router.message(Button("🧾 Mening tarifim", "Mening tarifim"))
+async def my_tariff(message: Message, state: FSMContext, session: AsyncSession = None):
     # ensure any previous FSM state is cleared so this command is processed cleanly
     try:
         await state.clear()
     except Exception:
         pass
-    user = get_user_by_tg(message.from_user.id)
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if not user:
         await answer_with_sticker(message, "❗ Iltimos, avval ro'yxatdan o'ting.", sticker_file_id=STICKER_TARIFF)
         return
 
-    bonus = int(get_user_bonus(user.id) or 0)
-    refs = get_referral_counts(user.id)
+    bonus = int(await get_user_bonus(user.id, session=session) or 0)
+    refs = await get_referral_counts(user.id, session=session)
 
     text = (
         f"📄 *Sizning tarifingiz:*\n"
@@ -65,7 +67,7 @@ async def my_tariff(message: Message, state: FSMContext):
 from keyboards import main_menu_keyboard
 
 
-@router.message(lambda m: m.text in ["Tarif sotib olish uchun ishlatish", "Tarif sotib olish uchun ishlatish"])
+@router.message(Button("Tarif sotib olish uchun ishlatish"))
 async def use_for_tariff(message: Message, state: FSMContext):
     try:
         await state.clear()
@@ -76,18 +78,18 @@ async def use_for_tariff(message: Message, state: FSMContext):
     await purchase.start_purchase(message, state)
 
 
-@router.message(lambda m: m.text == "Klinika xizmatlari uchun ishlatish")
-async def use_for_clinic(message: Message, state: FSMContext):
+@router.message(Button("Klinika xizmatlari uchun ishlatish"))
+async def use_for_clinic(message: Message, state: FSMContext, session: AsyncSession = None):
     try:
         await state.clear()
     except Exception:
         pass
-    user = get_user_by_tg(message.from_user.id)
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if not user:
         await answer_with_sticker(message, "❗ Iltimos, avval ro'yxatdan o'ting.", sticker_file_id=STICKER_TARIFF)
         return
 
-    bonus = int(get_user_bonus(user.id) or 0)
+    bonus = int(await get_user_bonus(user.id, session=session) or 0)
     if bonus <= 0:
         await answer_with_sticker(message, "⚠ Sizda bonus mablag‘ mavjud emas.", sticker_file_id=STICKER_TARIFF)
         return
@@ -12,24 +12,24 @@ Flow:
     save provider IDs, activate the user's tariff and notify the user in Uzbek.
 
 Notes:
-- Uses existing synchronous DB helpers in database.py:
+- Uses the awaitable DB helpers in db.py:
     create_pending_payment, get_pending_payment, update_pending_payment, activate_tariff
-  This keeps storage consistent with the rest of the project (SQLite).
+  This keeps storage consistent with the rest of the project (SQLite) without blocking the event loop.
 - All user-facing messages go through loader.answer_with_sticker.
 - Ensure STRIPE_PROVIDER_TOKEN and PAYMENT_CURRENCY are set in your .env / config.py.
 """
 
 import os
-import time
 import json
 import aiohttp
 import datetime as dt
 from typing import Optional, List
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, LabeledPrice, PreCheckoutQuery
+from sqlalchemy.ext.asyncio import AsyncSession
 from loader import answer_with_sticker, bot
 from config import STRIPE_PROVIDER_TOKEN, PAYMENT_CURRENCY, STICKER_TARIFF
-from database import get_pending_payment, update_pending_payment, create_pending_payment, activate_tariff, get_user_by_tg
+from db import get_pending_payment, update_pending_payment, create_pending_payment, activate_tariff, get_user_by_tg
 
 from keyboards.inline.purchase import pay_link_kb
 from utils.payment import human_name, duration_days
@@ -263,7 +263,7 @@ async def _verify_payment_by_link(link: str) -> str:
 
 # ----- Callback: generate payment link and send to user -----
 @router.callback_query(F.data.startswith("start_pay:"))
-async def callback_start_pay(call: CallbackQuery):
+async def callback_start_pay(call: CallbackQuery, session: AsyncSession = None):
     """
     When user clicks "To'lov qilamiz" (start_pay:<purchase_id>), generate a provider link
     and send it to the user. Save link into PendingPayment.receipt_file_id.
@@ -275,7 +275,7 @@ async def callback_start_pay(call: CallbackQuery):
         await call.answer("Noto'g'ri so'rov.", show_alert=True)
         return
 
-    payment = get_pending_payment(pid)
+    payment = await get_pending_payment(pid, session=session)
     if not payment:
         await call.answer("To'lov topilmadi.", show_alert=True)
         return
@@ -296,7 +296,7 @@ async def callback_start_pay(call: CallbackQuery):
 
     # Save link in DB (receipt_file_id)
     try:
-        update_pending_payment(pid, {"receipt_file_id": str(link), "status": "awaiting_payment"})
+        await update_pending_payment(pid, {"receipt_file_id": str(link), "status": "awaiting_payment"}, session=session)
     except Exception:
         # non-fatal
         pass
@@ -317,7 +317,7 @@ async def callback_start_pay(call: CallbackQuery):
 
 # ----- Callback: check payment status via provider -----
 @router.callback_query(F.data.startswith("check_pay:"))
-async def callback_check_pay(call: CallbackQuery):
+async def callback_check_pay(call: CallbackQuery, session: AsyncSession = None):
     """
     When user clicks "To'lovni tekshirish" -> attempt verification via provider APIs.
     If paid -> mark DB approved and notify user.
@@ -329,7 +329,7 @@ async def callback_check_pay(call: CallbackQuery):
         await call.answer("Noto'g'ri so'rov.", show_alert=True)
         return
 
-    payment = get_pending_payment(pid)
+    payment = await get_pending_payment(pid, session=session)
     if not payment:
         await call.answer("To'lov topilmadi.", show_alert=True)
         return
@@ -345,7 +345,7 @@ async def callback_check_pay(call: CallbackQuery):
     if status == "paid":
         # mark approved
         try:
-            update_pending_payment(pid, {"status": "approved", "approved_at": time.time()})
+            await update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()}, session=session)
         except Exception:
             pass
         # Notify user
@@ -383,7 +383,7 @@ async def callback_check_pay(call: CallbackQuery):
 
 # ----- Callback: manual confirm (paid_now:<pid>) -----
 @router.callback_query(F.data.startswith("paid_now:"))
-async def callback_paid_now_with_id(call: CallbackQuery):
+async def callback_paid_now_with_id(call: CallbackQuery, session: AsyncSession = None):
     """
     Manual confirmation: mark purchase as approved.
     This is intended for admins or trusted manual flows.
@@ -395,13 +395,13 @@ async def callback_paid_now_with_id(call: CallbackQuery):
         await call.answer("Noto'g'ri so'rov.", show_alert=True)
         return
 
-    payment = get_pending_payment(pid)
+    payment = await get_pending_payment(pid, session=session)
     if not payment:
         await call.answer("To'lov topilmadi.", show_alert=True)
         return
 
     try:
-        update_pending_payment(pid, {"status": "approved", "approved_at": time.time()})
+        await update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()}, session=session)
     except Exception:
         pass
 
@@ -417,7 +417,7 @@ async def callback_paid_now_with_id(call: CallbackQuery):
 
 # ----- Callback: start payment via Telegram invoice -----
 @router.callback_query(F.data.startswith("start_pay:"))
-async def start_pay_callback(call: CallbackQuery):
+async def start_pay_callback(call: CallbackQuery, session: AsyncSession = None):
     """
     Callback triggered when user presses "To'lov qilamiz" (start_pay:{purchase_id}).
     We fetch the purchase record and send an invoice to the user via Telegram Payments.
@@ -431,7 +431,7 @@ async def start_pay_callback(call: CallbackQuery):
         await answer_with_sticker(call.message, "❌ Noto'g'ri so'rov.", sticker_file_id=STICKER_TARIFF)
         return
 
-    payment = get_pending_payment(pid)
+    payment = await get_pending_payment(pid, session=session)
     if not payment:
         await answer_with_sticker(call.message, "❌ To'lov topilmadi yoki muddati o'tgan.", sticker_file_id=STICKER_TARIFF)
         return
@@ -440,11 +440,11 @@ async def start_pay_callback(call: CallbackQuery):
     if payable <= 0:
         # Treat as free / fully covered by bonus; mark approved immediately
         try:
-            update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()})
-            user_db = get_user_by_tg(call.from_user.id)
+            await update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()}, session=session)
+            user_db = await get_user_by_tg(call.from_user.id, session=session)
             days = duration_days(payment.get("plan", "month") or "month")
             if user_db:
-                activate_tariff(user_db.id, payment.get("tariff"), days)
+                await activate_tariff(user_db.id, payment.get("tariff"), days, session=session)
             await answer_with_sticker(call.message, "✅ To‘lov muvaffaqiyatli amalga oshirildi!", sticker_file_id=STICKER_TARIFF)
         except Exception:
             await answer_with_sticker(call.message, "❌ To'lovni tasdiqlashda xatolik yuz berdi.", sticker_file_id=STICKER_TARIFF)
@@ -518,7 +518,7 @@ async def handle_pre_checkout(pre_checkout: PreCheckoutQuery):
 
 # Successful payment handler: Telegram sends a message with successful_payment
 @router.message(F.successful_payment)
-async def handle_successful_payment(message: Message):
+async def handle_successful_payment(message: Message, session: AsyncSession = None):
     """
     Called when Telegram forwards the successful_payment message after payment completes.
     We extract the payload (purchase_id), update DB, activate tariff and notify user.
@@ -543,26 +543,26 @@ async def handle_successful_payment(message: Message):
     if pid:
         # Update pending payment record
         try:
-            update_pending_payment(pid, {
+            await update_pending_payment(pid, {
                 "status": "approved",
                 "approved_at": dt.datetime.utcnow(),
                 "receipt_file_id": provider_payment_charge_id or telegram_payment_charge_id
-            })
+            }, session=session)
         except Exception:
             # non-fatal
             pass
 
         # Activate tariff for the user
         try:
-            pay = get_pending_payment(pid)
+            pay = await get_pending_payment(pid, session=session)
             if pay:
                 tariff = pay.get("tariff")
                 plan = pay.get("plan")
                 days = duration_days(plan) or 30
                 # Find DB user by telegram id
-                user_db = get_user_by_tg(user_tg)
+                user_db = await get_user_by_tg(user_tg, session=session)
                 if user_db:
-                    activate_tariff(user_db.id, tariff, days)
+                    await activate_tariff(user_db.id, tariff, days, session=session)
         except Exception:
             pass
 
@@ -577,7 +577,7 @@ async def handle_successful_payment(message: Message):
 
 # Optional: fallback callback "paid_now:{pid}" used when provider links were used
 @router.callback_query(F.data.startswith("paid_now:"))
-async def paid_now_callback(call: CallbackQuery):
+async def paid_now_callback(call: CallbackQuery, session: AsyncSession = None):
     """
     Manual confirmation button when user uses external link and then presses "Men to'lov qildim".
     Admin still needs to verify via receipt/last4 flow, but we update pending status to awaiting_review.
@@ -591,7 +591,7 @@ async def paid_now_callback(call: CallbackQuery):
         return
 
     try:
-        update_pending_payment(pid, {"status": "awaiting_review"})
+        await update_pending_payment(pid, {"status": "awaiting_review"}, session=session)
     except Exception:
         pass
 
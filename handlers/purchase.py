@@ -1,11 +1,14 @@
 # handlers/purchase.py
 import datetime as dt
+from typing import Any, Dict, Optional, Tuple
 from aiogram import Router, F, types
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from database import (
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
+from db import (
     create_pending_payment,
     update_pending_payment,
     get_latest_pending_by_user,
@@ -13,6 +16,7 @@ from database import (
     get_user_by_tg,
     get_pending_payment,
     set_user_bonus,
+    transaction,
 )
 from config import ADMIN_ID
 from keyboards import get_menu_for
@@ -110,7 +114,7 @@ post_payment_kb = ReplyKeyboardMarkup(
 
 
 # --- Start purchase ---
-@router.message(lambda m: m.text in ["🏷 Tarif sotib olish", "Tarif sotib olish"])
+@router.message(Button("🏷 Tarif sotib olish", "Tarif sotib olish"))
 async def start_purchase(msg: types.Message, state: FSMContext, tariff_name: str = None):
     # If tariff_name is provided, preselect and advance to plan selection
     if tariff_name:
@@ -188,7 +192,7 @@ async def choose_tariff(msg: types.Message, state: FSMContext):
     c.data.startswith("homiladorlik_") or c.data.startswith("farzand_") or
     c.data.startswith("1 haftalik obuna_") or c.data.startswith("1 oylik obuna_")
 ))
-async def plan_callback(callback: types.CallbackQuery, state: FSMContext):
+async def plan_callback(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession = None):
     """Handle inline plan selection callbacks (e.g. 'pro_1week').
 
     Creates a pending payment, stores it in FSM data and advances to confirm state.
@@ -238,7 +242,7 @@ async def plan_callback(callback: types.CallbackQuery, state: FSMContext):
         "base_price": price,
         "payable": price,
     }
-    pid = create_pending_payment(payload)
+    pid = await create_pending_payment(payload, session=session)
     await state.update_data(payment_id=pid, tariff=tariff, plan=plan)
 
     await state.set_state(PurchaseFSM.confirm_payment)
@@ -255,7 +259,7 @@ async def plan_callback(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.message(PurchaseFSM.choose_plan)
-async def choose_plan(msg: types.Message, state: FSMContext):
+async def choose_plan(msg: types.Message, state: FSMContext, session: AsyncSession = None):
     """Backward-compatible function: accept textual plan selection from reply keyboard.
 
     This allows older handlers (e.g. `handlers.tariffs.plan_selected`) to delegate to
@@ -381,7 +385,7 @@ async def choose_plan(msg: types.Message, state: FSMContext):
         "base_price": price,
         "payable": price,
     }
-    pid = create_pending_payment(payload)
+    pid = await create_pending_payment(payload, session=session)
     await state.update_data(payment_id=pid, tariff=tariff, plan=plan)
 
     await state.set_state(PurchaseFSM.confirm_payment)
@@ -394,7 +398,7 @@ async def choose_plan(msg: types.Message, state: FSMContext):
 
 # --- Confirm payment ---
 @router.message(PurchaseFSM.confirm_payment)
-async def confirm_payment(msg: types.Message, state: FSMContext):
+async def confirm_payment(msg: types.Message, state: FSMContext, session: AsyncSession = None):
     """Handle user's choice after a plan is selected: either use bonus or pay normally.
 
     Use fuzzy matching to accept minor text variants and ensure we don't override
@@ -409,12 +413,12 @@ async def confirm_payment(msg: types.Message, state: FSMContext):
 
     # Detect bonus intent (accept variants)
     if "bonus" in norm and ("foyd" in norm or "mablag" in norm or "foydalan" in norm):
-        pp = get_latest_pending_by_user(msg.from_user.id)
+        pp = await get_latest_pending_by_user(msg.from_user.id, session=session)
         if not pp:
             await msg.answer("Xatolik yuz berdi.")
             return
         # use actual bonus balance from DB
-        user_db = get_user_by_tg(msg.from_user.id)
+        user_db = await get_user_by_tg(msg.from_user.id, session=session)
         bonus_available = int(getattr(user_db, "bonus_balance", 0) or 0)
         if bonus_available <= 0:
             await msg.answer("⚠ Sizda bonus mablag‘ mavjud emas.")
@@ -441,7 +445,7 @@ async def confirm_payment(msg: types.Message, state: FSMContext):
 
     # Detect pay intent (accept variants like 'sotib', 'sotib olish')
     if "sotib" in norm or "to'lov" in norm or "tolov" in norm:
-        pp = get_latest_pending_by_user(msg.from_user.id)
+        pp = await get_latest_pending_by_user(msg.from_user.id, session=session)
         if not pp:
             await msg.answer("Xatolik yuz berdi.")
             return
@@ -461,7 +465,7 @@ async def confirm_payment(msg: types.Message, state: FSMContext):
 
 
 @router.message(PurchaseFSM.confirm_bonus)
-async def handle_confirm_bonus(msg: types.Message, state: FSMContext):
+async def handle_confirm_bonus(msg: types.Message, state: FSMContext, session: AsyncSession = None):
     """Handle user's confirmation to use bonus balance for the pending payment."""
     text = (msg.text or "").strip().lower()
     # normalize common variants
@@ -474,21 +478,40 @@ async def handle_confirm_bonus(msg: types.Message, state: FSMContext):
 
     if norm.startswith("ha"):
         # apply bonus: mark pending payment approved and deduct bonus, then activate tariff immediately
-        pp = get_pending_payment(pid)
+        pp = await get_pending_payment(pid, session=session)
         if not pp:
             await msg.answer("Xatolik: to'lov topilmadi.")
             await state.clear()
             return
-        # Update pending payment with bonus applied and new payable
-        update_pending_payment(pid, {"bonus_applied": int(bonus_to_apply), "payable": int(new_payable)})
+        async with transaction(session) as session:
+            # Update pending payment with bonus applied and new payable
+            await update_pending_payment(pid, {"bonus_applied": int(bonus_to_apply), "payable": int(new_payable)}, session=session)
 
-        user = get_user_by_tg(msg.from_user.id)
-        try:
-            curr = int(getattr(user, "bonus_balance", 0) or 0)
-            if bonus_to_apply and curr >= bonus_to_apply:
-                set_user_bonus(user.id, curr - int(bonus_to_apply))
-        except Exception:
-            pass
+            user = await get_user_by_tg(msg.from_user.id, session=session)
+            try:
+                curr = int(getattr(user, "bonus_balance", 0) or 0)
+                if bonus_to_apply and curr >= bonus_to_apply:
+                    await set_user_bonus(user.id, curr - int(bonus_to_apply), session=session)
+            except Exception:
+                pass
+
+            if int(new_payable) <= 0:
+                # Bonus covered full price: approve and activate tariff
+                await update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow(), "payable": 0}, session=session)
+
+                # determine days from plan then activate tariff
+                plan = (pp.get("plan") or "").lower()
+                if "haftalik" in plan:
+                    days = 7
+                elif "9 oy" in plan or "9 oy" in pp.get("plan", ""):
+                    days = 280
+                else:
+                    days = 30
+
+                try:
+                    await activate_tariff(user.id, pp["tariff"], days, session=session)
+                except Exception:
+                    pass
 
         # If bonus does NOT fully cover the price, ask the user to pay the remaining amount and upload receipt
         if int(new_payable) > 0:
@@ -506,23 +529,6 @@ async def handle_confirm_bonus(msg: types.Message, state: FSMContext):
             await state.set_state(PurchaseFSM.upload_receipt)
             return
 
-        # Bonus covered full price: approve and activate tariff
-        update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow(), "payable": 0})
-
-        # determine days from plan then activate tariff
-        plan = (pp.get("plan") or "").lower()
-        if "haftalik" in plan:
-            days = 7
-        elif "9 oy" in plan or "9 oy" in pp.get("plan", ""):
-            days = 280
-        else:
-            days = 30
-
-        try:
-            activate_tariff(user.id, pp["tariff"], days)
-        except Exception:
-            pass
-
         await msg.answer("🎉 Bonus ishlatildi va tarif faollashtirildi!", reply_markup=get_menu_for(msg.from_user.id))
         await state.clear()
         return
@@ -530,7 +536,7 @@ async def handle_confirm_bonus(msg: types.Message, state: FSMContext):
     # user declined
     if norm.startswith("yo") or norm.startswith("n"):
         try:
-            update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()})
+            await update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()}, session=session)
         except Exception:
             pass
         await msg.answer("❌ To'lov bekor qilindi.", reply_markup=get_menu_for(msg.from_user.id))
@@ -542,13 +548,13 @@ async def handle_confirm_bonus(msg: types.Message, state: FSMContext):
 
 
 # Global 'Orqaga' handler — always available to let users back out to main menu
-@router.message(lambda m: m.text == "Orqaga")
+@router.message(Button("Orqaga"))
 async def global_go_back(msg: types.Message, state: FSMContext):
     await state.clear()
     await msg.answer("Bosh menyuga qaytildi.", reply_markup=get_menu_for(msg.from_user.id))
 
 
-@router.message(lambda m: m.text == "Bekor qilish")
+@router.message(Button("Bekor qilish"))
 async def cancel_payment(msg: types.Message, state: FSMContext):
     """Cancel the current payment flow and return to main menu."""
     try:
@@ -560,11 +566,11 @@ async def cancel_payment(msg: types.Message, state: FSMContext):
 
 # --- Upload receipt ---
 @router.message(PurchaseFSM.upload_receipt, F.photo)
-async def upload_receipt(msg: types.Message, state: FSMContext):
+async def upload_receipt(msg: types.Message, state: FSMContext, session: AsyncSession = None):
     data = await state.get_data()
     pid = data.get("payment_id")
     file_id = msg.photo[-1].file_id
-    update_pending_payment(pid, {"receipt_file_id": file_id, "status": "under_review"})
+    await update_pending_payment(pid, {"receipt_file_id": file_id, "status": "under_review"}, session=session)
 
     await state.set_state(PurchaseFSM.enter_last4)
     await msg.answer("✅ Endi kartangizning oxirgi 4 ta raqamini yuboring.")
@@ -572,7 +578,7 @@ async def upload_receipt(msg: types.Message, state: FSMContext):
 
 # --- Enter last4 ---
 @router.message(PurchaseFSM.enter_last4)
-async def enter_last4(msg: types.Message, state: FSMContext):
+async def enter_last4(msg: types.Message, state: FSMContext, session: AsyncSession = None):
     data = await state.get_data()
     pid = data.get("payment_id")
     last4 = msg.text.strip()
@@ -582,10 +588,10 @@ async def enter_last4(msg: types.Message, state: FSMContext):
         await msg.answer("Iltimos, kartaning oxirgi 4 ta raqamini faqat raqam sifatida yuboring (masalan: 1234).")
         return
 
-    update_pending_payment(pid, {"payer_last4": last4})
+    await update_pending_payment(pid, {"payer_last4": last4}, session=session)
 
-    user = get_user_by_tg(msg.from_user.id)
-    pp = get_latest_pending_by_user(msg.from_user.id)
+    user = await get_user_by_tg(msg.from_user.id, session=session)
+    pp = await get_latest_pending_by_user(msg.from_user.id, session=session)
 
     txt = (
         f"💳 Yangi to‘lov\n\n"
@@ -627,14 +633,14 @@ async def enter_last4(msg: types.Message, state: FSMContext):
 
 
 # If user clicks the 'To'lov qildim' button outside photo flow, prompt them to upload receipt
-@router.message(lambda m: m.text == "To'lov qildim")
+@router.message(Button("To'lov qildim"))
 async def i_paid(msg: types.Message, state: FSMContext):
     await answer_with_sticker(msg, "Iltimos, chek yoki to‘lov screenshotini shu chatga yuboring.", sticker_file_id=STICKER_TARIFF)
     await state.set_state(PurchaseFSM.upload_receipt)
 
 
 # If user wants to return to tariffs list
-@router.message(lambda m: m.text == "Tariflar bo'limiga qaytish")
+@router.message(Button("Tariflar bo'limiga qaytish"))
 async def back_to_tariffs(msg: types.Message, state: FSMContext):
     await state.clear()
     from handlers.tariffs import buy_tariff
@@ -642,53 +648,61 @@ async def back_to_tariffs(msg: types.Message, state: FSMContext):
 
 
 # --- Admin confirm/decline ---
-@router.message(F.text.startswith("Tasdiqlash:"))
-async def approve_payment(msg: types.Message):
-    pid = int(msg.text.split(":")[1])
-    # mark approved
-    update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()})
+async def _approve(pid: int, session: Optional[AsyncSession]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Approve payment `pid` and activate its tariff in one transaction; returns (payment, error text)."""
+    async with transaction(session) as session:
+        # mark approved
+        await update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()}, session=session)
 
-    pp = get_pending_payment(pid)
-    if not pp:
-        await msg.answer("Xatolik: to'lov topilmadi.")
-        return
+        pp = await get_pending_payment(pid, session=session)
+        if not pp:
+            return None, "Xatolik: to'lov topilmadi."
 
-    user = get_user_by_tg(pp["user_tg"])
-    if not user:
-        await msg.answer("Xatolik: foydalanuvchi topilmadi.")
-        return
+        user = await get_user_by_tg(pp["user_tg"], session=session)
+        if not user:
+            return pp, "Xatolik: foydalanuvchi topilmadi."
 
-    # determine days
-    plan = (pp.get("plan") or "").lower()
-    if "haftalik" in plan:
-        days = 7
-    elif "9 oy" in plan or "9 oy" in pp.get("plan", ""):
-        days = 280
-    else:
-        days = 30
+        # determine days
+        plan = (pp.get("plan") or "").lower()
+        if "haftalik" in plan:
+            days = 7
+        elif "9 oy" in plan or "9 oy" in pp.get("plan", ""):
+            days = 280
+        else:
+            days = 30
 
-    activate_tariff(user.id, pp["tariff"], days)
+        await activate_tariff(user.id, pp["tariff"], days, session=session)
+
+        # deduct bonus used
+        try:
+            bonus_used = int(pp.get("bonus_applied") or 0)
+            if bonus_used and getattr(user, "bonus_balance", 0) >= bonus_used:
+                await set_user_bonus(user.id, int(getattr(user, "bonus_balance", 0)) - bonus_used, session=session)
+        except Exception:
+            pass
+    return pp, None
 
-    # deduct bonus used
-    try:
-        bonus_used = int(pp.get("bonus_applied") or 0)
-        if bonus_used and getattr(user, "bonus_balance", 0) >= bonus_used:
-            set_user_bonus(user.id, int(getattr(user, "bonus_balance", 0)) - bonus_used)
-    except Exception:
-        pass
 
+@router.message(F.text.startswith("Tasdiqlash:"))
+async def approve_payment(msg: types.Message, session: AsyncSession = None):
+    pid = int(msg.text.split(":")[1])
+    # replies go out after the transaction: the writer connection is not held over Bot API calls
+    _, error = await _approve(pid, session)
+    if error:
+        await msg.answer(error)
+        return
     await msg.answer("✅ To‘lov tasdiqlandi va tarif faollashtirildi.")
 
 
 @router.message(F.text.startswith("Bekor qilish:"))
-async def decline_payment(msg: types.Message):
+async def decline_payment(msg: types.Message, session: AsyncSession = None):
     pid = int(msg.text.split(":")[1])
-    update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()})
+    await update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()}, session=session)
     await msg.answer("❌ To‘lov bekor qilindi. Iltimos, sababini bilish uchun adminga murojat qiling.")
 
 
 @router.callback_query(lambda c: c.data and (c.data.startswith("approve_") or c.data.startswith("approve:")))
-async def cb_approve(call: types.CallbackQuery):
+async def cb_approve(call: types.CallbackQuery, session: AsyncSession = None):
     # only admin/doctor can approve
     uid = call.from_user.id
     from config import ADMIN_ID, DOCTOR_ID
@@ -715,33 +729,9 @@ async def cb_approve(call: types.CallbackQuery):
         pid = int(raw.split("_")[1])
     except Exception:
         return await call.answer("Xatolik: noto'g'ri to'lov ID.", show_alert=True)
-    update_pending_payment(pid, {"status": "approved", "approved_at": dt.datetime.utcnow()})
-    pp = get_pending_payment(pid)
-    if not pp:
-        return await call.answer("Xatolik: to'lov topilmadi.", show_alert=True)
-
-    user = get_user_by_tg(pp["user_tg"])
-    if not user:
-        return await call.answer("Xatolik: foydalanuvchi topilmadi.", show_alert=True)
-
-    # determine days
-    plan = (pp.get("plan") or "").lower()
-    if "haftalik" in plan:
-        days = 7
-    elif "9 oy" in plan or "9 oy" in pp.get("plan", ""):
-        days = 280
-    else:
-        days = 30
-
-    activate_tariff(user.id, pp["tariff"], days)
-
-    # deduct bonus if any
-    try:
-        bonus_used = int(pp.get("bonus_applied") or 0)
-        if bonus_used and getattr(user, "bonus_balance", 0) >= bonus_used:
-            set_user_bonus(user.id, int(getattr(user, "bonus_balance", 0)) - bonus_used)
-    except Exception:
-        pass
+    pp, error = await _approve(pid, session)
+    if error:
+        return await call.answer(error, show_alert=True)
 
     # notify admin in chat (if possible)
     try:
@@ -765,7 +755,7 @@ async def cb_approve(call: types.CallbackQuery):
 
 
 @router.callback_query(lambda c: c.data and (c.data.startswith("decline_") or c.data.startswith("decline:")))
-async def cb_decline(call: types.CallbackQuery):
+async def cb_decline(call: types.CallbackQuery, session: AsyncSession = None):
     uid = call.from_user.id
     from config import ADMIN_ID, DOCTOR_ID
     if uid not in (ADMIN_ID, DOCTOR_ID):
@@ -794,16 +784,16 @@ async def cb_decline(call: types.CallbackQuery):
         except Exception:
             pass
         return
-    update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()})
+    await update_pending_payment(pid, {"status": "declined", "declined_at": dt.datetime.utcnow()}, session=session)
     # prepare a clearer admin notification with payment details
     try:
-        pp = get_pending_payment(pid)
+        pp = await get_pending_payment(pid, session=session)
         user_tg = None
         user_full = "Noma'lum foydalanuvchi"
         if pp:
             user_tg = pp.get("user_tg")
             try:
-                user_obj = get_user_by_tg(user_tg) if user_tg else None
+                user_obj = await get_user_by_tg(user_tg, session=session) if user_tg else None
                 user_full = getattr(user_obj, "full_name", str(user_tg) if user_tg else user_full)
             except Exception:
                 pass
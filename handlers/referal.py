@@ -1,11 +1,12 @@
-from aiogram import Router, F
+from aiogram import Router
+from text_dispatch import Button
 from loader import bot, answer_with_sticker
 from keyboards import get_menu_for
 from config import STICKER_TARIFF
 
 router = Router()
 
-@router.message(lambda m: m.text in ["➕ Botga odam qo‘shish", "Botga odam qo‘shish"])
+@router.message(Button("➕ Botga odam qo‘shish", "Botga odam qo‘shish"))
 async def invite_friend(message):
     user_id = message.from_user.id
     try:
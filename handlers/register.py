@@ -1,12 +1,14 @@
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from database import Session, User, get_user_by_tg, get_user_by_phone
+from db import create_user, get_user_by_tg, get_user_by_phone, update_user_profile
 from keyboards import start_keyboard, get_menu_for
 from loader import answer_with_sticker, bot
 from config import STICKER_WELCOME, ADMIN_ID
 from aiogram.filters.command import Command
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 import hashlib
 
 router = Router()
@@ -26,8 +28,8 @@ def hash_device_id(device_id: str) -> str:
 
 # /start handler
 @router.message(Command("start"))
-async def start_command(message: Message):
-    user = get_user_by_tg(message.from_user.id)
+async def start_command(message: Message, session: AsyncSession = None):
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if user:
         await answer_with_sticker(message, "Siz allaqal ro'yxatdan o'tgansiz!", sticker_file_id=STICKER_WELCOME, reply_markup=get_menu_for(message.from_user.id))
     else:
@@ -39,9 +41,9 @@ async def start_command(message: Message):
 
 
 # Ro'yxatdan o'tishni boshlash tugmasi
-@router.message(F.text == "Ro'yxatdan o'tish")
-async def start_register(message: Message, state: FSMContext):
-    user = get_user_by_tg(message.from_user.id)
+@router.message(Button("Ro'yxatdan o'tish"))
+async def start_register(message: Message, state: FSMContext, session: AsyncSession = None):
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if user:
         await answer_with_sticker(
             message,
@@ -74,29 +76,25 @@ async def birth_year_handler(message: Message, state: FSMContext):
 
 
 @router.message(RegisterForm.phone)
-async def phone_handler(message: Message, state: FSMContext):
-    session = Session()
-    try:
-        existing_user = get_user_by_phone(message.text)
-        if existing_user:
-            await answer_with_sticker(
-                message,
-                "Siz allaqon ro'yxatdan o'tgansiz. Qo'shimcha bonus olish imkoni mavjud emas.",
-                sticker_file_id=STICKER_WELCOME,
-                reply_markup=get_menu_for(message.from_user.id)
+async def phone_handler(message: Message, state: FSMContext, session: AsyncSession = None):
+    existing_user = await get_user_by_phone(message.text, session=session)
+    if existing_user:
+        await answer_with_sticker(
+            message,
+            "Siz allaqon ro'yxatdan o'tgansiz. Qo'shimcha bonus olish imkoni mavjud emas.",
+            sticker_file_id=STICKER_WELCOME,
+            reply_markup=get_menu_for(message.from_user.id)
+        )
+        # Adminni shubhali faoliyat haqida xabardor qilish
+        if ADMIN_ID:
+            await bot.send_message(
+                ADMIN_ID,
+                f"⚠️ *Shubhali ko'p hisob qaydnomasi urinish:* \n\n"
+                f"👤 Ism: {existing_user.full_name}\n"
+                f"📞 Telefon: {existing_user.phone}\n"
+                f"🆔 Telegram ID: {message.from_user.id}\n"
             )
-            # Adminni shubhali faoliyat haqida xabardor qilish
-            if ADMIN_ID:
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"⚠️ *Shubhali ko'p hisob qaydnomasi urinish:* \n\n"
-                    f"👤 Ism: {existing_user.full_name}\n"
-                    f"📞 Telefon: {existing_user.phone}\n"
-                    f"🆔 Telegram ID: {message.from_user.id}\n"
-                )
-            return
-    finally:
-        session.close()
+        return
 
     await state.update_data(phone=message.text)
     await state.set_state(RegisterForm.address)
@@ -105,24 +103,20 @@ async def phone_handler(message: Message, state: FSMContext):
 
 # Ro'yxatdan o‘tish tugagandan so‘ng
 @router.message(RegisterForm.address)
-async def address_handler(message: Message, state: FSMContext):
+async def address_handler(message: Message, state: FSMContext, session: AsyncSession = None):
     data = await state.get_data()
     await state.clear()
 
-    session = Session()
-    try:
-        new_user = User(
-            telegram_id=message.from_user.id,
-            full_name=data['full_name'],
-            birth_year=data['birth_year'],
-            phone=data['phone'],
-            address=message.text,
-            device_id=hash_device_id(message.from_user.id)  # Qurilma ID sini xesh qilish misoli
+    profile = dict(full_name=data['full_name'], birth_year=data['birth_year'], phone=data['phone'],
+                   address=message.text)
+    # /start has usually created the user already: fill in its profile
+    if not await update_user_profile(message.from_user.id, **profile, session=session):
+        await create_user(
+            tg_id=message.from_user.id,
+            device_id=hash_device_id(str(message.from_user.id)),  # Qurilma ID sini xesh qilish misoli
+            **profile,
+            session=session,
         )
-        session.add(new_user)
-        session.commit()
-    finally:
-        session.close()
 
     await answer_with_sticker(
         message,
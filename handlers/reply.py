@@ -1,6 +1,7 @@
-from aiogram import Router, types, F
+from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
+from text_dispatch import Button
 from keyboards import get_menu_for
 from loader import answer_with_sticker
 from config import STICKER_WELCOME
@@ -8,7 +9,7 @@ from config import STICKER_WELCOME
 router = Router()
 
 # Return to main menu when user presses the reply keyboard "Bosh menuga qaytish"
-@router.message(F.text == "Bosh menuga qaytish")
+@router.message(Button("Bosh menuga qaytish"))
 async def back_to_main(message: types.Message, state: FSMContext):
     # clear any FSM state and show main menu
     try:
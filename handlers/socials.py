@@ -1,16 +1,18 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 from loader import bot, answer_with_sticker
 from config import STICKER_SOCIALS, ADMIN_ID
 from keyboards.inline.social_links import social_links_kb
-from database import get_user_by_tg, get_user_bonus, set_user_bonus
+from db import get_user_by_tg, get_user_bonus, set_user_bonus
 
 router = Router()
 
 BONUS_SOCIALS = 29000
 
 
-@router.message(F.text == "Mirsaid BAKUMOVning ijtimoiy tarmoqlari")
+@router.message(Button("Mirsaid BAKUMOVning ijtimoiy tarmoqlari"))
 async def socials_info(message: Message):
     text = (
         "🌐 Mirsaid BAKUMOVning ijtimoiy tarmoqlari:\n\n"
@@ -25,8 +27,8 @@ async def socials_info(message: Message):
 
 
 @router.callback_query(F.data == "check_socials")
-async def check_socials(callback: CallbackQuery):
-    user = get_user_by_tg(callback.from_user.id)
+async def check_socials(callback: CallbackQuery, session: AsyncSession = None):
+    user = await get_user_by_tg(callback.from_user.id, session=session)
     if not user:
         await answer_with_sticker(callback.message, "❗ Iltimos, avval ro'yxatdan o'ting.", sticker_file_id=STICKER_SOCIALS)
         await callback.answer()
@@ -44,8 +46,8 @@ async def check_socials(callback: CallbackQuery):
 
     if joined_all:
         try:
-            curr = get_user_bonus(user.id)
-            set_user_bonus(user.id, curr + BONUS_SOCIALS)
+            curr = await get_user_bonus(user.id, session=session)
+            await set_user_bonus(user.id, curr + BONUS_SOCIALS, session=session)
         except Exception:
             pass
         await answer_with_sticker(callback.message, f"🎉 Tabriklaymiz! Siz barcha sahifalarga a'zo bo'ldingiz.\n{BONUS_SOCIALS:,} so'm bonus qo'shildi.", sticker_file_id=STICKER_SOCIALS)
@@ -1,16 +1,17 @@
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from loader import answer_with_sticker
 from keyboards import get_menu_for
 from config import STICKER_WELCOME, ADMIN_ID, DOCTOR_ID
 from keyboards.inline.admin_menu import admin_menu_kb
-from database import create_user, get_user_by_tg
+from db import create_user
 
 router = Router()
 
 
 @router.message(F.text.startswith("/start"))
-async def start_handler(message, state: FSMContext):
+async def start_handler(message, state: FSMContext, session: AsyncSession = None):
     args = message.text.split()
     referred_by = None
 
@@ -24,10 +25,11 @@ async def start_handler(message, state: FSMContext):
     except Exception:
         pass
 
-    user = create_user(
+    user = await create_user(
         tg_id=message.from_user.id,
         full_name=message.from_user.full_name,
-        referred_by=referred_by
+        referred_by=referred_by,
+        session=session,
     )
 
     # Inform users that questions are currently unlimited/free
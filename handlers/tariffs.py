@@ -7,15 +7,17 @@ from keyboards.tariffs import (
 )
 from loader import answer_with_sticker
 from config import STICKER_TARIFF
-from database import get_user_by_tg  # check registration
+from db import get_user_by_tg  # check registration
 
 router = Router()
 
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 from handlers.purchase import start_purchase, PurchaseFSM
 
 # 1️⃣ Tariflar haqida umumiy ma'lumot
-@router.message(lambda m: m.text in ["Tariflar haqida", "📌 Tariflar haqida"])
+@router.message(Button("Tariflar haqida", "📌 Tariflar haqida"))
 async def tariffs_info(message: types.Message, state: FSMContext):
     # Tariff section disabled — all users have open access now.
     try:
@@ -26,7 +28,7 @@ async def tariffs_info(message: types.Message, state: FSMContext):
 
 
 # 2️⃣ Tarif sotib olish menyusi
-@router.message(lambda m: m.text in ["🏷 Tarif sotib olish", "Tarif sotib olish"])
+@router.message(Button("🏷 Tarif sotib olish", "Tarif sotib olish"))
 async def buy_tariff(message: types.Message, state: FSMContext):
     """Start the purchase FSM in the purchase handler by delegating with the current FSM context."""
     from handlers.purchase import start_purchase
@@ -39,7 +41,7 @@ async def buy_tariff(message: types.Message, state: FSMContext):
 
 
 # 3️⃣ Tarif turlari bo‘yicha tanlovlar
-@router.message(lambda m: m.text == "💰 Pro")
+@router.message(Button("💰 Pro"))
 async def pro_selected(message: types.Message, state: FSMContext):
     # Start purchase flow and preselect Pro
     await start_purchase(message, state)
@@ -48,7 +50,7 @@ async def pro_selected(message: types.Message, state: FSMContext):
     await answer_with_sticker(message, "Qaysi reja kerak?", sticker_file_id=STICKER_TARIFF, reply_markup=weekly_monthly_keyboard)
 
 
-@router.message(lambda m: m.text == "💎 Premium")
+@router.message(Button("💎 Premium"))
 async def premium_selected(message: types.Message, state: FSMContext):
     await start_purchase(message, state)
     await state.update_data(tariff="premium")
@@ -56,7 +58,7 @@ async def premium_selected(message: types.Message, state: FSMContext):
     await answer_with_sticker(message, "Qaysi reja kerak?", sticker_file_id=STICKER_TARIFF, reply_markup=weekly_monthly_keyboard)
 
 
-@router.message(lambda m: m.text == "👪 Farzand ko‘rishni rejalashtirish")
+@router.message(Button("👪 Farzand ko‘rishni rejalashtirish"))
 async def family_selected(message: types.Message, state: FSMContext):
     await start_purchase(message, state)
     await state.update_data(tariff="farzand ko‘rishni rejalashtirish")
@@ -64,7 +66,7 @@ async def family_selected(message: types.Message, state: FSMContext):
     await answer_with_sticker(message, "Qaysi reja kerak?", sticker_file_id=STICKER_TARIFF, reply_markup=weekly_monthly_keyboard)
 
 
-@router.message(lambda m: m.text == "🤰 Homiladorlik")
+@router.message(Button("🤰 Homiladorlik"))
 async def pregnancy_selected(message: types.Message, state: FSMContext):
     await start_purchase(message, state)
     await state.update_data(tariff="pregnancy")
@@ -73,7 +75,7 @@ async def pregnancy_selected(message: types.Message, state: FSMContext):
 
 
 # 4️⃣ Orqaga qaytish
-@router.message(lambda m: m.text == "Orqaga")
+@router.message(Button("Orqaga"))
 async def go_back(message: types.Message, state: FSMContext):
     # If in purchase FSM -> go back in purchase, otherwise return to main menu
     from handlers.purchase import start_purchase
@@ -92,12 +94,12 @@ async def go_back(message: types.Message, state: FSMContext):
 
 
 # 5️⃣ Yakuniy tanlov
-@router.message(lambda m: m.text in ["1 haftalik", "1 oylik", "Homiladorlik 1 oy", "Homiladorlik 9 oy"])
-async def plan_selected(message: types.Message, state: FSMContext):
+@router.message(Button("1 haftalik", "1 oylik", "Homiladorlik 1 oy", "Homiladorlik 9 oy"))
+async def plan_selected(message: types.Message, state: FSMContext, session: AsyncSession = None):
     # Delegate plan selection to purchase.choose_plan which manages creating pending payment and next steps
     from handlers.purchase import choose_plan
     # Do NOT clear the state here: tariff must remain stored in FSM data.
-    await choose_plan(message, state)
+    await choose_plan(message, state, session=session)
 
 
 # 🔹 Main.py uchun ro‘yxatdan o‘tkazish funksiyasi
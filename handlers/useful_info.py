@@ -1,25 +1,27 @@
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from text_dispatch import Button
 from loader import answer_with_sticker
 from config import STICKER_TARIFF
-from database import get_user_by_tg, get_user_bonus, set_user_bonus, has_claimed_free_useful, mark_claimed_free_useful
+from db import get_user_by_tg, get_user_bonus, set_user_bonus, has_claimed_free_useful, mark_claimed_free_useful
 
 router = Router()
 
 
-@router.message(lambda m: m.text in ["📚 Foydali ma`lumotlar olish", "Foydali ma`lumotlar olish"])
-async def useful_info(message: Message, state: FSMContext | None = None):
+@router.message(Button("📚 Foydali ma`lumotlar olish", "Foydali ma`lumotlar olish"))
+async def useful_info(message: Message, state: FSMContext | None = None, session: AsyncSession = None):
     # clear any running FSM so menu buttons aren't intercepted
     try:
         await state.clear()
     except Exception:
         pass
 
-    user = get_user_by_tg(message.from_user.id)
+    user = await get_user_by_tg(message.from_user.id, session=session)
     has_free = False
     if user is not None:
-        has_free = has_claimed_free_useful(user.id)
+        has_free = await has_claimed_free_useful(user.id, session=session)
 
     text = (
         "ℹ️ *Foydali ma'lumotlar obunasi*\n\n"
@@ -44,26 +46,26 @@ async def useful_info(message: Message, state: FSMContext | None = None):
     )
 
 
-@router.message(lambda m: m.text in ["1 haftalik obunani tekin olish", "1 haftalik obunani tekin olish"])
-async def get_free_week(message: Message):
-    user = get_user_by_tg(message.from_user.id)
+@router.message(Button("1 haftalik obunani tekin olish"))
+async def get_free_week(message: Message, session: AsyncSession = None):
+    user = await get_user_by_tg(message.from_user.id, session=session)
     if not user:
         await answer_with_sticker(message, "❗ Iltimos, avval ro'yxatdan o'ting.", sticker_file_id=STICKER_TARIFF)
         return
-    if has_claimed_free_useful(user.id):
+    if await has_claimed_free_useful(user.id, session=session):
         await answer_with_sticker(message, "❌ Siz allaqachon tekin 1 haftalik obunani olgansiz.", sticker_file_id=STICKER_TARIFF)
         return
 
     # Mark claimed and inform user. Actual subscriber flow (sending tips) is out of scope here.
     try:
-        mark_claimed_free_useful(user.id)
+        await mark_claimed_free_useful(user.id, session=session)
     except Exception:
         pass
 
     await answer_with_sticker(message, "✅ Sizga 1 haftalik 'Foydali ma'lumotlar' obunasi tekin faollashtirildi!\n\nTarifni to'liq faollashtirish uchun 'Tarif sotib olish' tugmasini bosing.", sticker_file_id=STICKER_TARIFF)
 
 
-@router.message(lambda m: m.text in ["1 haftalik obuna", "1 haftalik obuna"])
+@router.message(Button("1 haftalik obuna"))
 async def buy_week(message: Message, state: FSMContext):
     from handlers.purchase import start_purchase
     try:
@@ -73,7 +75,7 @@ async def buy_week(message: Message, state: FSMContext):
     await start_purchase(message, state, tariff_name="1 haftalik obuna")
 
 
-@router.message(lambda m: m.text in ["1 oylik obuna", "1 oylik obuna"])
+@router.message(Button("1 oylik obuna"))
 async def buy_month(message: Message, state: FSMContext):
     from handlers.purchase import start_purchase
     try:
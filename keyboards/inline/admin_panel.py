@@ -6,3 +6,42 @@ def admin_panel_kb():
     kb.button(text="📢 Barchaga xabar yuborish", callback_data="broadcast_all")
     kb.adjust(1)  # Har qatorda 1 ta tugma
     return kb.as_markup()
+
+
+def broadcast_job_kb(job_id: int, status: str):
+    """Pause/resume and cancel buttons for a broadcast job (callback data bjob:<action>:<id>)."""
+    kb = InlineKeyboardBuilder()
+    if status == "running":
+        kb.button(text="⏸ To'xtatib turish", callback_data=f"bjob:pause:{job_id}")
+    elif status == "paused":
+        kb.button(text="▶️ Davom ettirish", callback_data=f"bjob:resume:{job_id}")
+    if status in ("running", "paused"):
+        kb.button(text="✖️ Bekor qilish", callback_data=f"bjob:cancel:{job_id}")
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+def segment_kb(segment, count: int):
+    """Audience picker for a broadcast (callback data seg:<filter>:<value>); ✅ marks active filters."""
+    from segments import SEGMENT_TARIFFS, NO_TARIFF
+
+    def mark(on: bool, text: str) -> str:
+        return f"✅ {text}" if on else text
+
+    joined_days = (segment.as_of - segment.joined_from).days if segment.joined_from else None
+    kb = InlineKeyboardBuilder()
+    for i, (key, label) in enumerate(SEGMENT_TARIFFS):
+        kb.button(text=mark(key in segment.tariffs, label), callback_data=f"seg:t:{i}")
+    kb.button(text=mark(NO_TARIFF in segment.tariffs, "Tarifsiz"), callback_data="seg:t:n")
+    kb.button(text=mark(segment.status == "active", "Faol tarif"), callback_data="seg:s:active")
+    kb.button(text=mark(segment.status == "expired", "Muddati o'tgan"), callback_data="seg:s:expired")
+    kb.button(text=mark(segment.seen_within_days == 7, "7 kunda faol"), callback_data="seg:a:7")
+    kb.button(text=mark(segment.seen_within_days == 30, "30 kunda faol"), callback_data="seg:a:30")
+    kb.button(text=mark(segment.not_seen_days == 30, "30+ kun nofaol"), callback_data="seg:i:30")
+    for days in (7, 30, 90):
+        kb.button(text=mark(joined_days == days, f"Yangi: {days} kun"), callback_data=f"seg:j:{days}")
+    kb.button(text=mark(segment.with_bonus, "Bonusi bor"), callback_data="seg:b:1")
+    kb.button(text="🔄 Tozalash", callback_data="seg:reset:0")
+    kb.button(text=f"✏️ Davom etish ({count})", callback_data="seg:go:0")
+    kb.adjust(3, 2, 2, 3, 3, 1, 2)
+    return kb.as_markup()
@@ -1,12 +1,24 @@
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import BOT_TOKEN, FSM_STORAGE, TELEGRAM_API_URL
+from delivery import setup_delivery
 import asyncio
 
-# Initialize Bot and Dispatcher with MemoryStorage so FSM works
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+# Initialize Bot and Dispatcher; FSM states live in the database unless FSM_STORAGE=memory
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# every API call honours flood control and flags users who blocked the bot
+setup_delivery(bot)
+if FSM_STORAGE == "memory":
+    storage = MemoryStorage()
+else:
+    from fsm_storage import SQLiteStorage
+    storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
 async def set_bot_commands():
@@ -1,35 +1,99 @@
+import signal
 import asyncio
 from aiogram.exceptions import TelegramConflictError
 from loader import dp, bot, set_bot_commands, storage
 from register_all_handlers import register_all_handlers
+from middlewares import setup_middlewares, polling_options
+from broadcast_jobs import setup_broadcast_jobs
 from scheduler import start_scheduler
+from db import init_db
+from db_engine import dispose_engines
+from config import BOT_MODE, BOT_WORKERS, BOT_WORKER_INDEX
+from webhook import run_webhook
+from supervisor import run_supervisor, serve_worker
+
+
+async def shutdown():
+    # Graceful shutdown: close storage and bot session
+    try:
+        await storage.close()
+    except Exception:
+        pass
+    try:
+        await bot.session.close()
+    except Exception:
+        pass
+    # Pooled SQLite connections keep worker threads alive until disposed
+    try:
+        await dispose_engines()
+    except Exception:
+        pass
 
 
 async def main():
+    # Stop cleanly on SIGTERM too (the supervisor stopping a worker, or the host stopping the process)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        pass  # no signal handlers on Windows event loops
+
+    is_worker = BOT_WORKER_INDEX >= 0
+    if not is_worker:
+        # Schema work happens here, once, not at import; workers start after the supervisor did it
+        await init_db()
+    if BOT_WORKERS > 1 and not is_worker:
+        # Supervisor: receives updates and routes them to worker processes by chat id
+        await set_bot_commands()
+        if BOT_MODE != "webhook":
+            try:
+                await bot.delete_webhook(drop_pending_updates=True)
+            except Exception:
+                pass
+        print(f"Bot ishga tushdi ({BOT_WORKERS} ta worker)...")
+        try:
+            await run_supervisor(bot)
+        finally:
+            await shutdown()
+        return
+
+    # The leader (the only process, or worker 0) runs the scheduler and resumes broadcasts
+    leader = BOT_WORKER_INDEX <= 0
+
     # Register routers
     register_all_handlers(dp)
+    setup_middlewares(dp)
+    setup_broadcast_jobs(dp, resume=leader)
 
-    # Set bot commands (best-effort)
-    await set_bot_commands()
+    if not is_worker:
+        # Set bot commands (best-effort)
+        await set_bot_commands()
 
-    # Ensure no webhook is set (delete if present) to avoid TelegramConflictError
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-    except Exception:
-        # ignore failures here; we'll handle conflict below
-        pass
+        if BOT_MODE != "webhook":
+            # Ensure no webhook is set (delete if present) to avoid TelegramConflictError
+            try:
+                await bot.delete_webhook(drop_pending_updates=True)
+            except Exception:
+                # ignore failures here; we'll handle conflict below
+                pass
 
     # Start background scheduler
-    try:
-        asyncio.create_task(start_scheduler(bot))
-    except Exception:
-        pass
+    if leader:
+        try:
+            asyncio.create_task(start_scheduler(bot))
+        except Exception:
+            pass
 
     print("Bot ishga tushdi...")
 
-    # Start long-polling with a small retry if Telegram reports a conflict
+    # Workers serve the supervisor; webhook mode serves until stopped;
+    # otherwise long-poll with a small retry if Telegram reports a conflict
     try:
-        await dp.start_polling(bot)
+        if is_worker:
+            await serve_worker(dp, bot, BOT_WORKER_INDEX)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot, **polling_options(dp))
     except TelegramConflictError as e:
         print("TelegramConflictError: attempting to delete webhook and retry...")
         try:
@@ -37,21 +101,13 @@ async def main():
         except Exception:
             pass
         # one retry
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, **polling_options(dp))
     finally:
-        # Graceful shutdown: close storage and bot session
-        try:
-            await storage.close()
-        except Exception:
-            pass
-        try:
-            await bot.session.close()
-        except Exception:
-            pass
+        await shutdown()
 
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("Interrupted by user, exiting...")
@@ -0,0 +1,22 @@
+from aiogram import Dispatcher
+
+from config import DB_SESSION_PER_UPDATE, UPDATE_MAX_CONCURRENT
+from .activity import ActivityMiddleware, setup_activity
+from .chat_queue import ChatQueueMiddleware, polling_options, setup_chat_queue
+from .metrics import metrics, setup_metrics
+from .unit_of_work import UnitOfWorkMiddleware, setup_unit_of_work
+
+
+def setup_middlewares(dp: Dispatcher) -> None:
+    """Install dispatcher-wide middlewares (call once, next to register_all_handlers)."""
+    # first: everything after it runs when the update's turn comes
+    if UPDATE_MAX_CONCURRENT > 0:
+        setup_chat_queue(dp)
+    setup_metrics(dp)
+    if DB_SESSION_PER_UPDATE:
+        setup_unit_of_work(dp)
+    setup_activity(dp)
+
+
+__all__ = ["setup_middlewares", "polling_options", "ActivityMiddleware", "ChatQueueMiddleware", "UnitOfWorkMiddleware",
+           "metrics"]
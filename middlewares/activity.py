@@ -0,0 +1,59 @@
+"""
+middlewares/activity.py
+
+Counts every incoming update as user activity without touching the database:
+the sender's telegram_id goes into db.record_activity(), and a background task
+writes the buffer out in one executemany every ACTIVITY_FLUSH_SECONDS (and once
+more on shutdown).
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from db import record_activity, flush_activity, run_activity_flusher
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            record_activity(user.id)
+        return await handler(event, data)
+
+
+def setup_activity(dp: Dispatcher) -> None:
+    """Install the middleware and tie the flusher task to the dispatcher's startup/shutdown."""
+    dp.update.outer_middleware(ActivityMiddleware())
+    flusher = {}
+
+    async def _start_flusher():
+        flusher["task"] = asyncio.create_task(run_activity_flusher())
+
+    async def _stop_flusher():
+        task = flusher.pop("task", None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await flush_activity()
+        except Exception:
+            logger.exception("Final last_active flush failed")
+
+    dp.startup.register(_start_flusher)
+    dp.shutdown.register(_stop_flusher)
+
+
+__all__ = ["ActivityMiddleware", "setup_activity"]
@@ -0,0 +1,230 @@
+"""
+middlewares/chat_queue.py
+
+Per-chat ordering with a global cap, instead of one free-running task per
+update. ChatQueueMiddleware (outermost on dp.update, ahead of aiogram's FSM
+middleware, so the chat's state is read when the update runs) puts every
+update into its chat's FIFO queue, keyed as supervisor.py routes updates
+(the chat, else the sender):
+
+- a chat's updates run one at a time, in arrival order, so two quick taps in
+  the purchase flow see each other's FSM data and pending payment;
+- at most UPDATE_MAX_CONCURRENT updates (so chats) run at once; a waiting
+  chat gets the next free slot in turn, one update per turn;
+- at most UPDATE_MAX_PENDING updates are accepted and not finished. Past
+  that, accepting the next one waits: long polling stops fetching
+  (Telegram keeps the updates) and webhook requests are held open.
+
+Polling has to hand updates over without awaiting them for that, so main.py
+starts it with polling_options(dp): aiogram awaits each update in turn
+(handle_as_tasks=False) and this middleware returns as soon as the update
+is queued. Every other caller of dp.feed_update (webhook, worker
+processes, scripts) still gets the handler's result back.
+
+An album arrives as one message per item, and a handler that waited for the
+rest of it in the chat's turn would hold them back behind itself. So
+AlbumMiddleware, just ahead of the queue, collects the messages sharing a
+media_group_id for ALBUM_COLLECT_SECONDS and queues the first one alone, with
+all of them (in message_id order) as the `album` handler argument; the others
+stop there.
+
+Queue depth, running updates, chats queued, the wait before an update
+starts and time spent in backpressure go to the metrics registry.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Set, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+from config import ALBUM_COLLECT_SECONDS, UPDATE_MAX_CONCURRENT, UPDATE_MAX_PENDING
+from .metrics import HandlerMetrics, metrics
+
+logger = logging.getLogger(__name__)
+
+# feed_update keyword (start_polling passes its extra kwargs through): queue the update and return
+DETACH = "detach_update"
+
+Job = Tuple[Callable[[], Awaitable[Any]], "asyncio.Future[Any]", float]
+
+
+def update_chat_key(update: Update) -> int:
+    """Chat an update belongs to (the sender's id for chat-less updates); 0 if none."""
+    try:
+        event = update.event
+    except Exception:  # an update type aiogram does not know
+        return 0
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user is not None else 0
+
+
+class ChatQueue:
+    """Per-chat FIFO queues drained under one cap on updates running at once."""
+
+    def __init__(self, max_concurrent: int = UPDATE_MAX_CONCURRENT, max_pending: int = UPDATE_MAX_PENDING,
+                 registry: HandlerMetrics = metrics):
+        self.registry = registry
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._room = asyncio.Semaphore(max(max_pending, max_concurrent))
+        self._chats: Dict[int, Deque[Job]] = {}
+        self._drains: Set[asyncio.Task] = set()
+        self.pending = 0
+        self.running = 0
+
+    def _publish(self) -> None:
+        self.registry.set_queue(self.pending, self.running, len(self._chats))
+
+    async def submit(self, chat_id: int, job: Callable[[], Awaitable[Any]]) -> "asyncio.Future[Any]":
+        """Queue `job` behind the chat's earlier updates; waits while the queues are full. Returns its result future."""
+        if self._room.locked():
+            t0 = time.perf_counter()
+            await self._room.acquire()
+            self.registry.record_backpressure(time.perf_counter() - t0)
+        else:
+            await self._room.acquire()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            drain = asyncio.create_task(self._drain(chat_id, queue))
+            self._drains.add(drain)
+            drain.add_done_callback(self._drains.discard)
+        queue.append((job, future, time.perf_counter()))
+        self.pending += 1
+        self._publish()
+        return future
+
+    async def _drain(self, chat_id: int, queue: Deque[Job]) -> None:
+        # the finished update leaves the queue only after it ran, so the chat stays "busy" meanwhile
+        while queue:
+            job, future, queued = queue[0]
+            async with self._slots:
+                self.registry.record_queue_wait(time.perf_counter() - queued)
+                self.running += 1
+                self._publish()
+                try:
+                    result = await job()
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+                finally:
+                    queue.popleft()
+                    self.running -= 1
+                    self.pending -= 1
+                    self._room.release()
+                    if not queue:
+                        del self._chats[chat_id]
+                    self._publish()
+
+    async def close(self) -> None:
+        """Let every accepted update finish."""
+        while self._drains:
+            await asyncio.gather(*self._drains, return_exceptions=True)
+
+
+class ChatQueueMiddleware(BaseMiddleware):
+    def __init__(self, queue: ChatQueue):
+        self.queue = queue
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        future = await self.queue.submit(update_chat_key(event), lambda: handler(event, data))
+        if not data.get(DETACH):
+            return await future
+
+        def _log_failure(done: "asyncio.Future[Any]") -> None:
+            if not done.cancelled() and done.exception() is not None:
+                logger.error("Update id=%s failed", event.update_id, exc_info=done.exception())
+
+        future.add_done_callback(_log_failure)
+        return None
+
+
+class AlbumMiddleware(BaseMiddleware):
+    def __init__(self, wait: float = ALBUM_COLLECT_SECONDS):
+        self.wait = wait
+        self._albums: Dict[str, list] = {}
+        self._pending: Set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = getattr(event, "message", None)
+        group_id = getattr(message, "media_group_id", None)
+        if not group_id:
+            return await handler(event, data)
+        if group_id in self._albums:
+            self._albums[group_id].append(message)
+            return None
+        self._albums[group_id] = [message]
+
+        async def _complete() -> Any:
+            await asyncio.sleep(self.wait)
+            data["album"] = sorted(self._albums.pop(group_id), key=lambda m: m.message_id)
+            return await handler(event, data)
+
+        if not data.get(DETACH):
+            return await _complete()
+        # the poller must go on fetching the rest of the album meanwhile
+        def _log_failure(done: "asyncio.Task[Any]") -> None:
+            if not done.cancelled() and done.exception() is not None:
+                logger.error("Album update id=%s failed", event.update_id, exc_info=done.exception())
+
+        task = asyncio.create_task(_complete())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        task.add_done_callback(_log_failure)
+        return None
+
+    async def close(self) -> None:
+        """Queue the albums still being collected."""
+        while self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+def setup_chat_queue(dp: Dispatcher, max_concurrent: int = UPDATE_MAX_CONCURRENT,
+                     max_pending: int = UPDATE_MAX_PENDING) -> ChatQueue:
+    """Register first among the dp.update outer middlewares; accepted updates finish before dp shutdown completes."""
+    queue = ChatQueue(max_concurrent, max_pending)
+    # ahead of aiogram's own (errors, user context, FSM): the FSM one reads the chat's
+    # state for the filters, which must happen when the update's turn comes, not on arrival
+    builtin = list(dp.update.outer_middleware)
+    for middleware in builtin:
+        dp.update.outer_middleware.unregister(middleware)
+    albums = AlbumMiddleware()
+    dp.update.outer_middleware(albums)
+    dp.update.outer_middleware(ChatQueueMiddleware(queue))
+    for middleware in builtin:
+        dp.update.outer_middleware(middleware)
+    dp.shutdown.register(albums.close)
+    dp.shutdown.register(queue.close)
+    return queue
+
+
+def polling_options(dp: Dispatcher) -> Dict[str, Any]:
+    """dp.start_polling keyword arguments that hand polled updates to the chat queue."""
+    if any(isinstance(m, ChatQueueMiddleware) for m in dp.update.outer_middleware):
+        return {"handle_as_tasks": False, DETACH: True}
+    return {}
+
+
+__all__ = ["AlbumMiddleware", "ChatQueue", "ChatQueueMiddleware", "DETACH", "polling_options", "setup_chat_queue", "update_chat_key"]
@@ -0,0 +1,375 @@
+"""
+middlewares/metrics.py
+
+Per-handler instrumentation, so a slow handler can be named:
+
+- UpdateMetricsMiddleware (outer, on dp.update) times every update and files
+  it under the handler that took it ("unhandled" if none did), together with
+  what the update cost: SQL statements and time spent in them, pooled
+  connections checked out (SQLAlchemy events on every db_engine engine) and
+  Bot API calls.
+- ApiMetricsMiddleware (on the bot session) counts and times every Bot API
+  request by method, inside the update or not (broadcasts, scheduler).
+- middlewares/chat_queue.py reports its queues here: updates waiting or
+  running, chats with queued updates, the wait before an update starts and
+  how long intake was held back when the queues were full.
+
+Everything lives in the process-wide `metrics` registry. It is served in the
+Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics and
+summarized by /dashboard (metrics.summary()).
+"""
+import time
+import bisect
+import logging
+import weakref
+from contextvars import ContextVar
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+
+from config import METRICS_HOST, METRICS_PORT, BOT_WORKER_INDEX
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNHANDLED = "unhandled"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        out, total = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            out.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return out
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if it is past the last bucket)."""
+        rank, total = q * self.count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            if total >= rank and total:
+                return bound
+        return 0.0
+
+
+class UpdateStats:
+    """What one update cost; filled in while it is handled."""
+
+    __slots__ = ("handler", "sql_statements", "sql_seconds", "connections", "api_calls")
+
+    def __init__(self):
+        self.handler = UNHANDLED
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.connections = 0
+        self.api_calls = 0
+
+
+_current: ContextVar[Optional[UpdateStats]] = ContextVar("update_stats", default=None)
+
+
+class HandlerMetrics:
+    def __init__(self):
+        self.duration: Dict[str, Histogram] = defaultdict(Histogram)
+        self.sql_statements: Dict[str, int] = defaultdict(int)
+        self.sql_seconds: Dict[str, float] = defaultdict(float)
+        self.connections: Dict[str, int] = defaultdict(int)
+        self.api_calls: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.api_duration: Dict[str, Histogram] = defaultdict(Histogram)
+        self.api_errors: Dict[str, int] = defaultdict(int)
+        self.sql_total = 0
+        self.sql_total_seconds = 0.0
+        self.connections_total = 0
+        self.queue_wait = Histogram()
+        self.queue_depth = 0
+        self.queue_running = 0
+        self.queue_chats = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+        self.started = time.time()
+
+    def record_update(self, stats: UpdateStats, seconds: float, failed: bool) -> None:
+        name = stats.handler
+        self.duration[name].observe(seconds)
+        self.sql_statements[name] += stats.sql_statements
+        self.sql_seconds[name] += stats.sql_seconds
+        self.connections[name] += stats.connections
+        self.api_calls[name] += stats.api_calls
+        if failed:
+            self.errors[name] += 1
+
+    def record_sql(self, seconds: float) -> None:
+        self.sql_total += 1
+        self.sql_total_seconds += seconds
+        stats = _current.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += seconds
+
+    def record_checkout(self) -> None:
+        self.connections_total += 1
+        stats = _current.get()
+        if stats is not None:
+            stats.connections += 1
+
+    def set_queue(self, depth: int, running: int, chats: int) -> None:
+        self.queue_depth, self.queue_running, self.queue_chats = depth, running, chats
+
+    def record_queue_wait(self, seconds: float) -> None:
+        self.queue_wait.observe(seconds)
+
+    def record_backpressure(self, seconds: float) -> None:
+        self.backpressure_waits += 1
+        self.backpressure_seconds += seconds
+
+    def record_api(self, method: str, seconds: float, failed: bool) -> None:
+        self.api_duration[method].observe(seconds)
+        if failed:
+            self.api_errors[method] += 1
+        stats = _current.get()
+        if stats is not None:
+            stats.api_calls += 1
+
+    # ---- output ----
+    def summary(self, top: int = 10) -> List[Dict[str, Any]]:
+        """Handlers by total time spent in them, with per-update averages."""
+        rows = []
+        for name, hist in self.duration.items():
+            n = hist.count
+            rows.append({
+                "handler": name, "updates": n, "errors": self.errors.get(name, 0),
+                "avg_ms": hist.sum / n * 1000, "p95_ms": hist.quantile(0.95) * 1000,
+                "sql_per_update": self.sql_statements[name] / n, "db_ms_per_update": self.sql_seconds[name] / n * 1000,
+                "connections_per_update": self.connections[name] / n,
+                "api_per_update": self.api_calls[name] / n, "total_s": hist.sum,
+            })
+        rows.sort(key=lambda r: r["total_s"], reverse=True)
+        return rows[:top]
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, hist: Histogram, lv: str = "") -> None:
+            for le, n in hist.cumulative():
+                lines.append(f'{name}_bucket{{{lv}{"," if lv else ""}le="{le}"}} {n}')
+            labels = f"{{{lv}}}" if lv else ""
+            lines.append(f"{name}_sum{labels} {hist.sum!r}")
+            lines.append(f"{name}_count{labels} {hist.count}")
+
+        def histograms(name: str, label: str, values: Dict[str, Histogram]) -> None:
+            for key, hist in sorted(values.items()):
+                histogram(name, hist, f'{label}="{_escape(key)}"')
+
+        def counters(name: str, label: str, values: Dict[str, Any]) -> None:
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{{label}="{_escape(key)}"}} {value!r}')
+
+        family("bot_handler_duration_seconds", "histogram", "Time to handle one update, by the handler that took it.")
+        histograms("bot_handler_duration_seconds", "handler", self.duration)
+        family("bot_handler_errors_total", "counter", "Updates whose handler raised.")
+        counters("bot_handler_errors_total", "handler", self.errors)
+        family("bot_handler_sql_statements_total", "counter", "SQL statements executed while handling updates.")
+        counters("bot_handler_sql_statements_total", "handler", self.sql_statements)
+        family("bot_handler_db_seconds_total", "counter", "Time spent in SQL statements while handling updates.")
+        counters("bot_handler_db_seconds_total", "handler", self.sql_seconds)
+        family("bot_handler_db_connections_total", "counter", "Pooled DB connections checked out while handling updates.")
+        counters("bot_handler_db_connections_total", "handler", self.connections)
+        family("bot_handler_api_calls_total", "counter", "Bot API requests made while handling updates.")
+        counters("bot_handler_api_calls_total", "handler", self.api_calls)
+        family("bot_telegram_api_duration_seconds", "histogram", "Bot API request time, by method.")
+        histograms("bot_telegram_api_duration_seconds", "method", self.api_duration)
+        family("bot_telegram_api_errors_total", "counter", "Bot API requests that failed, by method.")
+        counters("bot_telegram_api_errors_total", "method", self.api_errors)
+        family("bot_sql_statements_total", "counter", "SQL statements executed by the process.")
+        lines.append(f"bot_sql_statements_total {self.sql_total}")
+        family("bot_sql_seconds_total", "counter", "Time spent in SQL statements by the process.")
+        lines.append(f"bot_sql_seconds_total {self.sql_total_seconds!r}")
+        family("bot_db_connections_total", "counter", "Pooled DB connections checked out by the process.")
+        lines.append(f"bot_db_connections_total {self.connections_total}")
+        family("bot_update_queue_depth", "gauge", "Updates accepted and not finished yet (waiting or running).")
+        lines.append(f"bot_update_queue_depth {self.queue_depth}")
+        family("bot_update_queue_running", "gauge", "Updates being handled right now.")
+        lines.append(f"bot_update_queue_running {self.queue_running}")
+        family("bot_update_queue_chats", "gauge", "Chats with updates waiting or running.")
+        lines.append(f"bot_update_queue_chats {self.queue_chats}")
+        family("bot_update_queue_wait_seconds", "histogram", "Time from accepting an update to starting it.")
+        histogram("bot_update_queue_wait_seconds", self.queue_wait)
+        family("bot_update_backpressure_waits_total", "counter", "Updates that waited for room before being accepted.")
+        lines.append(f"bot_update_backpressure_waits_total {self.backpressure_waits}")
+        family("bot_update_backpressure_seconds_total", "counter", "Time intake was held back by full queues.")
+        lines.append(f"bot_update_backpressure_seconds_total {self.backpressure_seconds!r}")
+        family("bot_process_start_time_seconds", "gauge", "Start time of the process since the epoch.")
+        lines.append(f"bot_process_start_time_seconds {self.started!r}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = HandlerMetrics()
+
+
+def handler_name(handler: Any) -> str:
+    callback = getattr(handler, "callback", handler)
+    return f"{getattr(callback, '__module__', '?')}.{getattr(callback, '__qualname__', repr(callback))}"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update: one UpdateStats per update, recorded when handling ends."""
+
+    def __init__(self, registry: HandlerMetrics = metrics):
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = UpdateStats()
+        token = _current.set(stats)
+        failed = False
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _current.reset(token)
+            self.registry.record_update(stats, elapsed, failed)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware on each event observer: tells the update's stats which handler took it."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = _current.get()
+        if stats is not None:
+            # a button press resolved by text_dispatch.ButtonIndex runs the indexed handler
+            stats.handler = handler_name(data.get("button_handler") or data.get("handler"))
+        return await handler(event, data)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    def __init__(self, registry: HandlerMetrics = metrics):
+        self.registry = registry
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        failed = True
+        t0 = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+            failed = False
+            return response
+        finally:
+            self.registry.record_api(method.__api_method__, time.perf_counter() - t0, failed)
+
+
+_instrumented: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def instrument_engine(engine: Any, registry: HandlerMetrics = metrics) -> None:
+    """Count and time every statement and connection checkout of a sync Engine (for an AsyncEngine pass .sync_engine); once per engine."""
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        registry.record_sql(time.perf_counter() - conn.info["query_start"].pop())
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        registry.record_checkout()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT,
+                               registry: HandlerMetrics = metrics) -> web.AppRunner:
+    async def serve(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return runner
+
+
+def setup_metrics(dp: Dispatcher, port: Optional[int] = None) -> None:
+    """Instrument updates, SQL and Bot API calls; serve /metrics between dp startup and shutdown (port 0: no server)."""
+    if port is None:
+        # worker processes of a multi-process bot each get their own port
+        port = METRICS_PORT + 1 + BOT_WORKER_INDEX if METRICS_PORT and BOT_WORKER_INDEX >= 0 else METRICS_PORT
+    from db_engine import get_engine, get_read_engine, get_write_engine
+
+    for engine in (get_engine(), get_read_engine().sync_engine, get_write_engine().sync_engine):
+        instrument_engine(engine)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerNameMiddleware())
+    server = {}
+
+    async def _start(bot: Bot):
+        if not any(isinstance(m, ApiMetricsMiddleware) for m in bot.session.middleware):
+            bot.session.middleware(ApiMetricsMiddleware())
+        if port:
+            try:
+                server["runner"] = await start_metrics_server(port=port)
+            except OSError:
+                logger.exception("Could not serve metrics on port %s", port)
+
+    async def _stop():
+        runner = server.pop("runner", None)
+        if runner is not None:
+            await runner.cleanup()
+
+    dp.startup.register(_start)
+    dp.shutdown.register(_stop)
+
+
+__all__ = [
+    "metrics", "HandlerMetrics", "Histogram", "LATENCY_BUCKETS", "UpdateMetricsMiddleware", "HandlerNameMiddleware",
+    "ApiMetricsMiddleware", "instrument_engine", "start_metrics_server", "setup_metrics",
+]
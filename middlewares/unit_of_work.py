@@ -0,0 +1,74 @@
+"""
+middlewares/unit_of_work.py
+
+One database session per update. UnitOfWorkMiddleware (outer, on dp.update)
+opens a db.update_session, hands it to handlers as the `session` argument
+and closes it when the update is done:
+
+    async def my_tariff(message: Message, state: FSMContext, session: AsyncSession = None):
+        user = await get_user_by_tg(message.from_user.id, session=session)
+        bonus = await get_user_bonus(user.id, session=session)
+
+Reads of one update then share one pooled connection, and
+`async with db.transaction(session):` groups writes into one transaction.
+The session connects only when a helper first uses it.
+
+A handler waiting on the Bot API should not sit on a pooled connection, so
+ReleaseReadsMiddleware (on the bot session) ends the update's read
+transaction before each API call the update makes; the next read checks a
+connection out again.
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import update_session, release_reads
+
+# the session of the update being handled, and the task handling it
+_current: ContextVar[Optional[Tuple[AsyncSession, "asyncio.Task[Any]"]]] = ContextVar("update_session", default=None)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with update_session() as session:
+            data["session"] = session
+            token = _current.set((session, asyncio.current_task()))
+            try:
+                return await handler(event, data)
+            finally:
+                _current.reset(token)
+
+
+class ReleaseReadsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        current = _current.get()
+        # tasks spawned by a handler inherit the context but must not touch its session
+        if current is not None and current[1] is asyncio.current_task():
+            pending = release_reads(current[0])
+            if pending is not None:
+                await pending
+        return await make_request(bot, method)
+
+
+def setup_unit_of_work(dp: Dispatcher) -> None:
+    dp.update.outer_middleware(UnitOfWorkMiddleware())
+
+    async def _install(bot: Bot):
+        if not any(isinstance(m, ReleaseReadsMiddleware) for m in bot.session.middleware):
+            bot.session.middleware(ReleaseReadsMiddleware())
+
+    dp.startup.register(_install)
+
+
+__all__ = ["UnitOfWorkMiddleware", "ReleaseReadsMiddleware", "setup_unit_of_work"]
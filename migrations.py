@@ -0,0 +1,160 @@
+"""
+migrations.py
+
+Versioned schema migrations for bot.db.
+
+Base.metadata.create_all only creates missing tables; it never adds columns or
+indexes to a table that already exists. Every schema change to an existing
+table therefore goes here as a new numbered step. Applied versions are recorded
+in `schema_migrations`, and each step runs in its own transaction together with
+its version row, so an interrupted upgrade resumes at the failed step.
+
+database.init_schema() / db.init_db() run pending migrations after create_all
+(main.py does so at startup); to upgrade a database by hand: python migrations.py
+"""
+import logging
+import datetime as dt
+from typing import Callable, List, Sequence, Tuple, Union
+
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+Step = Union[Sequence[str], Callable[[Connection], None]]
+
+
+def _add_missing_columns(conn: Connection) -> None:
+    """Add model columns that older bot.db files were created without (nullable, with scalar defaults)."""
+    from database import Base
+
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column.type.compile(conn.dialect)}'
+            default = getattr(column.default, "arg", None)
+            if isinstance(default, (int, float)) and not isinstance(default, bool):
+                ddl += f" DEFAULT {default}"
+            elif isinstance(default, str):
+                ddl += " DEFAULT '" + default.replace("'", "''") + "'"
+            conn.execute(text(ddl))
+            logger.info("Added column %s.%s", table.name, column.name)
+
+
+def _backfill_metrics_daily(conn: Connection) -> None:
+    """metrics_daily itself comes from create_all; seed it from the rows already in the database."""
+    from rollup import backfill_metrics_daily
+
+    backfill_metrics_daily(conn)
+
+
+# (version, description, step). Never edit or reorder an applied step; append a new one.
+MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, "add columns missing from older databases", _add_missing_columns),
+    (2, "indexes for payment lookups, reports and user filters", [
+        # get_latest_pending_by_user: user_tg = ? AND status IN (...) ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS ix_pending_payments_user_status_created "
+        "ON pending_payments (user_tg, status, created_at)",
+        # get_report_data: status = 'approved' AND approved_at BETWEEN ? AND ?
+        "CREATE INDEX IF NOT EXISTS ix_pending_payments_status_approved "
+        "ON pending_payments (status, approved_at)",
+        # get_report_data: new users by created_at range
+        "CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)",
+        # get_user_by_phone
+        "CREATE INDEX IF NOT EXISTS ix_users_phone ON users (phone)",
+        # deactivate_expired_tariffs: tariff_end <= now
+        "CREATE INDEX IF NOT EXISTS ix_users_tariff_end ON users (tariff_end)",
+    ]),
+    (3, "covering indexes for get_report_data", [
+        # approved payments in range grouped by tariff/plan with SUM(payable), no table lookups;
+        # supersedes ix_pending_payments_status_approved (its prefix)
+        "CREATE INDEX IF NOT EXISTS ix_pending_payments_report "
+        "ON pending_payments (status, approved_at, tariff, plan, payable)",
+        "DROP INDEX IF EXISTS ix_pending_payments_status_approved",
+        # purchased users: COUNT WHERE tariff IS NOT NULL as an index range
+        "CREATE INDEX IF NOT EXISTS ix_users_tariff ON users (tariff)",
+    ]),
+    (4, "fill metrics_daily from existing users and payments", _backfill_metrics_daily),
+    (5, "referral leaderboard indexes and counter re-sync", [
+        "CREATE INDEX IF NOT EXISTS ix_users_referred_by ON users (referred_by)",
+        # referrals_registered must equal the number of users pointing at the referrer;
+        # the correlated COUNT is an ix_users_referred_by lookup per row
+        "UPDATE users SET referrals_registered = "
+        "(SELECT COUNT(*) FROM users AS r WHERE r.referred_by = users.id)",
+        "CREATE INDEX IF NOT EXISTS ix_users_referral_rank ON users (referrals_registered DESC, id)",
+    ]),
+    (6, "users.unreachable_at for chats that blocked the bot", _add_missing_columns),
+    (7, "broadcast job progress and per-error-class counters", _add_missing_columns),
+    (8, "broadcast_jobs.audience for segmented broadcasts", _add_missing_columns),
+    (9, "indexes for broadcast segment filters", [
+        "CREATE INDEX IF NOT EXISTS ix_users_last_active ON users (last_active)",
+        "CREATE INDEX IF NOT EXISTS ix_users_bonus_balance ON users (bonus_balance)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at DATETIME NOT NULL)"
+    ))
+
+
+def applied_versions(conn: Connection) -> set:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def current_version(engine: Engine) -> int:
+    with engine.begin() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def run_migrations(bind: Union[Engine, Connection] = None) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied by this call."""
+    if bind is None:
+        from db_engine import get_engine
+        bind = get_engine()
+    if isinstance(bind, Engine):
+        with bind.connect() as conn:
+            return run_migrations(conn)
+
+    conn = bind
+    applied = []
+    for version, name, step in MIGRATIONS:
+        with conn.begin():
+            # re-read inside the transaction: another process may have applied it meanwhile
+            if version in applied_versions(conn):
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(text(statement))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": dt.datetime.utcnow()},
+            )
+        logger.info("Applied migration %s: %s", version, name)
+        applied.append(version)
+    return applied
+
+
+__all__ = ["MIGRATIONS", "LATEST_VERSION", "run_migrations", "current_version", "applied_versions"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from database import ENGINE, init_schema
+
+    init_schema(ENGINE)
+
+    print(f"schema version: {current_version(ENGINE)} (latest {LATEST_VERSION})")
@@ -0,0 +1,81 @@
+"""
+Upgrade a copy of bot.db (or an empty database) with migrations.py and check
+with EXPLAIN QUERY PLAN that the hot queries use the new indexes.
+
+Run: python migrations_check.py   (exits 1 on failure; never touches bot.db)
+"""
+import os
+import shutil
+import datetime as dt
+import sqlite3
+import tempfile
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent / "bot.db"
+TMP = Path(tempfile.mkdtemp(prefix="migrations_check_")) / "bot.db"
+if SRC.exists():
+    shutil.copy(SRC, TMP)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{TMP}"
+
+from sqlalchemy import select, func  # noqa: E402
+
+from database import ENGINE, User, PendingPayment, FsmState, init_schema, report_statements, referral_leaderboard_statement  # noqa: E402
+from migrations import LATEST_VERSION, current_version, run_migrations  # noqa: E402
+from segments import Segment  # noqa: E402
+
+errors = False
+
+
+def check(ok: bool, label: str, detail: str = "") -> None:
+    global errors
+    print("OK " if ok else "ERR", label, detail)
+    errors = errors or not ok
+
+
+def plan(stmt) -> str:
+    sql = str(stmt.compile(ENGINE, compile_kwargs={"literal_binds": True}))
+    conn = sqlite3.connect(TMP)
+    try:
+        return " | ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+    finally:
+        conn.close()
+
+
+init_schema(ENGINE)
+check(current_version(ENGINE) == LATEST_VERSION, "schema at latest version", str(current_version(ENGINE)))
+check(run_migrations(ENGINE) == [], "second run is a no-op")
+
+cols = {row[1] for row in sqlite3.connect(TMP).execute("PRAGMA table_info(users)")}
+check({c.name for c in User.__table__.columns} <= cols, "users has every model column")
+
+day = dt.datetime(2024, 1, 1)
+queries = {
+    "ix_pending_payments_user_status_created": select(PendingPayment).where(
+        PendingPayment.user_tg == 1,
+        PendingPayment.status.in_(["under_review", "awaiting_receipt", "awaiting_payment"]),
+    ).order_by(PendingPayment.created_at.desc()).limit(1),
+    "ix_pending_payments_report": report_statements(day, day)[1],
+    "ix_users_created_at": report_statements(day, day)[0],
+    "ix_users_tariff": report_statements(day, day)[0],
+    "ix_users_phone": select(User).where(User.phone == "+998901234567").limit(1),
+    "ix_users_tariff_end": select(User).where(User.tariff_end != None, User.tariff_end <= day),  # noqa: E711
+    "ix_users_referral_rank": referral_leaderboard_statement(10, 20),
+    # broadcast segment pre-counts
+    "ix_users_last_active": select(func.count(User.id)).where(*Segment(seen_within_days=7).criteria()),
+    "ix_users_bonus_balance": select(func.count(User.id)).where(*Segment(with_bonus=True).criteria()),
+    # FSM storage TTL cleanup
+    "ix_fsm_states_updated_at": select(FsmState.key).where(FsmState.updated_at < day),
+}
+for index, stmt in queries.items():
+    detail = plan(stmt)
+    check(index in detail, f"uses {index}", detail)
+
+month_users, month_sales = report_statements(dt.datetime(2024, 1, 1, 12), dt.datetime(2024, 1, 31, 12))
+for label, stmt in (("new users", month_users), ("sales", month_sales)):
+    detail = plan(stmt)
+    check("metrics_daily" in detail, f"30-day {label} read whole days from metrics_daily", detail)
+
+ENGINE.dispose()
+if errors:
+    raise SystemExit(1)
+print("MIGRATIONS OK")
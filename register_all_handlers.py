@@ -1,6 +1,7 @@
 import importlib
 import logging
 from aiogram import Dispatcher
+from text_dispatch import ButtonIndex
 
 # Ensure basic logging is configured so startup issues are visible on console
 logging.basicConfig(level=logging.INFO)
@@ -25,20 +26,24 @@ MODULES = [
     "handlers.admin_contact",
     "handlers.admin.broadcast",
     "handlers.admin.panel",
+    "handlers.admin.dashboard",
     # temporary debug-only module to confirm callback delivery
     "handlers.admin.debug_callbacks",
 ]
 
-def register_all_handlers(dp: Dispatcher):
+def register_all_handlers(dp: Dispatcher, index_buttons: bool = True):
+    """
+    Include every handler router in MODULES order. With index_buttons, a
+    ButtonIndex router goes first and resolves stateless reply-keyboard
+    presses by one lookup (see text_dispatch.py).
+    """
+    routers = []
     for name in MODULES:
         try:
             mod = importlib.import_module(name)
             router = getattr(mod, "router", None)
             if router:
-                dp.include_router(router)
-                logger.info("Included router: %s", name)
-                # visible feedback for environments without logging config
-                print(f"Included router: {name}")
+                routers.append((name, router))
             else:
                 logger.warning("Module %s has no router", name)
                 print(f"WARNING: Module {name} has no router")
@@ -46,4 +51,15 @@ def register_all_handlers(dp: Dispatcher):
             logger.exception("Failed to import %s", name)
             print(f"Failed to import {name}; see logs for details")
 
+    if index_buttons:
+        index = ButtonIndex(router for _, router in routers)
+        dp.include_router(index.router())
+        logger.info("Indexed %s button texts", len(index))
+
+    for name, router in routers:
+        dp.include_router(router)
+        logger.info("Included router: %s", name)
+        # visible feedback for environments without logging config
+        print(f"Included router: {name}")
+
 __all__ = ["register_all_handlers"]
\ No newline at end of file
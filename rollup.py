@@ -0,0 +1,50 @@
+"""
+rollup.py
+
+Rebuild metrics_daily (database.MetricsDaily) from users and pending_payments.
+
+Normal operation keeps the rollup current in the same transaction as each
+user insert and payment approval; a rebuild is only needed after importing
+data or editing rows by hand. Migration 4 runs it once for existing databases.
+
+Usage: python rollup.py
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+_BACKFILL = [
+    "DELETE FROM metrics_daily",
+    # the day's user row (tariff = '')
+    "INSERT INTO metrics_daily (day, tariff, plan, new_users, sales, revenue) "
+    "SELECT date(created_at), '', '', COUNT(*), 0, 0 FROM users "
+    "WHERE created_at IS NOT NULL GROUP BY date(created_at)",
+    # approved sales per tariff/plan; same 'unknown' label as the reports for a missing tariff
+    "INSERT INTO metrics_daily (day, tariff, plan, new_users, sales, revenue) "
+    "SELECT date(approved_at), COALESCE(tariff, 'unknown'), COALESCE(\"plan\", ''), 0, COUNT(*), "
+    "COALESCE(SUM(payable), 0) FROM pending_payments "
+    "WHERE status = 'approved' AND approved_at IS NOT NULL "
+    "GROUP BY date(approved_at), COALESCE(tariff, 'unknown'), COALESCE(\"plan\", '')",
+]
+
+
+def backfill_metrics_daily(conn: Connection) -> int:
+    """Replace metrics_daily with totals recomputed from raw rows (caller owns the transaction)."""
+    for statement in _BACKFILL:
+        conn.execute(text(statement))
+    return conn.execute(text("SELECT COUNT(*) FROM metrics_daily")).scalar() or 0
+
+
+__all__ = ["backfill_metrics_daily"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from database import ENGINE
+
+    with ENGINE.begin() as conn:
+        rows = backfill_metrics_daily(conn)
+    print(f"metrics_daily rebuilt: {rows} rows")
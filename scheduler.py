@@ -4,14 +4,14 @@ from datetime import datetime, timedelta
 from aiogram import Bot
 import aioschedule
 from config import ADMIN_ID
-from database import get_report_data
+from db import get_report_data
 from loader import bot
 from handlers.admin.panel import send_10_day_report, send_monthly_report, manage_expired_subscriptions
 
 async def send_report(bot: Bot, admin_id: int):
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=1)
-    report = get_report_data(start_date, end_date)
+    report = await get_report_data(start_date, end_date)
 
     text = (
         f"📊 Kunlik hisobot\n"
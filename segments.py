@@ -0,0 +1,142 @@
+"""
+segments.py
+
+Broadcast audiences. A Segment is a set of optional filters on users that
+AND together; criteria() compiles them into SQLAlchemy expressions for one
+query, so the same segment drives db.count_recipients (the instant pre-count)
+and db.iter_recipients (the streamed send). Every filter is a range or IN on
+an indexed column:
+
+    tariffs          users.tariff IN (...), "none" = no tariff   ix_users_tariff
+    status           active: tariff_end > as_of                  ix_users_tariff_end
+                     expired: tariff_end <= as_of, or no tariff but an
+                     approved payment (expiry clears tariff_end)  ix_pending_payments_user_status_created
+    seen_within_days last_active >= as_of - N days               ix_users_last_active
+    not_seen_days    last_active <  as_of - N days               ix_users_last_active
+    joined_from/to   created_at range                            ix_users_created_at
+    with_bonus       bonus_balance > 0                           ix_users_bonus_balance
+
+Relative windows are measured from `as_of`, fixed when the segment is created,
+so a job resumed tomorrow still targets the same users. Segments travel as
+plain dicts (to_dict / from_dict): in FSM data and in broadcast_jobs.audience.
+"""
+import datetime as dt
+from dataclasses import dataclass, field, fields, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, exists, or_
+
+from database import User, PendingPayment
+
+# (tariff key stored in users.tariff, label); the index is used in callback data
+SEGMENT_TARIFFS: Tuple[Tuple[str, str], ...] = (
+    ("pro", "Pro"),
+    ("premium", "Premium"),
+    ("pregnancy", "Homiladorlik"),
+    ("farzand ko‘rishni rejalashtirish", "Farzand rejalash"),
+)
+NO_TARIFF = "none"
+STATUS_LABELS = {"active": "faol tarif", "expired": "muddati o'tgan"}
+
+
+def _parse_dt(value) -> Optional[dt.datetime]:
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    return dt.datetime.fromisoformat(value)
+
+
+@dataclass(frozen=True)
+class Segment:
+    tariffs: Tuple[str, ...] = ()
+    status: Optional[str] = None
+    seen_within_days: Optional[int] = None
+    not_seen_days: Optional[int] = None
+    joined_from: Optional[dt.datetime] = None
+    joined_to: Optional[dt.datetime] = None
+    with_bonus: bool = False
+    as_of: dt.datetime = field(default_factory=dt.datetime.utcnow)
+
+    # ---- serialization ----
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if isinstance(value, dt.datetime):
+                value = value.isoformat()
+            elif isinstance(value, tuple):
+                value = list(value)
+            data[f.name] = value
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "Segment":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        data = {k: v for k, v in data.items() if k in known}
+        for key in ("joined_from", "joined_to", "as_of"):
+            if key in data:
+                data[key] = _parse_dt(data[key])
+        if data.get("as_of") is None:
+            data.pop("as_of", None)
+        data["tariffs"] = tuple(data.get("tariffs") or ())
+        return cls(**data)
+
+    def update(self, **changes) -> "Segment":
+        return replace(self, **changes)
+
+    @property
+    def is_everyone(self) -> bool:
+        return self.criteria() == []
+
+    # ---- SQL ----
+    def criteria(self) -> List[Any]:
+        """SQLAlchemy WHERE expressions on User (AND-ed by the caller)."""
+        out = []
+        if self.tariffs:
+            named = [t for t in self.tariffs if t != NO_TARIFF]
+            options = [User.tariff.in_(named)] if named else []
+            if NO_TARIFF in self.tariffs:
+                options.append(User.tariff.is_(None))
+            out.append(or_(*options))
+        if self.status == "active":
+            out.append(and_(User.tariff.isnot(None), User.tariff_end > self.as_of))
+        elif self.status == "expired":
+            bought = exists().where(
+                PendingPayment.user_tg == User.telegram_id, PendingPayment.status == "approved",
+            )
+            out.append(or_(User.tariff_end <= self.as_of, and_(User.tariff.is_(None), bought)))
+        if self.seen_within_days:
+            out.append(User.last_active >= self.as_of - dt.timedelta(days=self.seen_within_days))
+        if self.not_seen_days:
+            out.append(User.last_active < self.as_of - dt.timedelta(days=self.not_seen_days))
+        if self.joined_from:
+            out.append(User.created_at >= self.joined_from)
+        if self.joined_to:
+            out.append(User.created_at < self.joined_to)
+        if self.with_bonus:
+            out.append(User.bonus_balance > 0)
+        return out
+
+    # ---- display ----
+    def describe(self) -> str:
+        labels = dict(SEGMENT_TARIFFS, **{NO_TARIFF: "tarifsiz"})
+        parts = []
+        if self.tariffs:
+            parts.append("tarif: " + ", ".join(labels.get(t, t) for t in self.tariffs))
+        if self.status:
+            parts.append(STATUS_LABELS.get(self.status, self.status))
+        if self.seen_within_days:
+            parts.append(f"{self.seen_within_days} kunda faol")
+        if self.not_seen_days:
+            parts.append(f"{self.not_seen_days}+ kun nofaol")
+        if self.joined_from or self.joined_to:
+            start = self.joined_from.strftime("%d.%m.%Y") if self.joined_from else "…"
+            end = self.joined_to.strftime("%d.%m.%Y") if self.joined_to else "hozir"
+            parts.append(f"qo'shilgan: {start} – {end}")
+        if self.with_bonus:
+            parts.append("bonusi bor")
+        return "; ".join(parts) if parts else "barcha foydalanuvchilar"
+
+
+__all__ = ["Segment", "SEGMENT_TARIFFS", "NO_TARIFF", "STATUS_LABELS"]
@@ -3,7 +3,12 @@ import logging
 import importlib
 
 from aiogram.types import BotCommand
-from loader import dp, bot
+from loader import dp, bot, storage
+from middlewares import setup_middlewares, polling_options
+from broadcast_jobs import setup_broadcast_jobs
+from config import BOT_MODE
+from db import init_db
+from webhook import run_webhook
 
 # Import the handlers.register_all_handlers module explicitly to avoid name shadowing
 register = importlib.import_module('handlers.register_all_handlers')
@@ -24,25 +29,43 @@ async def set_bot_commands() -> None:
         logger.warning("Failed to set bot commands: %s", exc)
 
 async def main() -> None:
+    # Create tables and apply migrations before anything reads the database
+    await init_db()
+
     # Register all handlers (routers) before starting polling
     try:
         register.register_all_handlers(dp)
     except Exception as exc:
         logger.exception("Failed to register handlers: %s", exc)
         # proceed — registraton failures will be logged
+    setup_middlewares(dp)
+    setup_broadcast_jobs(dp)
 
     # Set bot commands (best-effort)
     await set_bot_commands()
 
-    logger.info("Starting polling...")
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            logger.info("Starting webhook server...")
+            await run_webhook(dp, bot)
+        else:
+            logger.info("Starting polling...")
+            await dp.start_polling(bot, **polling_options(dp))
     finally:
-        # Ensure bot session closed on shutdown
+        # Write out FSM states and close the bot session on shutdown
+        try:
+            await storage.close()
+        except Exception:
+            pass
         try:
             await bot.session.close()
         except Exception:
             pass
+        try:
+            from db_engine import dispose_engines
+            await dispose_engines()
+        except Exception:
+            pass
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,209 @@
+"""
+supervisor.py
+
+Multi-process mode, for when one process (one CPU core) is not enough. With
+BOT_WORKERS = N > 1, `python main.py` becomes a supervisor that
+
+- starts N worker processes (main.py again, with BOT_WORKER_INDEX=0..N-1)
+  and restarts any that exits;
+- receives updates the way a single bot would (long polling, or the public
+  webhook when BOT_MODE=webhook) and forwards each to worker chat_id % N over
+  a local HTTP connection, one update at a time per worker. All updates of a
+  chat therefore reach the same process in the order Telegram sent them, and
+  the worker's chat queue (middlewares/chat_queue.py) runs them in that
+  order. Without it they would run concurrently, so worker mode requires
+  UPDATE_MAX_CONCURRENT > 0;
+- runs no handlers itself.
+
+Workers share the SQLite database and the FSM states (fsm_storage.py).
+Worker 0 is the leader: only it runs the daily scheduler and resumes
+interrupted broadcast jobs. A worker serves webhook.build_app on
+127.0.0.1:WORKER_BASE_PORT + index, so the secret-token check and bounded
+concurrency of webhook mode apply there too.
+
+Updates fetched but not yet forwarded when the supervisor itself dies are
+lost (they are already confirmed to Telegram). While a worker is down the
+supervisor keeps retrying the next update until it is back, but a worker
+acknowledges an update when it is queued, not handled (webhook.py): the
+updates a worker had queued or running when it died are lost too.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import secrets
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+from aiohttp import ClientError, ClientSession, web
+
+from config import (
+    BOT_MODE, BOT_WORKERS, WORKER_BASE_PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_MAX_CONNECTIONS, UPDATE_MAX_CONCURRENT,
+)
+from webhook import build_app
+
+logger = logging.getLogger(__name__)
+
+MAIN = Path(__file__).resolve().parent / "main.py"
+WORKER_PATH = "/updates"
+# updates waiting per worker before the supervisor stops taking new ones
+WORKER_QUEUE_SIZE = 1000
+POLL_TIMEOUT = 30
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+Route = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """Chat an update belongs to (the sender's id for chat-less updates such as inline queries); 0 if none."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        user = value.get("from") or value.get("user")
+        if user:
+            return int(user["id"])
+    return 0
+
+
+def worker_for(chat_id: int, workers: int = BOT_WORKERS) -> int:
+    return chat_id % workers
+
+
+class WorkerLink:
+    """One worker process and the ordered queue of updates headed to it."""
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.url = f"http://127.0.0.1:{port}{WORKER_PATH}"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WORKER_QUEUE_SIZE)
+        self.process: Optional[asyncio.subprocess.Process] = None
+
+    async def run_process(self, stopping: asyncio.Event) -> None:
+        """Keep the worker process running until `stopping` is set."""
+        env = {**os.environ, "BOT_WORKER_INDEX": str(self.index)}
+        while not stopping.is_set():
+            self.process = await asyncio.create_subprocess_exec(sys.executable, str(MAIN), env=env)
+            code = await self.process.wait()
+            if stopping.is_set():
+                return
+            logger.warning("Worker %s exited with code %s; restarting", self.index, code)
+            await asyncio.sleep(1)
+
+    async def run_sender(self, http: ClientSession) -> None:
+        """POST queued updates to the worker in order; retry each until the worker accepts it."""
+        headers = {SECRET_HEADER: WEBHOOK_SECRET, "Content-Type": "application/json"}
+        while True:
+            update = await self.queue.get()
+            body = json.dumps(update, ensure_ascii=False)
+            while True:
+                try:
+                    async with http.post(self.url, data=body, headers=headers) as response:
+                        if response.status == 200:
+                            break
+                        logger.warning("Worker %s answered %s", self.index, response.status)
+                except (ClientError, OSError):
+                    pass  # starting or restarting
+                await asyncio.sleep(0.2)
+            self.queue.task_done()
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+async def _poll(bot: Bot, route: Route) -> None:
+    offset = None
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=POLL_TIMEOUT), request_timeout=POLL_TIMEOUT + 10)
+        except Exception:
+            logger.exception("getUpdates failed; retrying")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await route(update.model_dump(mode="json", exclude_unset=True))
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(bot: Bot, route: Route) -> None:
+    async def receive(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+        await route(await request.json())
+        return web.json_response({})
+
+    if not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_URL (the public https address of this server)")
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    try:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                              max_connections=WEBHOOK_MAX_CONNECTIONS)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _require_chat_queue() -> None:
+    if UPDATE_MAX_CONCURRENT <= 0:
+        raise RuntimeError("BOT_WORKERS > 1 needs UPDATE_MAX_CONCURRENT > 0: the chat queue keeps each chat's "
+                           "updates in order inside a worker")
+
+
+async def run_supervisor(bot: Bot, workers: int = BOT_WORKERS, base_port: int = WORKER_BASE_PORT) -> None:
+    """Start the workers and feed them updates until cancelled."""
+    _require_chat_queue()
+    links = [WorkerLink(i, base_port + i) for i in range(workers)]
+    stopping = asyncio.Event()
+
+    async def route(update: Dict[str, Any]) -> None:
+        await links[worker_for(update_chat_id(update), workers)].queue.put(update)
+
+    async with ClientSession() as http:
+        tasks: List[asyncio.Task] = [asyncio.create_task(link.run_process(stopping)) for link in links]
+        tasks += [asyncio.create_task(link.run_sender(http)) for link in links]
+        logger.info("Supervising %s workers on ports %s-%s", workers, base_port, base_port + workers - 1)
+        try:
+            if BOT_MODE == "webhook":
+                await _serve_webhook(bot, route)
+            else:
+                await _poll(bot, route)
+        finally:
+            # hand over what was already fetched, then stop the workers
+            try:
+                await asyncio.wait_for(asyncio.gather(*(link.queue.join() for link in links)), 10)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            stopping.set()
+            for link in links:
+                link.stop()
+            await asyncio.gather(*(l.process.wait() for l in links if l.process), return_exceptions=True)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def serve_worker(dp: Dispatcher, bot: Bot, index: int, base_port: int = WORKER_BASE_PORT) -> None:
+    """Handle updates forwarded by the supervisor until cancelled (runs in worker processes)."""
+    _require_chat_queue()
+    runner = web.AppRunner(build_app(dp, bot, path=WORKER_PATH))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", base_port + index).start()
+    logger.info("Worker %s listening on 127.0.0.1:%s", index, base_port + index)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+__all__ = ["run_supervisor", "serve_worker", "update_chat_id", "worker_for", "WORKER_PATH"]
@@ -0,0 +1,109 @@
+"""
+text_dispatch.py
+
+Reply-keyboard buttons resolved by one dict lookup instead of a filter scan.
+
+Handlers declare their button texts with the Button filter:
+
+    @router.message(Button("📑 Savol yozish", "Savol yozish"))
+
+register_all_handlers collects every handler whose only filter is a Button
+into a ButtonIndex and includes its router ahead of the others. For a
+message sent outside any FSM state, the index maps the text to its handler
+directly: first by exact text, then by normalize_button(text), so the ‘ / '
+apostrophe variants and texts with or without the emoji prefix reach the same
+handler. When one text is declared twice, the router included first wins, as
+it does in the linear scan.
+
+Messages sent inside an FSM state skip the index: state handlers must keep
+their say, and there the Button filters run in router order as before.
+"""
+import unicodedata
+from typing import Any, Dict, Iterable, Optional
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+_APOSTROPHES = str.maketrans({c: "'" for c in "‘’ʻʼ`´"})
+# zero-width joiner and variation selectors that glue emoji together
+_JOINERS = {"‍", "︎", "️"}
+
+
+def _is_prefix_char(ch: str) -> bool:
+    if ch.isspace() or ch in _JOINERS:
+        return True
+    # letters and digits of the scripts the bot writes in are text; ℹ, emoji and symbols are decoration
+    if ch.isalnum():
+        return ord(ch) >= 0x2000
+    return unicodedata.category(ch)[0] == "S"
+
+
+def normalize_button(text: str) -> str:
+    """Button text without its emoji prefix, with one kind of apostrophe and single spaces."""
+    text = text.translate(_APOSTROPHES)
+    start = 0
+    while start < len(text) and _is_prefix_char(text[start]):
+        start += 1
+    return " ".join(text[start:].split())
+
+
+class Button(Filter):
+    """Message text equals one of `texts` exactly."""
+
+    def __init__(self, *texts: str):
+        self.texts = frozenset(texts)
+
+    async def __call__(self, message: Message) -> bool:
+        return message.text in self.texts
+
+    def __str__(self) -> str:
+        return f"Button({', '.join(sorted(self.texts))})"
+
+
+class ButtonIndex:
+    """Exact and normalized button text → handler, built once from the included routers."""
+
+    def __init__(self, routers: Iterable[Router] = ()):
+        self.exact: Dict[str, HandlerObject] = {}
+        self.normalized: Dict[str, HandlerObject] = {}
+        for router in routers:
+            self.add_router(router)
+
+    def add_router(self, router: Router) -> None:
+        for r in router.chain_tail:
+            for handler in r.message.handlers:
+                if len(handler.filters or ()) != 1 or not isinstance(handler.filters[0].callback, Button):
+                    continue
+                for text in sorted(handler.filters[0].callback.texts):
+                    self.exact.setdefault(text, handler)
+                    self.normalized.setdefault(normalize_button(text), handler)
+
+    def resolve(self, text: Optional[str]) -> Optional[HandlerObject]:
+        if not text:
+            return None
+        return self.exact.get(text) or self.normalized.get(normalize_button(text))
+
+    def router(self) -> Router:
+        """Router with one message handler that runs the indexed handler for a stateless button press."""
+        router = Router(name="buttons")
+
+        async def match(message: Message, raw_state: Optional[str] = None) -> Any:
+            if raw_state is not None:
+                return False
+            handler = self.resolve(message.text)
+            return {"button_handler": handler} if handler is not None else False
+
+        async def dispatch(message: Message, button_handler: HandlerObject, **data: Any) -> Any:
+            data["handler"] = button_handler
+            return await button_handler.call(message, **data)
+
+        router.message.register(dispatch, match)
+        return router
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+
+__all__ = ["Button", "ButtonIndex", "normalize_button"]
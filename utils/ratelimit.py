@@ -0,0 +1,124 @@
+"""
+utils/ratelimit.py
+
+Asyncio rate limiters for outgoing Bot API calls.
+
+Telegram allows roughly 30 messages per second across all chats and about one
+message per second into the same chat; going faster only earns 429 errors.
+When one arrives anyway, BroadcastLimiter.on_retry_after pauses and slows down
+every sender sharing the limiter (see delivery.py).
+"""
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Global limiter: `rate` tokens per second, at most `capacity` saved up.
+    Waiters are served in arrival order.
+
+    The rate adapts between `min_rate` and the configured rate: slow_down()
+    cuts it multiplicatively, speed_up() wins it back additively, and pause()
+    stops every acquire() until Telegram's retry_after has passed.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: Optional[float] = None):
+        self.rate = self.max_rate = float(rate)
+        self.min_rate = float(min_rate if min_rate is not None else max(1.0, self.max_rate / 10))
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def wait_paused(self) -> None:
+        while True:
+            remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def slow_down(self, factor: float = 0.5) -> None:
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def speed_up(self, step: float) -> None:
+        self.rate = min(self.max_rate, self.rate + step)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            await self.wait_paused()
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatLimiter:
+    """
+    Per-chat limiter: consecutive calls to the same chat are at least `interval`
+    seconds apart, measured from the moment each call was let through (mark()).
+    Only chats touched within the last `interval` are remembered, so memory does
+    not grow with the number of recipients.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = float(interval)
+        self._next_allowed: "OrderedDict[int, float]" = OrderedDict()
+
+    def _forget_idle(self, now: float) -> None:
+        while self._next_allowed:
+            chat_id, allowed_at = next(iter(self._next_allowed.items()))
+            if allowed_at > now:
+                break
+            del self._next_allowed[chat_id]
+
+    async def wait(self, chat_id: int) -> None:
+        """Sleep until `chat_id` may receive the next call."""
+        now = time.monotonic()
+        self._forget_idle(now)
+        allowed_at = self._next_allowed.get(chat_id)
+        if allowed_at is not None and allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+    def mark(self, chat_id: int) -> None:
+        """Record that a call to `chat_id` is being made now."""
+        self._next_allowed.pop(chat_id, None)
+        self._next_allowed[chat_id] = time.monotonic() + self.interval
+
+
+class BroadcastLimiter:
+    """Both limits for one outgoing call: wait for the chat, then take a global token."""
+
+    def __init__(self, rate: float, per_chat_interval: float = 1.0):
+        # no saved-up burst: Telegram counts messages in a sliding second
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.chats = ChatLimiter(per_chat_interval)
+
+    async def acquire(self, chat_id: int) -> None:
+        await self.chats.wait(chat_id)
+        await self.bucket.acquire()
+        self.chats.mark(chat_id)
+
+    def on_retry_after(self, seconds: float) -> None:
+        """Telegram said 429: stop everyone for `seconds` and halve the rate."""
+        self.bucket.pause(seconds)
+        self.bucket.slow_down()
+
+    def on_success(self) -> None:
+        """Win the rate back gradually: the full rate returns after ~100 clean calls."""
+        self.bucket.speed_up(self.bucket.max_rate / 100)
+
+
+__all__ = ["TokenBucket", "ChatLimiter", "BroadcastLimiter"]
@@ -0,0 +1,103 @@
+"""
+webhook.py
+
+Webhook serving mode (config.BOT_MODE = "webhook"): an aiohttp server that
+Telegram POSTs updates to, instead of the bot long-polling getUpdates. It
+uses the same Dispatcher, so routers and middlewares registered for polling
+(register_all_handlers, setup_middlewares, ...) apply unchanged.
+
+- Every request must carry WEBHOOK_SECRET in X-Telegram-Bot-Api-Secret-Token
+  (set on the webhook by start_webhook); anything else gets 401.
+- Updates are acknowledged right away and handled in the background, at
+  most WEBHOOK_MAX_CONCURRENT at a time. When all slots are busy the next
+  request is held open until one frees up, so Telegram (which keeps at most
+  WEBHOOK_MAX_CONNECTIONS requests in flight) slows down instead of updates
+  piling up in memory.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT,
+    WEBHOOK_MAX_CONCURRENT, WEBHOOK_MAX_CONNECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = WEBHOOK_SECRET,
+                 max_concurrent: int = WEBHOOK_MAX_CONCURRENT, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._feed(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await self._background_feed_update(bot=bot, update=update)
+        except Exception:
+            logger.exception("Update %s failed", update.get("update_id"))
+        finally:
+            self._slots.release()
+
+    async def close(self) -> None:
+        """
+        Let in-flight updates finish. The bot session stays open: the
+        dispatcher's shutdown hooks run after this and may still send; the
+        caller closes it (as main.py does after polling).
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: Optional[str] = WEBHOOK_SECRET,
+              max_concurrent: int = WEBHOOK_MAX_CONCURRENT) -> web.Application:
+    """aiohttp app serving `path`; its startup/shutdown run the dispatcher's startup/shutdown hooks."""
+    app = web.Application()
+    BoundedRequestHandler(dp, bot, secret_token=secret, max_concurrent=max_concurrent).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def start_webhook(dp: Dispatcher, bot: Bot, base_url: str = WEBHOOK_URL, path: str = WEBHOOK_PATH,
+                        secret: Optional[str] = WEBHOOK_SECRET, host: str = WEBAPP_HOST, port: int = WEBAPP_PORT,
+                        max_concurrent: int = WEBHOOK_MAX_CONCURRENT) -> web.AppRunner:
+    """Start serving, then point Telegram at base_url + path. Stop with `await runner.cleanup()`."""
+    if not base_url:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_URL (the public https address of this server)")
+    runner = web.AppRunner(build_app(dp, bot, path, secret, max_concurrent))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await bot.set_webhook(
+        base_url.rstrip("/") + path,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info("Webhook server on %s:%s, Telegram posts to %s%s", host, port, base_url, path)
+    return runner
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **kwargs: Any) -> None:
+    """Serve updates until cancelled (the webhook-mode counterpart of dp.start_polling)."""
+    runner = await start_webhook(dp, bot, **kwargs)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+__all__ = ["BoundedRequestHandler", "build_app", "start_webhook", "run_webhook"]